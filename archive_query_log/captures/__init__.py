@@ -1,112 +1,419 @@
+from asyncio import (
+    CancelledError,
+    Queue,
+    Semaphore,
+    TaskGroup,
+    create_task,
+    gather,
+    to_thread,
+)
+from contextlib import suppress
+from dataclasses import dataclass
 from datetime import timedelta, datetime
-from itertools import chain
-from typing import Iterable, Iterator, Callable
+from functools import cached_property
+from itertools import batched, chain
+from typing import AsyncIterator, Hashable, Iterable, Iterator, Callable, Literal
 from urllib.parse import urljoin
 from uuid import uuid5, UUID
 from warnings import warn
 
+from aiohttp import ClientResponseError, ClientSession, ClientTimeout
 from elasticsearch_dsl import Search
 from elasticsearch_dsl.function import RandomScore
 from elasticsearch_dsl.query import FunctionScore, RankFeature, Term, Range, Exists
-from pydantic import HttpUrl
-from requests import ConnectTimeout, HTTPError, Response
+from pydantic import HttpUrl, TypeAdapter
 from tqdm.auto import tqdm
 from web_archive_api.cdx import CdxApi, CdxMatchType, CdxCapture
 
+from archive_query_log.captures.cdx import (
+    AsyncCdxApi,
+    CDX_TIMEOUT_ERRORS,
+    HostLimiter,
+)
+from archive_query_log.captures.filters import get_capture_filter
 from archive_query_log.config import Config
-from archive_query_log.namespaces import NAMESPACE_CAPTURE
+from archive_query_log.namespaces import NAMESPACE_CAPTURE, NAMESPACE_SOURCE
 from archive_query_log.orm import (
+    CdxCheckpoint,
     Source,
+    SourceShard,
     Capture,
     InnerParser,
     WebSearchResultBlock,
     InnerCapture,
+    Integer,
 )
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import METRICS, count_documents
+from archive_query_log.utils.parallel import prefetch, prefetch_async
+from archive_query_log.utils.scheduler import get_scheduler
 from archive_query_log.utils.time import utc_now, UTC
 
 
 REFETCH_DELTA = timedelta(weeks=4)
 
 
-def _iter_captures(
-    config: Config,
+def _check_url_length(url: str) -> bool:
+    if len(url) > 32766:
+        warn(
+            RuntimeWarning(
+                f"The URL {url} exceeds the "
+                f"maximum length of Elasticsearch."
+                f" It will be skipped."
+            )
+        )
+        return False
+    return True
+
+
+def _capture_id(cdx_api_url: str, url: str, utc_timestamp_text: str) -> UUID:
+    capture_id_components = (
+        cdx_api_url,
+        url,
+        utc_timestamp_text,
+    )
+    return uuid5(
+        NAMESPACE_CAPTURE,
+        ":".join(capture_id_components),
+    )
+
+
+def create_capture(
     source: Source,
-) -> Iterator[Capture]:
-    cdx_api = CdxApi(
-        api_url=source.archive.cdx_api_url.encoded_string(),
-        session=config.http.session,
+    cdx_capture: CdxCapture,
+) -> Capture | None:
+    if not _check_url_length(cdx_capture.url):
+        return None
+
+    capture_utc_timestamp_text = cdx_capture.timestamp.astimezone(UTC).strftime(
+        "%Y%m%d%H%M%S"
     )
-    url = f"https://{source.provider.domain}"
-    url = urljoin(url, source.provider.url_path_prefix)
-    url = url.removeprefix("https://")
-    cdx_captures = cdx_api.iter_captures(
-        url=url,
-        match_type=CdxMatchType.PREFIX,
-        # If the source was not fetched before, fetch all captures.
-        # Otherwise, only fetch new captures captured since the last fetch.
-        from_timestamp=source.last_fetched_captures
-        if not source.should_fetch_captures
+    capture_id = _capture_id(
+        source.archive.cdx_api_url.encoded_string(),
+        cdx_capture.url,
+        capture_utc_timestamp_text,
+    )
+    return Capture(
+        id=capture_id,
+        last_modified=utc_now(),
+        archive=source.archive,
+        provider=source.provider,
+        url=HttpUrl(cdx_capture.url),
+        url_key=cdx_capture.url_key,
+        timestamp=cdx_capture.timestamp.astimezone(UTC),
+        status_code=cdx_capture.status_code,
+        digest=cdx_capture.digest,
+        mimetype=cdx_capture.mimetype,
+        filename=cdx_capture.filename,
+        offset=cdx_capture.offset,
+        length=cdx_capture.length,
+        access=cdx_capture.access,
+        redirect_url=HttpUrl(cdx_capture.redirect_url)
+        if cdx_capture.redirect_url is not None
         else None,
+        flags=(
+            [flag.value for flag in cdx_capture.flags]
+            if cdx_capture.flags is not None
+            else None
+        ),
+        collection=cdx_capture.collection,
+        source=cdx_capture.source,
+        source_collection=cdx_capture.source_collection,
+        url_query_parser=InnerParser(
+            should_parse=True,
+        ),
     )
-    for cdx_capture in cdx_captures:
-        if len(cdx_capture.url) > 32766:
-            warn(
-                RuntimeWarning(
-                    f"The URL {cdx_capture.url} exceeds the "
-                    f"maximum length of Elasticsearch."
-                    f" It will be skipped."
-                )
-            )
-            continue
 
-        capture_utc_timestamp_text = cdx_capture.timestamp.astimezone(UTC).strftime(
-            "%Y%m%d%H%M%S"
-        )
-        capture_id_components = (
-            source.archive.cdx_api_url.encoded_string(),
-            cdx_capture.url,
-            capture_utc_timestamp_text,
-        )
-        capture_id = uuid5(
-            NAMESPACE_CAPTURE,
-            ":".join(capture_id_components),
-        )
-        yield Capture(
-            id=capture_id,
-            last_modified=utc_now(),
-            archive=source.archive,
-            provider=source.provider,
-            url=HttpUrl(cdx_capture.url),
-            url_key=cdx_capture.url_key,
-            timestamp=cdx_capture.timestamp.astimezone(UTC),
-            status_code=cdx_capture.status_code,
-            digest=cdx_capture.digest,
-            mimetype=cdx_capture.mimetype,
-            filename=cdx_capture.filename,
-            offset=cdx_capture.offset,
-            length=cdx_capture.length,
-            access=cdx_capture.access,
-            redirect_url=HttpUrl(cdx_capture.redirect_url)
+
+# Validate integers like the integer fields of documents.
+_INTEGER: TypeAdapter[int | None] = TypeAdapter(Integer | None)
+
+
+def _format_date(timestamp: datetime) -> str:
+    # Like the JSON serialization of dates in documents.
+    return timestamp.astimezone(UTC).isoformat().replace("+00:00", "Z")
+
+
+@dataclass(frozen=True)
+class CaptureActions:
+    """
+    Build the create actions for captures of a source directly from the CDX
+    fields. The actions are the same as from `create_capture()` and then
+    `create_action()`, but without constructing, validating, and serializing
+    a `Capture` per CDX row. URLs are still validated and normalized.
+    """
+
+    source: Source
+    index: str
+
+    @cached_property
+    def _cdx_api_url(self) -> str:
+        return self.source.archive.cdx_api_url.encoded_string()
+
+    @cached_property
+    def _memento_api_url(self) -> str:
+        return str(self.source.archive.memento_api_url)
+
+    @cached_property
+    def _archive(self) -> dict:
+        return self.source.archive.to_dict()
+
+    @cached_property
+    def _provider(self) -> dict:
+        return self.source.provider.to_dict()
+
+    def create_action(
+        self,
+        cdx_capture: CdxCapture,
+        last_modified: datetime,
+    ) -> dict | None:
+        if not _check_url_length(cdx_capture.url):
+            return None
+        url = str(HttpUrl(cdx_capture.url))
+        timestamp = cdx_capture.timestamp.astimezone(UTC)
+        timestamp_text = timestamp.strftime("%Y%m%d%H%M%S")
+        return {
+            "_op_type": "create",
+            "_index": self.index,
+            "_id": str(_capture_id(self._cdx_api_url, cdx_capture.url, timestamp_text)),
+            "last_modified": _format_date(last_modified),
+            "archive": self._archive,
+            "provider": self._provider,
+            "url": url,
+            "url_key": cdx_capture.url_key,
+            "timestamp": _format_date(timestamp),
+            "status_code": _INTEGER.validate_python(cdx_capture.status_code),
+            "digest": cdx_capture.digest,
+            "mimetype": cdx_capture.mimetype,
+            "filename": cdx_capture.filename,
+            "offset": _INTEGER.validate_python(cdx_capture.offset),
+            "length": _INTEGER.validate_python(cdx_capture.length),
+            "access": cdx_capture.access,
+            "redirect_url": str(HttpUrl(cdx_capture.redirect_url))
             if cdx_capture.redirect_url is not None
             else None,
-            flags=(
+            "flags": (
                 [flag.value for flag in cdx_capture.flags]
                 if cdx_capture.flags is not None
                 else None
             ),
-            collection=cdx_capture.collection,
-            source=cdx_capture.source,
-            source_collection=cdx_capture.source_collection,
-            url_query_parser=InnerParser(
-                should_parse=True,
+            "collection": cdx_capture.collection,
+            "source": cdx_capture.source,
+            "source_collection": cdx_capture.source_collection,
+            "url_query_parser": {"should_parse": True},
+            "memento_url": str(
+                HttpUrl(f"{self._memento_api_url}/{timestamp_text}/{url}")
             ),
+        }
+
+
+def _source_url(source: Source) -> str:
+    url = f"https://{source.provider.domain}"
+    url = urljoin(url, source.provider.url_path_prefix)
+    return url.removeprefix("https://")
+
+
+async def _iter_captures(
+    cdx_api: AsyncCdxApi,
+    capture_actions: CaptureActions,
+    checkpoint: CdxCheckpoint,
+) -> AsyncIterator[tuple[list[dict], CdxCheckpoint | None]]:
+    """
+    Iterate over the capture create actions of a source, page by page, each
+    with the checkpoint to resume from after the page (if there are more pages).
+    """
+    source = capture_actions.source
+    capture_filter = get_capture_filter(source)
+    cdx_pages = cdx_api.iter_pages(
+        url=_source_url(source),
+        match_type=CdxMatchType.PREFIX,
+        from_timestamp=checkpoint.from_timestamp,
+        to_timestamp=checkpoint.to_timestamp,
+        page=checkpoint.page if checkpoint.page is not None else 0,
+        resume_key=checkpoint.resume_key,
+        filters=capture_filter.cdx_filters,
+        collapse=capture_filter.cdx_collapse,
+    )
+    last_collapse_key: Hashable | None = None
+    async for cdx_page in cdx_pages:
+        last_modified = utc_now()
+        actions: list[dict] = []
+        for cdx_capture in cdx_page.captures:
+            # Filter and collapse again, in case the API ignored the parameters.
+            if not capture_filter.matches(cdx_capture):
+                continue
+            collapse_key = capture_filter.collapse_key(cdx_capture)
+            if collapse_key is not None and collapse_key == last_collapse_key:
+                continue
+            last_collapse_key = collapse_key
+            action = capture_actions.create_action(cdx_capture, last_modified)
+            if action is not None:
+                actions.append(action)
+        next_checkpoint: CdxCheckpoint | None = None
+        if cdx_page.page is not None:
+            next_checkpoint = checkpoint.model_copy(
+                update={"page": cdx_page.page + 1, "resume_key": None}
+            )
+        elif cdx_page.resume_key is not None:
+            next_checkpoint = checkpoint.model_copy(
+                update={"page": None, "resume_key": cdx_page.resume_key}
+            )
+        yield actions, next_checkpoint
+
+
+# Maximum number of document IDs to look up at once.
+_EXISTING_BATCH_SIZE = 1000
+
+
+async def _filter_existing(
+    config: Config,
+    index: str,
+    actions: list[dict],
+) -> list[dict]:
+    """
+    Drop the create actions of documents that are already indexed, e.g., by an
+    earlier fetch that was interrupted or overlapped, as they would conflict.
+    """
+    existing_ids: set[str] = set()
+    for batch in batched(actions, _EXISTING_BATCH_SIZE):
+        # The synchronous client is thread-safe and its requests are timed.
+        response = await to_thread(
+            config.es.client.mget,
+            index=index,
+            body={"ids": [action["_id"] for action in batch]},
+            _source=False,
+        )
+        existing_ids.update(doc["_id"] for doc in response["docs"] if doc["found"])
+    if len(existing_ids) == 0:
+        return actions
+    METRICS.count("fetch_captures_existing", len(existing_ids))
+    return [action for action in actions if action["_id"] not in existing_ids]
+
+
+# Start of the first time range shard, when web archiving started.
+_SHARDS_START = datetime(1996, 1, 1, tzinfo=UTC)
+
+
+def _next_period(timestamp: datetime, period: Literal["year", "month"]) -> datetime:
+    if period == "month" and timestamp.month < 12:
+        return timestamp.replace(month=timestamp.month + 1)
+    elif period == "month":
+        return timestamp.replace(year=timestamp.year + 1, month=1)
+    else:
+        return timestamp.replace(year=timestamp.year + 1)
+
+
+def _iter_time_ranges(
+    to_timestamp: datetime,
+    period: Literal["year", "month"],
+) -> Iterator[tuple[datetime | None, datetime]]:
+    # The first range also includes any earlier captures.
+    from_timestamp: datetime | None = None
+    boundary = _SHARDS_START
+    while True:
+        boundary = _next_period(boundary, period)
+        if boundary > to_timestamp:
+            yield from_timestamp, to_timestamp
+            return
+        # The CDX time range is inclusive, so end one second before the next.
+        yield from_timestamp, boundary - timedelta(seconds=1)
+        from_timestamp = boundary
+
+
+def _shard_source(
+    source: Source,
+    from_timestamp: datetime | None,
+    to_timestamp: datetime,
+    index: str,
+) -> Source:
+    shard_id_components = (
+        str(source.id),
+        from_timestamp.astimezone(UTC).strftime("%Y%m%d%H%M%S")
+        if from_timestamp is not None
+        else "",
+        to_timestamp.astimezone(UTC).strftime("%Y%m%d%H%M%S"),
+    )
+    return Source(
+        id=uuid5(NAMESPACE_SOURCE, ":".join(shard_id_components)),
+        index=index,
+        last_modified=utc_now(),
+        archive=source.archive,
+        provider=source.provider,
+        should_fetch_captures=True,
+        shard=SourceShard(
+            source_id=source.id,
+            from_timestamp=from_timestamp,
+            to_timestamp=to_timestamp,
+        ),
+    )
+
+
+async def _shard_source_actions(
+    config: Config,
+    cdx_api: AsyncCdxApi,
+    source: Source,
+    to_timestamp: datetime,
+) -> list[dict] | None:
+    """
+    Split a large source into time range shards, if the CDX API reports enough
+    pages of captures. The shards are then fetched as separate sources, so that
+    they can be fetched in parallel and retried on their own.
+    """
+    if config.http.cdx_shard_min_pages is None:
+        return None
+    url = _source_url(source)
+    capture_filter = get_capture_filter(source)
+    num_pages = await cdx_api.num_pages(
+        url=url,
+        match_type=CdxMatchType.PREFIX,
+        to_timestamp=to_timestamp,
+        filters=capture_filter.cdx_filters,
+        collapse=capture_filter.cdx_collapse,
+    )
+    if num_pages is None or num_pages < config.http.cdx_shard_min_pages:
+        return None
+    time_ranges = list(_iter_time_ranges(to_timestamp, config.http.cdx_shard_period))
+    time_ranges_num_pages = await gather(
+        *(
+            cdx_api.num_pages(
+                url=url,
+                match_type=CdxMatchType.PREFIX,
+                from_timestamp=from_timestamp,
+                to_timestamp=shard_to_timestamp,
+                filters=capture_filter.cdx_filters,
+                collapse=capture_filter.cdx_collapse,
+            )
+            for from_timestamp, shard_to_timestamp in time_ranges
         )
+    )
+    # Skip time ranges without captures.
+    actions = [
+        _shard_source(
+            source, from_timestamp, shard_to_timestamp, config.es.index_sources
+        ).create_action()
+        for (from_timestamp, shard_to_timestamp), time_range_num_pages in zip(
+            time_ranges, time_ranges_num_pages
+        )
+        if time_range_num_pages != 0
+    ]
+    actions = await _filter_existing(config, config.es.index_sources, actions)
+    # The shards' captures are fetched with the shards.
+    actions.append(
+        source.update_action(
+            should_fetch_captures=False,
+            last_fetched_captures=to_timestamp,
+            fetch_captures_checkpoint=None,
+        )
+    )
+    return actions
 
 
-def _add_captures_actions(
+async def _add_captures_actions(
     config: Config,
+    cdx_api: AsyncCdxApi,
     source: Source,
-) -> Iterator[dict]:
+) -> AsyncIterator[list[dict]]:
     # Re-check if fetching captures is necessary.
     if (
         source.should_fetch_captures is not None
@@ -114,61 +421,166 @@ def _add_captures_actions(
         and (
             source.last_fetched_captures is None
             or source.last_fetched_captures >= utc_now() - REFETCH_DELTA
+            # Shards are only fetched once, for their time range.
+            or source.shard is not None
         )
     ):
         return
 
-    captures_iter = _iter_captures(config, source)
+    # Resume an interrupted fetch, or start a new one.
+    checkpoint = source.fetch_captures_checkpoint
+    should_shard = False
+    if checkpoint is None and source.shard is not None:
+        checkpoint = CdxCheckpoint(
+            from_timestamp=source.shard.from_timestamp,
+            to_timestamp=source.shard.to_timestamp,
+        )
+    elif checkpoint is None:
+        checkpoint = CdxCheckpoint(
+            # If the source was not fetched before, fetch all captures.
+            # Otherwise, only fetch new captures captured since the last fetch.
+            from_timestamp=source.last_fetched_captures
+            if not source.should_fetch_captures
+            else None,
+            to_timestamp=utc_now(),
+        )
+        # Only full fetches of all captures are split into shards.
+        should_shard = checkpoint.from_timestamp is None
+
+    capture_actions = CaptureActions(source=source, index=config.es.index_captures)
     try:
-        for capture in captures_iter:
-            capture.meta.index = config.es.index_captures
-            yield capture.create_action()
-    except ConnectTimeout as e:
+        if should_shard:
+            shard_actions = await _shard_source_actions(
+                config, cdx_api, source, checkpoint.to_timestamp
+            )
+            if shard_actions is not None:
+                yield shard_actions
+                return
+        async for actions, next_checkpoint in _iter_captures(
+            cdx_api, capture_actions, checkpoint
+        ):
+            actions = await _filter_existing(config, config.es.index_captures, actions)
+            if next_checkpoint is not None:
+                # Written after the page's captures, see `_bulk_pages`.
+                actions.append(
+                    source.update_action(fetch_captures_checkpoint=next_checkpoint)
+                )
+            yield actions
+    except CDX_TIMEOUT_ERRORS as e:
         # The archives' CDX are usually very slow, so we expect timeouts.
         # Rather than failing, we just warn and continue with the next source.
-        # But we do not mark this source as fetched, so that we try again.
+        # But we do not mark this source as fetched, so that we try again,
+        # starting from the last checkpoint, once the source's claim expires.
         warn(
             RuntimeWarning(
                 f"Connection timeout while fetching captures "
-                f"for source {source.id}: {e}"
+                f"for source {source.id}: {e!r}"
             )
         )
         return
-    except HTTPError as e:
-        ignored = False
-        response: Response = e.response
-        if response.status_code == 403:
-            warn(
-                RuntimeWarning(
-                    f"Unauthorized to fetch captures for source "
-                    f"domain {source.provider.domain} and "
-                    f"URL prefix {source.provider.url_path_prefix}."
-                )
-            )
-            ignored = True
-        if not ignored:
+    except ClientResponseError as e:
+        if e.status != 403:
             raise e
+        warn(
+            RuntimeWarning(
+                f"Unauthorized to fetch captures for source "
+                f"domain {source.provider.domain} and "
+                f"URL prefix {source.provider.url_path_prefix}."
+            )
+        )
 
-    yield source.update_action(
-        should_fetch_captures=False,
-        last_fetched_captures=utc_now(),
+    yield [
+        source.update_action(
+            should_fetch_captures=False,
+            last_fetched_captures=checkpoint.to_timestamp,
+            fetch_captures_checkpoint=None,
+        )
+    ]
+
+
+async def _iter_captures_actions(
+    config: Config,
+    sources: Iterable[Source],
+) -> AsyncIterator[list[dict]]:
+    """
+    Fetch the captures of many sources concurrently, and yield the actions of
+    each CDX page as soon as it arrives, so that slow archives do not hold up
+    the sources of other archives.
+    """
+    limiter = HostLimiter(
+        max_concurrency=config.http.cdx_host_concurrency,
+        min_interval=config.http.cdx_host_interval,
     )
+    pages: Queue[list[dict] | None] = Queue(maxsize=config.http.cdx_concurrency)
+    slots = Semaphore(config.http.cdx_concurrency)
+    async with ClientSession(
+        headers={"User-Agent": config.http.user_agent},
+        # CDX APIs may take long to respond, but should not stall forever.
+        timeout=ClientTimeout(total=None, sock_connect=60, sock_read=300),
+    ) as session:
+
+        async def _fetch(source: Source) -> None:
+            cdx_api = AsyncCdxApi(
+                api_url=source.archive.cdx_api_url.encoded_string(),
+                session=session,
+                limiter=limiter,
+                max_retries=config.http.max_retries,
+            )
+            try:
+                async for actions in _add_captures_actions(config, cdx_api, source):
+                    await pages.put(actions)
+            finally:
+                slots.release()
+
+        async def _next_source(iterator: Iterator[Source]) -> Source | None:
+            # Selecting and claiming sources blocks, so do not block the loop.
+            return await to_thread(next, iterator, None)
+
+        async def _fetch_all() -> None:
+            iterator = iter(sources)
+            try:
+                async with TaskGroup() as task_group:
+                    while (source := await _next_source(iterator)) is not None:
+                        await slots.acquire()
+                        task_group.create_task(_fetch(source))
+            except ExceptionGroup as errors:
+                # The other fetches were cancelled, re-raise the first error.
+                await pages.put(None)
+                raise errors.exceptions[0]
+            await pages.put(None)
+
+        fetch_all = create_task(_fetch_all())
+        try:
+            while (actions := await pages.get()) is not None:
+                yield actions
+            # Re-raise errors of fetching.
+            await fetch_all
+        finally:
+            # Cancel pending fetches if the consumer stopped early.
+            if not fetch_all.done():
+                fetch_all.cancel()
+                with suppress(CancelledError):
+                    await fetch_all
 
 
 def fetch_captures(
     config: Config,
     size: int = 10,
     dry_run: bool = False,
-) -> None:
+) -> int:
     changed_sources_search: Search = (
         Source.search(using=config.es.client, index=config.es.index_sources)
         .filter(
             (
                 ~Term(should_fetch_captures=False)
-                | Range(
-                    last_fetched_captures={
-                        "lt": utc_now() - REFETCH_DELTA,
-                    }
+                | (
+                    Range(
+                        last_fetched_captures={
+                            "lt": utc_now() - REFETCH_DELTA,
+                        }
+                    )
+                    # Shards are only fetched once, for their time range.
+                    & ~Exists(field="shard")
                 )
             )
             # FIXME: The UK Web Archive is facing an outage: https://www.webarchive.org.uk/#en
@@ -180,28 +592,49 @@ def fetch_captures(
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_sources = changed_sources_search.count()
-    if num_changed_sources == 0:
+    changed_sources: Iterable[Source]
+    num_changed_sources, changed_sources = select_documents(
+        changed_sources_search,
+        size=size,
+        partition=config.partition,
+        claim_field="captures_fetcher",
+        dry_run=dry_run,
+        scheduler=get_scheduler(config.schedule, "fetch_captures"),
+    )
+    if num_changed_sources <= 0:
         print("No new/changed sources.")
-        return
-
-    changed_sources: Iterable[Source] = changed_sources_search.params(
-        size=size
-    ).execute()
+        return 0
 
     changed_sources = tqdm(
-        changed_sources,
+        count_documents("fetch_captures", until_stopped(changed_sources)),
         total=num_changed_sources,
         desc="Fetching captures",
         unit="source",
     )
-    actions = chain.from_iterable(
-        _add_captures_actions(config, source) for source in changed_sources
-    )
-    config.es.bulk(
-        actions=actions,
+    _bulk_pages(
+        config=config,
+        pages=prefetch_async(_iter_captures_actions(config, changed_sources)),
         dry_run=dry_run,
     )
+    return num_changed_sources
+
+
+def _bulk_pages(
+    config: Config,
+    pages: Iterable[list[dict]],
+    dry_run: bool = False,
+) -> None:
+    # Source updates (e.g., checkpoints) must not be written before the page's
+    # creates. A single bulk stream keeps the order of the actions. Otherwise,
+    # write the creates of each page before its updates.
+    if config.es.bulk_concurrency <= 1:
+        config.es.bulk(actions=chain.from_iterable(pages), dry_run=dry_run)
+        return
+    for actions in pages:
+        creates = [action for action in actions if action["_op_type"] == "create"]
+        updates = [action for action in actions if action["_op_type"] != "create"]
+        config.es.bulk(actions=creates, dry_run=dry_run)
+        config.es.bulk(actions=updates, dry_run=dry_run)
 
 
 def _capture_timestamp_distance(timestamp: datetime) -> Callable[[CdxCapture], float]:
@@ -272,7 +705,7 @@ def fetch_web_search_result_block_captures(
     config: Config,
     size: int = 10,
     dry_run: bool = False,
-) -> None:
+) -> int:
     changed_result_blocks_search: Search = (
         WebSearchResultBlock.search(
             using=config.es.client, index=config.es.index_web_search_result_blocks
@@ -284,32 +717,39 @@ def fetch_web_search_result_block_captures(
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_result_blocks = changed_result_blocks_search.count()
-
+    changed_result_blocks: Iterable[WebSearchResultBlock]
+    num_changed_result_blocks, changed_result_blocks = select_documents(
+        changed_result_blocks_search,
+        size=size,
+        partition=config.partition,
+        scheduler=get_scheduler(
+            config.schedule, "fetch_web_search_result_block_captures"
+        ),
+    )
     if num_changed_result_blocks <= 0:
         print("No new/changed web search result blocks.")
-        return
-
-    changed_result_blocks: Iterable[WebSearchResultBlock] = (
-        changed_result_blocks_search.params(size=size).execute()
-    )
+        return 0
 
     changed_result_blocks = tqdm(
-        changed_result_blocks,
+        count_documents(
+            "fetch_web_search_result_block_captures",
+            until_stopped(changed_result_blocks),
+        ),
         total=num_changed_result_blocks,
         desc="Fetch captures",
         unit="web search result block",
     )
 
-    actions = (
+    actions = prefetch(
         _update_web_search_result_block_capture_action(
             config=config,
             result_block=web_search_result_block,
         )
-        for web_search_result_block in changed_result_blocks
+        for web_search_result_block in prefetch(changed_result_blocks)
         if web_search_result_block.url is not None
     )
     config.es.bulk(
         actions=actions,
         dry_run=dry_run,
     )
+    return num_changed_result_blocks
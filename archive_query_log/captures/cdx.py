@@ -0,0 +1,339 @@
+from asyncio import (
+    Semaphore,
+    TimeoutError as AsyncTimeoutError,
+    get_running_loop,
+    sleep,
+)
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from json import JSONDecodeError, loads
+from typing import Any, AsyncIterator, Sequence
+from urllib.parse import urlsplit
+from warnings import warn
+
+from aiohttp import ClientConnectionError, ClientResponseError, ClientSession
+from web_archive_api.cdx import CdxCapture, CdxFlag, CdxMatchType
+
+from archive_query_log.utils.metrics import timed
+
+# Status codes on which to retry a CDX request, like the synchronous session.
+_RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+@dataclass
+class HostLimiter:
+    """
+    Limit the concurrent requests and the request rate per host.
+    """
+
+    max_concurrency: int = 1
+    min_interval: float = 0
+    _semaphores: dict[str, Semaphore] = field(default_factory=dict, init=False)
+    _next_request: dict[str, float] = field(default_factory=dict, init=False)
+
+    @asynccontextmanager
+    async def limit(self, host: str) -> AsyncIterator[None]:
+        if host not in self._semaphores:
+            self._semaphores[host] = Semaphore(self.max_concurrency)
+        async with self._semaphores[host]:
+            # Reserve the next free time slot of the host.
+            now = get_running_loop().time()
+            start = max(now, self._next_request.get(host, now))
+            self._next_request[host] = start + self.min_interval
+            await sleep(start - now)
+            yield
+
+
+# The Internet Archive's cdx11 fields and pywb's extended fields.
+CDX_FIELDS: Sequence[str] = (
+    "urlkey",
+    "timestamp",
+    "original",
+    "mimetype",
+    "statuscode",
+    "digest",
+    "redirect",
+    "robotflags",
+    "length",
+    "offset",
+    "filename",
+    "access",
+    "collection",
+    "source",
+    "source-coll",
+)
+
+
+@dataclass(frozen=True)
+class CdxPage:
+    captures: Sequence[CdxCapture]
+    # Number of the page, if the API paginates by page numbers.
+    page: int | None = None
+    # Key to request the next page with, if the API paginates by resume keys.
+    resume_key: str | None = None
+
+
+def _pop(line: dict[str, Any], *keys: str) -> Any:
+    values = [line.pop(key) for key in keys if key in line]
+    return values[0] if len(values) > 0 else None
+
+
+def _pop_int(line: dict[str, Any], *keys: str) -> int | None:
+    value = _pop(line, *keys)
+    return int(value) if value is not None and value.isnumeric() else None
+
+
+def _parse_cdx_flags(flags: str) -> set[CdxFlag]:
+    flags_by_value = {flag.value: flag for flag in CdxFlag}
+    parsed_flags: set[CdxFlag] = set()
+    for flag in flags.split():
+        if flag in flags_by_value:
+            parsed_flags.add(flags_by_value[flag])
+        else:
+            warn(RuntimeWarning(f"Unrecognized CDX flag: {flag}"))
+    return parsed_flags
+
+
+def parse_cdx_line(line: dict[str, Any]) -> CdxCapture:
+    """
+    Parse a CDX line given as a JSON object, with the field names of either
+    the Internet Archive's or pywb's CDX API.
+    """
+    # Missing values are given as "-".
+    line = {key: value for key, value in line.items() if value != "-"}
+    url_key = _pop(line, "urlkey")
+    timestamp = _pop(line, "timestamp")
+    url = _pop(line, "url", "original")
+    digest = _pop(line, "digest")
+    if url_key is None or timestamp is None or url is None or digest is None:
+        raise ValueError(f"Missing URL key, timestamp, URL, or digest: {line}")
+    flags = _pop(line, "flags", "robotflags")
+    fuzzy = _pop_int(line, "is_fuzzy")
+    capture = CdxCapture(
+        url=url,
+        url_key=url_key,
+        # Important to add the UTC timezone explicitly.
+        timestamp=datetime.strptime(f"{timestamp}+0000", "%Y%m%d%H%M%S%z"),
+        digest=digest,
+        status_code=_pop_int(line, "statuscode", "status"),
+        mimetype=_pop(line, "mimetype", "mime", "mime-detected"),
+        filename=_pop(line, "filename"),
+        offset=_pop_int(line, "offset"),
+        length=_pop_int(line, "length"),
+        access=_pop(line, "access"),
+        redirect_url=_pop(line, "redirect"),
+        memento_raw_url=_pop(line, "load_url"),
+        flags=_parse_cdx_flags(flags) if flags is not None else None,
+        collection=_pop(line, "collection"),
+        source=_pop(line, "source"),
+        source_collection=_pop(line, "source-coll"),
+        metadata=_pop(line, "metadata"),
+        fuzzy=bool(fuzzy) if fuzzy is not None else None,
+    )
+    if len(line) > 0:
+        # Fail fast if any fields are left unparsed.
+        raise RuntimeError(f"Unparsed fields in CDX line: {line}")
+    return capture
+
+
+def _read_cdx_text(text: str) -> CdxPage:
+    lines = text.splitlines()
+    if len(lines) == 0:
+        return CdxPage(captures=[])
+    rows: list[Any]
+    try:
+        if lines[0].startswith("["):
+            # Internet Archive style JSON CDX: a header and rows of values.
+            rows = loads(text)
+        else:
+            rows = [loads(line) for line in lines if line.strip() != ""]
+    except JSONDecodeError as e:
+        raise RuntimeError(f"Failed to parse CDX response as JSON: {text}") from e
+    if len(rows) == 0:
+        return CdxPage(captures=[])
+    resume_key: str | None = None
+    if isinstance(rows[0], list):
+        if len(rows) >= 3 and rows[-2] == [] and len(rows[-1]) == 1:
+            resume_key = rows[-1][0]
+            rows = rows[:-2]
+        header = rows[0]
+        rows = [dict(zip(header, row)) for row in rows[1:]]
+    return CdxPage(
+        captures=[parse_cdx_line(row) for row in rows],
+        resume_key=resume_key,
+    )
+
+
+def _format_timestamp(timestamp: datetime) -> str:
+    return timestamp.astimezone(timezone.utc).strftime("%Y%m%d%H%M%S")
+
+
+def _params(
+    url: str,
+    match_type: CdxMatchType,
+    from_timestamp: datetime | None,
+    to_timestamp: datetime | None,
+) -> list[tuple[str, str]]:
+    params = [("url", url), ("output", "json"), ("matchType", match_type.value)]
+    if from_timestamp is not None:
+        params.append(("from", _format_timestamp(from_timestamp)))
+    if to_timestamp is not None:
+        params.append(("to", _format_timestamp(to_timestamp)))
+    return params
+
+
+@dataclass(frozen=True)
+class AsyncCdxApi:
+    """
+    Asynchronous client to list captures from a web archive's CDX API,
+    page by page, with the same pagination as `web_archive_api`'s `CdxApi`.
+    """
+
+    api_url: str
+    session: ClientSession
+    limiter: HostLimiter
+    max_retries: int = 5
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.api_url).hostname or ""
+
+    async def _get(
+        self,
+        params: Sequence[tuple[str, str]],
+        raise_for_status: bool = True,
+    ) -> str | None:
+        for attempt in range(self.max_retries + 1):
+            async with self.limiter.limit(self.host):
+                with timed("cdx", self.host):
+                    async with self.session.get(
+                        self.api_url, params=params
+                    ) as response:
+                        if (
+                            response.status in _RETRY_STATUS_CODES
+                            and attempt < self.max_retries
+                        ):
+                            pass
+                        elif response.status != 200 and not raise_for_status:
+                            return None
+                        else:
+                            response.raise_for_status()
+                            return await response.text()
+            # Back off before retrying, like the synchronous session.
+            await sleep(2**attempt)
+        raise RuntimeError("Unreachable.")
+
+    async def _get_page(
+        self,
+        params: Sequence[tuple[str, str]],
+        optional_params: list[tuple[str, str]],
+    ) -> tuple[str, list[tuple[str, str]]]:
+        # On unsupported parameters, omit the fields, then all optional ones.
+        fallbacks = [
+            [(key, value) for key, value in optional_params if key != "fl"],
+            [],
+        ]
+        for fallback in fallbacks:
+            if fallback == optional_params:
+                continue
+            try:
+                text = await self._get([*params, *optional_params])
+                return text or "", optional_params
+            except ClientResponseError as e:
+                if e.status != 400:
+                    raise
+            optional_params = fallback
+        return await self._get([*params, *optional_params]) or "", optional_params
+
+    async def num_pages(
+        self,
+        url: str,
+        match_type: CdxMatchType,
+        from_timestamp: datetime | None = None,
+        to_timestamp: datetime | None = None,
+        filters: Sequence[str] = (),
+        collapse: Sequence[str] = (),
+    ) -> int | None:
+        """
+        Get the number of pages of captures of a URL, if the API reports it.
+        Filters and collapse fields are omitted if the API rejects them.
+        """
+        params = _params(url, match_type, from_timestamp, to_timestamp)
+        params += [("limit", "1"), ("showNumPages", "true")]
+        optional_params = [("filter", cdx_filter) for cdx_filter in filters]
+        optional_params += [("collapse", field) for field in collapse]
+        num_pages_text = await self._get(
+            [*params, *optional_params],
+            raise_for_status=False,
+        )
+        if num_pages_text is None and len(optional_params) > 0:
+            num_pages_text = await self._get(params, raise_for_status=False)
+        if num_pages_text is None or num_pages_text.strip() == "":
+            return None
+        num_pages_text = num_pages_text.splitlines()[0]
+        if not num_pages_text.isnumeric():
+            return None
+        return int(num_pages_text)
+
+    async def iter_pages(
+        self,
+        url: str,
+        match_type: CdxMatchType,
+        from_timestamp: datetime | None = None,
+        to_timestamp: datetime | None = None,
+        page: int = 0,
+        resume_key: str | None = None,
+        fields: Sequence[str] | None = CDX_FIELDS,
+        filters: Sequence[str] = (),
+        collapse: Sequence[str] = (),
+    ) -> AsyncIterator[CdxPage]:
+        """
+        Iterate over the pages of captures of a URL, starting from the given
+        page or resume key, with the given fields, filters, and collapsing.
+        """
+        params = _params(url, match_type, from_timestamp, to_timestamp)
+
+        optional_params = [("filter", cdx_filter) for cdx_filter in filters]
+        optional_params += [("collapse", field) for field in collapse]
+        if fields is not None:
+            optional_params.append(("fl", ",".join(fields)))
+
+        # The number of pages is only available for some CDX API implementations.
+        num_pages: int | None = None
+        if resume_key is None:
+            num_pages = await self.num_pages(
+                url,
+                match_type,
+                from_timestamp,
+                to_timestamp,
+                filters=filters,
+                collapse=collapse,
+            )
+
+        if num_pages is not None:
+            for page_number in range(page, num_pages):
+                text, optional_params = await self._get_page(
+                    [*params, ("page", str(page_number))], optional_params
+                )
+                cdx_page = _read_cdx_text(text)
+                yield CdxPage(captures=cdx_page.captures, page=page_number)
+            return
+
+        # Otherwise, request the full list and follow the resume keys.
+        while True:
+            resume_params = (
+                [("resumeKey", resume_key)] if resume_key is not None else []
+            )
+            text, optional_params = await self._get_page(
+                [*params, *resume_params, ("showResumeKey", "true")], optional_params
+            )
+            cdx_page = _read_cdx_text(text)
+            yield cdx_page
+            if cdx_page.resume_key is None:
+                return
+            resume_key = cdx_page.resume_key
+
+
+# Errors after which the next attempt to fetch from a CDX API may succeed.
+CDX_TIMEOUT_ERRORS = (AsyncTimeoutError, ClientConnectionError)
@@ -0,0 +1,121 @@
+from datetime import datetime
+from re import escape
+from typing import Hashable, Literal, Pattern, Sequence, TypeAlias
+from uuid import UUID
+
+from pydantic import BaseModel
+from web_archive_api.cdx import CdxCapture
+
+from archive_query_log.orm import Source
+
+
+CollapsePeriod: TypeAlias = Literal["hour", "day", "week", "month", "year"]
+
+
+def _period(timestamp: datetime, period: CollapsePeriod) -> Hashable:
+    if period == "hour":
+        return timestamp.date(), timestamp.hour
+    elif period == "day":
+        return timestamp.date()
+    elif period == "week":
+        return timestamp.isocalendar()[:2]
+    elif period == "month":
+        return timestamp.year, timestamp.month
+    else:
+        return timestamp.year
+
+
+class CaptureFilter(BaseModel):
+    """
+    Which captures to fetch for the sources of a provider and/or archive.
+
+    The filter is pushed down into the CDX query, and is also applied to the
+    returned captures, for archives that ignore or do not support CDX filters.
+
+    Consecutive captures of the same URL can be collapsed to the first one with
+    the same digest and/or within the same period (e.g., one capture per day).
+    Collapsing by digest is pushed down into the CDX query, too. Collapsing by
+    period is not, as CDX APIs collapse by timestamp across different URLs.
+    """
+
+    provider_id: UUID | None = None
+    archive_id: UUID | None = None
+    status_codes: Sequence[int] | None = None
+    mimetypes: Sequence[str] | None = None
+    url_key_pattern: Pattern | None = None
+    collapse_digest: bool = False
+    collapse_period: CollapsePeriod | None = None
+
+    def is_applicable(self, source: Source) -> bool:
+        return (
+            self.provider_id is None or self.provider_id == source.provider.id
+        ) and (self.archive_id is None or self.archive_id == source.archive.id)
+
+    @property
+    def cdx_filters(self) -> Sequence[str]:
+        # Filters match the whole field by a regular expression.
+        filters: list[str] = []
+        if self.status_codes is not None:
+            filters.append(
+                "statuscode:" + "|".join(str(code) for code in self.status_codes)
+            )
+        if self.mimetypes is not None:
+            filters.append(
+                "mimetype:" + "|".join(escape(mimetype) for mimetype in self.mimetypes)
+            )
+        if self.url_key_pattern is not None:
+            filters.append(f"urlkey:{self.url_key_pattern.pattern}")
+        return filters
+
+    @property
+    def cdx_collapse(self) -> Sequence[str]:
+        return ["digest"] if self.collapse_digest else []
+
+    def collapse_key(self, capture: CdxCapture) -> Hashable | None:
+        """
+        Key by which consecutive captures are collapsed, if collapsing.
+        """
+        if not self.collapse_digest and self.collapse_period is None:
+            return None
+        return (
+            capture.url_key,
+            capture.digest if self.collapse_digest else None,
+            _period(capture.timestamp, self.collapse_period)
+            if self.collapse_period is not None
+            else None,
+        )
+
+    def matches(self, capture: CdxCapture) -> bool:
+        if (
+            self.status_codes is not None
+            and capture.status_code not in self.status_codes
+        ):
+            return False
+        if self.mimetypes is not None and capture.mimetype not in self.mimetypes:
+            return False
+        if (
+            self.url_key_pattern is not None
+            and self.url_key_pattern.fullmatch(capture.url_key) is None
+        ):
+            return False
+        return True
+
+
+# Filters for specific providers or archives must come before general filters.
+CAPTURE_FILTERS: Sequence[CaptureFilter] = (
+    # Only successful HTML captures can be downloaded and parsed as SERPs.
+    CaptureFilter(
+        status_codes=(200,),
+        mimetypes=("text/html", "application/xhtml+xml"),
+    ),
+)
+
+
+def get_capture_filter(source: Source) -> CaptureFilter:
+    """
+    Get the first capture filter applicable to the source, or no filter.
+    """
+    for capture_filter in CAPTURE_FILTERS:
+        if capture_filter.is_applicable(source):
+            return capture_filter
+    return CaptureFilter()
@@ -0,0 +1,92 @@
+from gzip import open as gzip_open
+from json import loads
+from pathlib import Path
+from typing import IO, Iterator, Literal, TypeAlias
+
+from web_archive_api.cdx import CdxCapture
+
+from archive_query_log.captures import create_capture
+from archive_query_log.captures.cdx import parse_cdx_line
+from archive_query_log.orm import Capture, Source
+
+LocalCapturesFormat: TypeAlias = Literal["jsonl", "cdx"]
+
+# Field letters of the CDX file format and the corresponding CDX API fields.
+# See: https://iipc.github.io/warc-specifications/specifications/cdx-format/cdx-2015/
+_CDX_FIELDS = {
+    "N": "urlkey",
+    "b": "timestamp",
+    "a": "original",
+    "m": "mimetype",
+    "s": "statuscode",
+    "k": "digest",
+    "r": "redirect",
+    "M": "robotflags",
+    "S": "length",
+    "V": "offset",
+    "g": "filename",
+}
+# Fields of the common 11-field CDX format, used if the file has no header.
+_DEFAULT_CDX_FIELDS = ("N", "b", "a", "m", "s", "k", "r", "M", "S", "V", "g")
+
+
+def _open_text(path: Path) -> IO[str]:
+    if path.suffix == ".gz":
+        return gzip_open(path, "rt", encoding="utf-8")
+    return path.open("rt", encoding="utf-8")
+
+
+def iter_cdx_captures(path: Path) -> Iterator[CdxCapture]:
+    """
+    Read captures from a CDX file, either in the space-separated CDX format
+    or with one CDX API JSON object per line.
+    """
+    with _open_text(path) as file:
+        fields: tuple[str, ...] = _DEFAULT_CDX_FIELDS
+        for line in file:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if line.startswith("{"):
+                yield parse_cdx_line(loads(line))
+                continue
+            if line.startswith("CDX "):
+                fields = tuple(line.split()[1:])
+                continue
+            values = line.split(" ")
+            yield parse_cdx_line(
+                {
+                    _CDX_FIELDS.get(field, field): value
+                    for field, value in zip(fields, values)
+                }
+            )
+
+
+def iter_local_captures(
+    path: Path,
+    format: LocalCapturesFormat,
+    source: Source | None = None,
+) -> Iterator[Capture]:
+    """
+    Stream captures from a local file without loading it into memory.
+
+    Captures in JSONL files (as written by the capture export) are read as-is.
+    Captures in CDX files lack the archive and provider, so these are taken
+    from the given source.
+    """
+    if format == "jsonl":
+        with _open_text(path) as file:
+            for line in file:
+                if len(line.strip()) == 0:
+                    continue
+                yield Capture.model_validate_json(line)
+    elif format == "cdx":
+        if source is None:
+            raise ValueError("A source is required to read captures from CDX files.")
+        for cdx_capture in iter_cdx_captures(path):
+            capture = create_capture(source, cdx_capture)
+            if capture is None:
+                continue
+            yield capture
+    else:
+        raise ValueError(f"Unknown captures format: {format}")
@@ -19,26 +19,34 @@ captures = App(
 @captures.command
 def fetch(
     *,
-    size: int = 10,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
     dry_run: bool = False,
     config: Config,
 ) -> None:
     """
     Fetch captures from web archives.
 
-    :param size: How many captures to fetch.
+    :param size: How many captures to fetch (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate sources, instead of stopping after one batch.
     """
 
     from archive_query_log.captures import fetch_captures
+    from archive_query_log.utils.daemon import run_stage
 
     Capture.init(
         using=config.es.client,
         index=config.es.index_captures,
     )
-    fetch_captures(
-        config=config,
+    run_stage(
+        lambda size: fetch_captures(
+            config=config,
+            size=size,
+            dry_run=dry_run,
+        ),
         size=size,
-        dry_run=dry_run,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
@@ -1,9 +1,19 @@
-from cyclopts import App
-from cyclopts.types import ResolvedPath, PositiveInt
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
 
+from cyclopts import App, Parameter
+from cyclopts.types import ResolvedExistingFile, ResolvedPath, PositiveInt
+
+from archive_query_log.captures.local import LocalCapturesFormat
 from archive_query_log.config import Config
 from archive_query_log.export.base import ExportFormat
-from archive_query_log.orm import Serp, WebSearchResultBlock, SpecialContentsResultBlock
+from archive_query_log.orm import (
+    Serp,
+    Source,
+    WebSearchResultBlock,
+    SpecialContentsResultBlock,
+)
+from archive_query_log.utils.parallel import Executor, action_pool
 
 serps = App(
     name="serps",
@@ -15,107 +25,175 @@ parse = App(name="parse", alias="p", help="Parse SERPs.")
 serps.command(parse)
 
 
-@parse.command
-def url_query(
-    *,
-    size: int = 10,
-    dry_run: bool = False,
+@Parameter(name="*")
+@dataclass(frozen=True)
+class ParseOptions:
+    size: PositiveInt | None = None
+    """How many documents to parse (default: 10)."""
+    prefetch_limit: PositiveInt | None = None
+    """Keep running as a daemon that repeatedly selects and prefetches up to this many candidate documents, instead of stopping after one batch."""
+    dry_run: bool = False
+    workers: PositiveInt = 1
+    """How many worker processes to parse in."""
+    executor: Executor = "local"
+    """Where to parse, either locally or on a Ray cluster (parses all matching documents, without claiming them)."""
+
+
+def _run_parser(
+    options: ParseOptions,
     config: Config,
+    get_action: Callable[[Config], Callable[[Any], Iterable[dict]]],
+    parse_serps: Callable[..., int],
 ) -> None:
+    from archive_query_log.utils.daemon import run_stage
+
+    if options.executor == "ray":
+        unsupported = [
+            option
+            for option, given in (
+                ("--size", options.size is not None),
+                ("--prefetch-limit", options.prefetch_limit is not None),
+                ("--workers", options.workers > 1),
+                ("--config.partition", config.partition.count > 1),
+                ("--config.schedule.fair", config.schedule.fair),
+            )
+            if given
+        ]
+        if len(unsupported) > 0:
+            raise ValueError(
+                f"The Ray executor does not support {', '.join(unsupported)}."
+            )
+
+    with action_pool(
+        get_action(config),
+        workers=options.workers,
+    ) as pool:
+        run_stage(
+            lambda size: parse_serps(
+                config=config,
+                size=size,
+                dry_run=options.dry_run,
+                pool=pool,
+                executor=options.executor,
+            ),
+            size=options.size,
+            prefetch_limit=options.prefetch_limit,
+            metrics=config.metrics,
+        )
+
+
+@parse.command
+def url_query(*, options: ParseOptions = ParseOptions(), config: Config) -> None:
     """
     Parse the search query from a SERP's URL.
-
-    :param size: How many captures to parse.
     """
-    from archive_query_log.parsers.url_query import parse_serps_url_query
+    from archive_query_log.parsers.url_query import (
+        get_url_query_action,
+        parse_serps_url_query,
+    )
 
     Serp.init(
         using=config.es.client,
         index=config.es.index_serps,
     )
-    parse_serps_url_query(
-        config=config,
-        size=size,
-        dry_run=dry_run,
-    )
+    _run_parser(options, config, get_url_query_action, parse_serps_url_query)
 
 
 @parse.command
-def url_page(
-    *,
-    size: int = 10,
-    dry_run: bool = False,
-    config: Config,
-) -> None:
+def url(*, options: ParseOptions = ParseOptions(), config: Config) -> None:
     """
-    Parse the SERP's page index from a SERP's URL.
-
-    :param size: How many SERPs to parse.
+    Parse the search query, page index, and pagination offset from a SERP's URL in one pass.
     """
-    from archive_query_log.parsers.url_page import parse_serps_url_page
+    from archive_query_log.parsers.url import get_url_action, parse_serps_url
 
-    parse_serps_url_page(
-        config=config,
-        size=size,
-        dry_run=dry_run,
+    Serp.init(
+        using=config.es.client,
+        index=config.es.index_serps,
     )
+    _run_parser(options, config, get_url_action, parse_serps_url)
 
 
 @parse.command
-def url_offset(
+def url_local(
+    input_path: ResolvedExistingFile,
+    output_path: ResolvedPath,
     *,
-    size: int = 10,
-    dry_run: bool = False,
-    config: Config,
+    format: LocalCapturesFormat = "jsonl",
+    source_path: ResolvedExistingFile | None = None,
 ) -> None:
     """
-    Parse the SERP's pagination offset from a SERP's URL.
+    Parse the search query, page index, and pagination offset from the URLs of captures in a local file, without Elasticsearch, and write the SERPs to a JSONL file.
 
-    :param size: How many SERPs to parse.
+    :param input_path: Captures file, either exported captures (JSONL) or a CDX file (optionally Gzip-compressed).
+    :param output_path: Output path for the SERPs (JSONL).
+    :param format: Format of the captures file.
+    :param source_path: Source (JSON) to take the archive and provider from, required for CDX files.
     """
-    from archive_query_log.parsers.url_offset import parse_serps_url_offset
+    from archive_query_log.parsers.url import parse_serps_url_local
 
-    parse_serps_url_offset(
-        config=config,
-        size=size,
-        dry_run=dry_run,
+    source: Source | None = None
+    if source_path is not None:
+        with source_path.open("rt", encoding="utf-8") as file:
+            source = Source.model_validate_json(file.readline())
+
+    parse_serps_url_local(
+        input_path=input_path,
+        output_path=output_path,
+        format=format,
+        source=source,
     )
 
 
 @parse.command
-def warc_query(
-    *,
-    size: int = 10,
-    dry_run: bool = False,
-    config: Config,
-) -> None:
+def url_page(*, options: ParseOptions = ParseOptions(), config: Config) -> None:
     """
-    Parse the search query from a SERP's WARC file (e.g., HTML contents).
+    Parse the SERP's page index from a SERP's URL.
+    """
+    from archive_query_log.parsers.url_page import (
+        get_url_page_action,
+        parse_serps_url_page,
+    )
+
+    _run_parser(options, config, get_url_page_action, parse_serps_url_page)
 
-    :param size: How many SERPs to parse.
+
+@parse.command
+def url_offset(*, options: ParseOptions = ParseOptions(), config: Config) -> None:
     """
-    from archive_query_log.parsers.warc_query import parse_serps_warc_query
+    Parse the SERP's pagination offset from a SERP's URL.
+    """
+    from archive_query_log.parsers.url_offset import (
+        get_url_offset_action,
+        parse_serps_url_offset,
+    )
 
-    parse_serps_warc_query(
-        config=config,
-        size=size,
-        dry_run=dry_run,
+    _run_parser(options, config, get_url_offset_action, parse_serps_url_offset)
+
+
+@parse.command
+def warc_query(*, options: ParseOptions = ParseOptions(), config: Config) -> None:
+    """
+    Parse the search query from a SERP's WARC file (e.g., HTML contents).
+    """
+    from archive_query_log.parsers.warc_query import (
+        get_warc_query_action,
+        parse_serps_warc_query,
     )
 
+    _run_parser(options, config, get_warc_query_action, parse_serps_warc_query)
+
 
 @parse.command
 def warc_web_search_result_blocks(
     *,
-    size: int = 10,
-    dry_run: bool = False,
+    options: ParseOptions = ParseOptions(),
     config: Config,
 ) -> None:
     """
     Parse the web search result blocks from a SERP's WARC file (e.g., HTML contents).
-
-    :param size: How many SERPs to parse.
     """
     from archive_query_log.parsers.warc_web_search_result_blocks import (
+        get_warc_web_search_result_blocks_action,
         parse_serps_warc_web_search_result_blocks,
     )
 
@@ -123,26 +201,25 @@ def warc_web_search_result_blocks(
         using=config.es.client,
         index=config.es.index_web_search_result_blocks,
     )
-    parse_serps_warc_web_search_result_blocks(
-        config=config,
-        size=size,
-        dry_run=dry_run,
+    _run_parser(
+        options,
+        config,
+        get_warc_web_search_result_blocks_action,
+        parse_serps_warc_web_search_result_blocks,
     )
 
 
 @parse.command
 def warc_special_contents_result_blocks(
     *,
-    size: int = 10,
-    dry_run: bool = False,
+    options: ParseOptions = ParseOptions(),
     config: Config,
 ) -> None:
     """
     Parse the special contents result blocks from a SERP's WARC file (e.g., HTML contents).
-
-    :param size: How many SERPs to parse.
     """
     from archive_query_log.parsers.warc_special_contents_result_blocks import (
+        get_warc_special_contents_result_blocks_action,
         parse_serps_warc_special_contents_result_blocks,
     )
 
@@ -150,10 +227,52 @@ def warc_special_contents_result_blocks(
         using=config.es.client,
         index=config.es.index_special_contents_result_blocks,
     )
-    parse_serps_warc_special_contents_result_blocks(
-        config=config,
+    _run_parser(
+        options,
+        config,
+        get_warc_special_contents_result_blocks_action,
+        parse_serps_warc_special_contents_result_blocks,
+    )
+
+
+@serps.command
+def pipeline(
+    *,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
+    dry_run: bool = False,
+    config: Config,
+) -> None:
+    """
+    Process new captures all the way through in memory: parse the URL, download the WARC, and parse the WARC.
+
+    :param size: How many captures to process (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate captures, instead of stopping after one batch.
+    """
+    from archive_query_log.parsers.pipeline import process_serps_pipeline
+    from archive_query_log.utils.daemon import run_stage
+
+    Serp.init(
+        using=config.es.client,
+        index=config.es.index_serps,
+    )
+    WebSearchResultBlock.init(
+        using=config.es.client,
+        index=config.es.index_web_search_result_blocks,
+    )
+    SpecialContentsResultBlock.init(
+        using=config.es.client,
+        index=config.es.index_special_contents_result_blocks,
+    )
+    run_stage(
+        lambda size: process_serps_pipeline(
+            config=config,
+            size=size,
+            dry_run=dry_run,
+        ),
         size=size,
-        dry_run=dry_run,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
@@ -168,19 +287,27 @@ serps.command(download)
 @download.command(name="warc")
 def download_warc(
     *,
-    size: int = 10,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
     config: Config,
 ) -> None:
     """
     Download archived contents of SERP captures as WARC to a file cache.
 
-    :param size: How many SERPs to download.
+    :param size: How many SERPs to download (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate SERPs, instead of stopping after one batch.
     """
     from archive_query_log.downloaders.warc import download_serps_warc
+    from archive_query_log.utils.daemon import run_stage
 
-    download_serps_warc(
-        config=config,
+    run_stage(
+        lambda size: download_serps_warc(
+            config=config,
+            size=size,
+        ),
         size=size,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
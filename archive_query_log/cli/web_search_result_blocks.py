@@ -21,26 +21,34 @@ web_search_result_blocks.command(parse)
 @web_search_result_blocks.command
 def fetch_captures(
     *,
-    size: int = 10,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
     dry_run: bool = False,
     config: Config,
 ) -> None:
     """
     Fetch captures of web search result block landing pages from web archives.
 
-    :param size: How many captures to fetch.
+    :param size: How many captures to fetch (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate web search result blocks, instead of stopping after one batch.
     """
 
     from archive_query_log.captures import fetch_web_search_result_block_captures
+    from archive_query_log.utils.daemon import run_stage
 
     WebSearchResultBlock.init(
         using=config.es.client,
         index=config.es.index_web_search_result_blocks,
     )
-    fetch_web_search_result_block_captures(
-        config=config,
+    run_stage(
+        lambda size: fetch_web_search_result_block_captures(
+            config=config,
+            size=size,
+            dry_run=dry_run,
+        ),
         size=size,
-        dry_run=dry_run,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
@@ -55,42 +63,58 @@ web_search_result_blocks.command(download)
 @download.command(name="warc-before-serp")
 def download_warc_before_serp(
     *,
-    size: int = 10,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
     config: Config,
 ) -> None:
     """
     Download archived contents of web search result block landing page captures as WARC to S3.
 
-    :param size: How many web search result block landing pages to download.
+    :param size: How many web search result block landing pages to download (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate web search result block landing pages, instead of stopping after one batch.
     """
     from archive_query_log.downloaders.warc import (
         download_web_search_result_block_warc_before_serp,
     )
+    from archive_query_log.utils.daemon import run_stage
 
-    download_web_search_result_block_warc_before_serp(
-        config=config,
+    run_stage(
+        lambda size: download_web_search_result_block_warc_before_serp(
+            config=config,
+            size=size,
+        ),
         size=size,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
 @download.command(name="warc-after-serp")
 def download_warc_after_serp(
     *,
-    size: int = 10,
+    size: PositiveInt | None = None,
+    prefetch_limit: PositiveInt | None = None,
     config: Config,
 ) -> None:
     """
     Download archived contents of web search result block landing page captures as WARC to S3.
 
-    :param size: How many web search result block landing pages to download.
+    :param size: How many web search result block landing pages to download (default: 10).
+    :param prefetch_limit: Keep running as a daemon that repeatedly selects and prefetches up to this many candidate web search result block landing pages, instead of stopping after one batch.
     """
     from archive_query_log.downloaders.warc import (
         download_web_search_result_block_warc_after_serp,
     )
+    from archive_query_log.utils.daemon import run_stage
 
-    download_web_search_result_block_warc_after_serp(
-        config=config,
+    run_stage(
+        lambda size: download_web_search_result_block_warc_after_serp(
+            config=config,
+            size=size,
+        ),
         size=size,
+        prefetch_limit=prefetch_limit,
+        metrics=config.metrics,
     )
 
 
@@ -1,12 +1,20 @@
 from functools import cached_property
 from json import dumps as json_dumps
 from pathlib import Path
-from typing import Iterable, Any, Annotated
+from typing import Iterable, Iterator, Any, Annotated, Literal
 
 from dotenv import find_dotenv
 from elasticsearch import Elasticsearch, AsyncElasticsearch
 from elasticsearch.helpers import streaming_bulk
-from pydantic import Field, AliasChoices
+from pydantic import (
+    Field,
+    AliasChoices,
+    NonNegativeFloat,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    model_validator,
+)
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pyrate_limiter import Limiter, RequestRate, Duration
 from requests import Session
@@ -16,10 +24,47 @@ from warc_cache import WarcCacheStore
 from warc_s3 import WarcS3Store
 
 from archive_query_log import __version__ as version
+from archive_query_log.utils.bulk import (
+    AdaptiveChunkSize,
+    adaptive_streaming_bulk,
+    first_index,
+)
+from archive_query_log.utils.metrics import (
+    TimedUrllib3HttpConnection,
+    time_http_response,
+    time_s3_calls,
+)
+from archive_query_log.utils.parallel import map_partitions
 from archive_query_log.utils.warc import WarcStore, WarcS3StoreWrapper
 
 
-class EsConfig(BaseSettings):
+class _ClientSettings(BaseSettings):
+    """
+    Settings that cache clients, which are not pickled along with the settings
+    but re-created when needed, e.g., after sending the settings to a Ray worker.
+    """
+
+    def __getstate__(self) -> dict[Any, Any]:
+        state = super().__getstate__()
+        cached_properties = {
+            name
+            for cls in type(self).__mro__
+            for name, value in vars(cls).items()
+            if isinstance(value, cached_property)
+        }
+        state["__dict__"] = {
+            key: value
+            for key, value in state["__dict__"].items()
+            if key not in cached_properties
+        }
+        return state
+
+
+def _action_document(action: dict) -> tuple[str | None, str | None]:
+    return action.get("_index"), action.get("_id")
+
+
+class EsConfig(_ClientSettings):
     model_config = SettingsConfigDict(frozen=True)
 
     host: str = "localhost"
@@ -39,10 +84,17 @@ class EsConfig(BaseSettings):
     bulk_max_chunk_bytes: int = 100 * 1024 * 1024
     bulk_initial_backoff: int = 2
     bulk_max_backoff: int = 60
+    # Number of bulk requests in flight at the same time.
+    bulk_concurrency: PositiveInt = 1
+    # Adapt the chunk size (starting from the above) to the cluster's feedback.
+    bulk_adaptive: bool = False
+    bulk_min_chunk_size: PositiveInt = 10
+    bulk_max_chunk_size: PositiveInt = 10_000
+    bulk_target_latency: PositiveFloat = 5
 
-    @cached_property
-    def client(self) -> Elasticsearch:
-        return Elasticsearch(
+    @property
+    def client_kwargs(self) -> dict[str, Any]:
+        return dict(
             hosts=f"https://{self.host}:{self.port}",
             api_key=self.api_key,
             http_auth=(self.username, self.password)
@@ -54,22 +106,59 @@ class EsConfig(BaseSettings):
             max_retries=self.max_retries,
             retry_on_status=(502, 503, 504),
             retry_on_timeout=True,
+            # Keep a connection for each concurrent bulk request.
+            maxsize=max(10, self.bulk_concurrency),
+        )
+
+    @cached_property
+    def client(self) -> Elasticsearch:
+        return Elasticsearch(
+            **self.client_kwargs,
+            connection_class=TimedUrllib3HttpConnection,
         )
 
     @cached_property
     def async_client(self) -> AsyncElasticsearch:
-        return AsyncElasticsearch(
-            hosts=f"https://{self.host}:{self.port}",
-            api_key=self.api_key,
-            http_auth=(self.username, self.password)
-            if self.api_key is None
-            and self.username is not None
-            and self.password is not None
-            else None,
-            timeout=60,
+        return AsyncElasticsearch(**self.client_kwargs)
+
+    @cached_property
+    def bulk_chunk_sizes(self) -> dict[str, AdaptiveChunkSize]:
+        # Learned chunk sizes, per index of the first action of a bulk.
+        return {}
+
+    def _streaming_bulk(self, actions: Iterable[dict]) -> Iterator[tuple[bool, Any]]:
+        if self.bulk_adaptive:
+            index, actions = first_index(actions)
+            chunk_size = self.bulk_chunk_sizes.setdefault(
+                index,
+                AdaptiveChunkSize(
+                    size=self.bulk_chunk_size,
+                    min_size=self.bulk_min_chunk_size,
+                    max_size=self.bulk_max_chunk_size,
+                    target_latency=self.bulk_target_latency,
+                    name=index,
+                ),
+            )
+            return adaptive_streaming_bulk(
+                client=self.client,
+                actions=actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=self.bulk_max_chunk_bytes,
+                initial_backoff=self.bulk_initial_backoff,
+                max_backoff=self.bulk_max_backoff,
+                max_retries=self.max_retries,
+            )
+        return streaming_bulk(
+            client=self.client,
+            actions=actions,
+            chunk_size=self.bulk_chunk_size,
+            max_chunk_bytes=self.bulk_max_chunk_bytes,
+            initial_backoff=self.bulk_initial_backoff,
+            max_backoff=self.bulk_max_backoff,
             max_retries=self.max_retries,
-            retry_on_status=(502, 503, 504),
-            retry_on_timeout=True,
+            raise_on_error=True,
+            raise_on_exception=True,
+            yield_ok=True,
         )
 
     def streaming_bulk(
@@ -77,22 +166,26 @@ class EsConfig(BaseSettings):
         actions: Iterable[dict],
         dry_run: bool = False,
     ) -> Iterable[tuple[bool, Any]]:
+        """
+        Index the actions and yield the results in the order they complete.
+
+        With a bulk concurrency above one, the actions are split by document
+        into that many streams, each sending its own bulk requests. So, the
+        actions of the same document are still applied in their original order.
+        """
         if dry_run:
             for action in actions:
                 print(json_dumps(action))
                 yield (True, None)
+        elif self.bulk_concurrency <= 1:
+            yield from self._streaming_bulk(actions)
         else:
-            yield from streaming_bulk(
-                client=self.client,
-                actions=actions,
-                chunk_size=self.bulk_chunk_size,
-                max_chunk_bytes=self.bulk_max_chunk_bytes,
-                initial_backoff=self.bulk_initial_backoff,
-                max_backoff=self.bulk_max_backoff,
-                max_retries=self.max_retries,
-                raise_on_error=True,
-                raise_on_exception=True,
-                yield_ok=True,
+            yield from map_partitions(
+                function=self._streaming_bulk,
+                items=actions,
+                key=_action_document,
+                partitions=self.bulk_concurrency,
+                buffer_size=self.bulk_chunk_size,
             )
 
     def bulk(
@@ -107,7 +200,7 @@ class EsConfig(BaseSettings):
             pass
 
 
-class S3Config(BaseSettings):
+class S3Config(_ClientSettings):
     model_config = SettingsConfigDict(frozen=True)
 
     endpoint_url: str | None = None
@@ -117,7 +210,7 @@ class S3Config(BaseSettings):
 
     @cached_property
     def warc_s3_store(self) -> WarcS3Store:
-        return WarcS3Store(
+        warc_s3_store = WarcS3Store(
             endpoint_url=self.endpoint_url,
             access_key=self.access_key,
             secret_key=self.secret_key,
@@ -125,23 +218,37 @@ class S3Config(BaseSettings):
             max_file_size=1_000_000_000,
             quiet=False,
         )
+        time_s3_calls(warc_s3_store.client)
+        return warc_s3_store
 
     @cached_property
     def warc_store(self) -> WarcStore:
         return WarcS3StoreWrapper(self.warc_s3_store)
 
 
-class HttpConfig(BaseSettings):
+class HttpConfig(_ClientSettings):
     model_config = SettingsConfigDict(frozen=True)
 
     max_retries: int = 5
+    # Sources to fetch captures from concurrently.
+    cdx_concurrency: PositiveInt = 16
+    # Concurrent CDX requests and minimum seconds between requests per host.
+    cdx_host_concurrency: PositiveInt = 1
+    cdx_host_interval: NonNegativeFloat = 0
+    # Split sources with at least this many CDX pages into time range shards.
+    cdx_shard_min_pages: PositiveInt | None = 100
+    cdx_shard_period: Literal["year", "month"] = "year"
+
+    @property
+    def user_agent(self) -> str:
+        return f"AQL/{version} (Webis group)"
 
     @cached_property
     def session(self) -> Session:
         session = Session()
         session.headers.update(
             {
-                "User-Agent": f"AQL/{version} (Webis group)",
+                "User-Agent": self.user_agent,
             }
         )
         _retries = Retry(
@@ -164,6 +271,7 @@ class HttpConfig(BaseSettings):
         )
         session.mount("http://", _adapter)
         session.mount("https://", _adapter)
+        session.hooks["response"].append(time_http_response)
         return session
 
     @cached_property
@@ -171,7 +279,7 @@ class HttpConfig(BaseSettings):
         session = Session()
         session.headers.update(
             {
-                "User-Agent": f"AQL/{version} (Webis group)",
+                "User-Agent": self.user_agent,
             }
         )
         _limiter = Limiter(
@@ -182,10 +290,11 @@ class HttpConfig(BaseSettings):
         )
         session.mount("http://", _adapter)
         session.mount("https://", _adapter)
+        session.hooks["response"].append(time_http_response)
         return session
 
 
-class WarcCacheConfig(BaseSettings):
+class WarcCacheConfig(_ClientSettings):
     model_config = SettingsConfigDict(frozen=True)
 
     path_serps: Path = Path("data/cache/warc/serps")
@@ -212,6 +321,50 @@ class WarcCacheConfig(BaseSettings):
         )
 
 
+class PartitionConfig(BaseSettings):
+    """
+    Disjoint partition of the work that this replica is responsible for.
+    """
+
+    model_config = SettingsConfigDict(frozen=True, env_prefix="partition_")
+
+    index: NonNegativeInt = 0
+    count: PositiveInt = 1
+
+    @model_validator(mode="after")
+    def _check_index(self) -> "PartitionConfig":
+        if self.index >= self.count:
+            raise ValueError(
+                f"Partition index {self.index} must be less than "
+                f"the partition count {self.count}."
+            )
+        return self
+
+
+class ScheduleConfig(BaseSettings):
+    """
+    How to share the work of a stage between archives and providers.
+    """
+
+    model_config = SettingsConfigDict(frozen=True, env_prefix="schedule_")
+
+    fair: bool = False
+    max_backlogs: PositiveInt = 1000
+    refresh_interval: PositiveFloat = 60
+
+
+class MetricsConfig(BaseSettings):
+    """
+    Where to export the throughput and latency metrics of running stages.
+    """
+
+    model_config = SettingsConfigDict(frozen=True, env_prefix="metrics_")
+
+    port: PositiveInt | None = None
+    path: Path | None = None
+    interval: PositiveFloat = 60
+
+
 class Config(BaseSettings):
     model_config = SettingsConfigDict(
         frozen=True,
@@ -229,3 +382,6 @@ class Config(BaseSettings):
     s3: S3Config = S3Config()
     http: HttpConfig = HttpConfig()
     warc_cache: WarcCacheConfig = WarcCacheConfig()
+    partition: PartitionConfig = PartitionConfig()
+    schedule: ScheduleConfig = ScheduleConfig()
+    metrics: MetricsConfig = MetricsConfig()
@@ -3,7 +3,7 @@ from itertools import chain
 from json import loads, dumps
 from pathlib import Path
 from typing import Iterable, Iterator, TypeVar, Generic, Type, Callable, cast
-from uuid import uuid5
+from uuid import UUID, uuid5
 from warnings import warn
 
 from elasticsearch_dsl import Search
@@ -28,6 +28,10 @@ from archive_query_log.orm import (
     WebSearchResultBlock,
     UuidBaseDocument,
 )
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents
+from archive_query_log.utils.scheduler import get_scheduler
 from archive_query_log.utils.time import utc_now
 
 
@@ -82,10 +86,25 @@ class _AnnotatedWarcRecord(ArcWarcRecord, Generic[_T]):
         self.annotation = annotation
 
 
-def _download_serp_warc(
+def warc_downloader_id(config: Config) -> UUID:
+    downloader_id_components = (
+        config.s3.endpoint_url if config.s3.endpoint_url is not None else "",
+        config.s3.bucket_name,
+        app_version,
+    )
+    return uuid5(
+        NAMESPACE_WARC_DOWNLOADER,
+        ":".join(downloader_id_components),
+    )
+
+
+def load_serp_warc(
     config: Config,
     serp: Serp,
-) -> Iterable[_WrapperWarcRecord[UuidBaseDocument]]:
+) -> Iterator[ArcWarcRecord]:
+    """
+    Load the WARC records of a SERP's capture from the Memento API.
+    """
     if serp.capture.status_code != 200:
         return
     memento_api = MementoApi(
@@ -106,7 +125,13 @@ def _download_serp_warc(
             )
         )
         return
+    yield from records
 
+
+def _download_serp_warc(
+    config: Config,
+    serp: Serp,
+) -> Iterable[_WrapperWarcRecord[UuidBaseDocument]]:
     # Only keep the meta fields of the SERP, as the source is not needed for updating it.
     pseudo_serp = UuidBaseDocument(
         id=serp.id,
@@ -114,11 +139,11 @@ def _download_serp_warc(
         seq_no=serp.seq_no,
     )
 
-    for record in records:
+    for record in load_serp_warc(config, serp):
         yield _WrapperWarcRecord(record, pseudo_serp)
 
 
-def download_serps_warc(config: Config, size: int = 10) -> None:
+def download_serps_warc(config: Config, size: int = 10) -> int:
     changed_serps_search: Search = (
         Serp.search(using=config.es.client, index=config.es.index_serps)
         .filter(
@@ -131,16 +156,23 @@ def download_serps_warc(config: Config, size: int = 10) -> None:
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_serps = changed_serps_search.count()
-
+    changed_serps: Iterable[Serp]
+    num_changed_serps, changed_serps = select_documents(
+        changed_serps_search,
+        size=size,
+        partition=config.partition,
+        claim_field="warc_downloader",
+        scheduler=get_scheduler(config.schedule, "download_serps_warc"),
+    )
     if num_changed_serps <= 0:
         print("No new/changed SERPs.")
-        return
-
-    changed_serps: Iterable[Serp] = changed_serps_search.params(size=size).execute()
+        return 0
 
     changed_serps = tqdm(
-        changed_serps, total=num_changed_serps, desc="Downloading WARCs", unit="SERP"
+        count_documents("download_serps_warc", until_stopped(changed_serps)),
+        total=num_changed_serps,
+        desc="Downloading WARCs",
+        unit="SERP",
     )
 
     # Download from Memento API.
@@ -155,6 +187,7 @@ def download_serps_warc(config: Config, size: int = 10) -> None:
     # Consume iterator to write to cache.
     for _ in locations:
         pass
+    return num_changed_serps
 
 
 @dataclass(frozen=True)
@@ -315,15 +348,7 @@ def upload_serps_warc(config: Config) -> None:
     )
 
     # Get downloader ID.
-    downloader_id_components = (
-        config.s3.endpoint_url if config.s3.endpoint_url is not None else "",
-        config.s3.bucket_name,
-        app_version,
-    )
-    downloader_id = uuid5(
-        NAMESPACE_WARC_DOWNLOADER,
-        ":".join(downloader_id_components),
-    )
+    downloader_id = warc_downloader_id(config)
 
     # Update Elasticsearch.
     actions = (
@@ -466,7 +491,7 @@ def _unwrap_records(
 
 def download_web_search_result_block_warc_before_serp(
     config: Config, size: int = 10
-) -> None:
+) -> int:
     changed_result_blocks_search: Search = (
         WebSearchResultBlock.search(
             using=config.es.client, index=config.es.index_web_search_result_blocks
@@ -482,18 +507,24 @@ def download_web_search_result_block_warc_before_serp(
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_result_blocks = changed_result_blocks_search.count()
-
+    changed_result_blocks: Iterable[WebSearchResultBlock]
+    num_changed_result_blocks, changed_result_blocks = select_documents(
+        changed_result_blocks_search,
+        size=size,
+        partition=config.partition,
+        scheduler=get_scheduler(
+            config.schedule, "download_web_search_result_block_warc_before_serp"
+        ),
+    )
     if num_changed_result_blocks <= 0:
         print("No new/changed web search result blocks.")
-        return
-
-    changed_result_blocks: Iterable[WebSearchResultBlock] = (
-        changed_result_blocks_search.params(size=size).execute()
-    )
+        return 0
 
     changed_result_blocks = tqdm(
-        changed_result_blocks,
+        count_documents(
+            "download_web_search_result_block_warc_before_serp",
+            until_stopped(changed_result_blocks),
+        ),
         total=num_changed_result_blocks,
         desc="Downloading WARCs",
         unit="web search result block",
@@ -535,11 +566,12 @@ def download_web_search_result_block_warc_before_serp(
         for result_block, location in stored_result_blocks
     )
     config.es.bulk(actions)
+    return num_changed_result_blocks
 
 
 def download_web_search_result_block_warc_after_serp(
     config: Config, size: int = 10
-) -> None:
+) -> int:
     changed_result_blocks_search: Search = (
         WebSearchResultBlock.search(
             using=config.es.client, index=config.es.index_web_search_result_blocks
@@ -555,18 +587,24 @@ def download_web_search_result_block_warc_after_serp(
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_result_blocks = changed_result_blocks_search.count()
-
+    changed_result_blocks: Iterable[WebSearchResultBlock]
+    num_changed_result_blocks, changed_result_blocks = select_documents(
+        changed_result_blocks_search,
+        size=size,
+        partition=config.partition,
+        scheduler=get_scheduler(
+            config.schedule, "download_web_search_result_block_warc_after_serp"
+        ),
+    )
     if num_changed_result_blocks <= 0:
         print("No new/changed web search result blocks.")
-        return
-
-    changed_result_blocks: Iterable[WebSearchResultBlock] = (
-        changed_result_blocks_search.params(size=size).execute()
-    )
+        return 0
 
     changed_result_blocks = tqdm(
-        changed_result_blocks,
+        count_documents(
+            "download_web_search_result_block_warc_after_serp",
+            until_stopped(changed_result_blocks),
+        ),
         total=num_changed_result_blocks,
         desc="Downloading WARCs",
         unit="web search result block",
@@ -608,3 +646,4 @@ def download_web_search_result_block_warc_after_serp(
         for result_block, location in stored_result_blocks
     )
     config.es.bulk(actions)
+    return num_changed_result_blocks
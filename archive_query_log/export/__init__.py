@@ -7,8 +7,6 @@ from elasticsearch_dsl import Search
 from elasticsearch_dsl.function import RandomScore
 from elasticsearch_dsl.query import FunctionScore
 from elasticsearch_pydantic import BaseDocument
-from ray.data import read_datasource, Dataset
-from ray_elasticsearch import ElasticsearchDatasource
 
 from archive_query_log.config import Config
 from archive_query_log.export.base import Exporter, ExportFormat
@@ -57,6 +55,9 @@ def export_ray(
     output_path: Path,
     config: Config,
 ) -> None:
+    from ray.data import read_datasource, Dataset
+    from ray_elasticsearch import ElasticsearchDatasource
+
     # Find the appropriate exporter for the given format.
     exporter = get_exporter(document_type, format)
 
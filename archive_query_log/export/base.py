@@ -1,8 +1,19 @@
 from pathlib import Path
-from typing import Generic, Iterable, Protocol, TypeVar, TypeAlias, Literal
+from typing import (
+    Generic,
+    Iterable,
+    Protocol,
+    TypeVar,
+    TypeAlias,
+    Literal,
+    TYPE_CHECKING,
+)
 
 from elasticsearch_pydantic import BaseDocument
-from ray.data import Dataset
+
+if TYPE_CHECKING:
+    # Ray is slow to import, so only import it where actually needed.
+    from ray.data import Dataset
 
 ExportFormat: TypeAlias = Literal["jsonl"]
 
@@ -18,6 +29,6 @@ class Exporter(Protocol, Generic[_D]):
 
     def export_ray(
         self,
-        dataset: Dataset,
+        dataset: "Dataset",
         output_path: Path,
     ) -> None: ...
@@ -109,12 +109,36 @@ class InnerProvider(BaseInnerDocument):
     priority: RankFeature | None = None
 
 
+class CdxCheckpoint(BaseInnerDocument):
+    # Time range of the interrupted fetch.
+    from_timestamp: Date | None = None
+    to_timestamp: Date
+    # Next page or resume key to fetch, depending on the CDX API.
+    page: Integer | None = None
+    resume_key: Keyword | None = None
+
+
+class SourceShard(BaseInnerDocument):
+    # Source that was split into time range shards.
+    source_id: UUID
+    # Time range of the captures of the shard.
+    from_timestamp: Date | None = None
+    to_timestamp: Date
+
+
+class InnerFetcher(BaseInnerDocument):
+    claimed_until: Date | None = None
+
+
 class Source(UuidBaseDocument):
     last_modified: DefaultDate
     archive: InnerArchive
     provider: InnerProvider
     should_fetch_captures: bool = True
     last_fetched_captures: Date | None = None
+    fetch_captures_checkpoint: CdxCheckpoint | None = None
+    shard: SourceShard | None = None
+    captures_fetcher: InnerFetcher | None = None
 
     class Index:
         settings = {
@@ -127,6 +151,7 @@ class InnerParser(BaseInnerDocument):
     id: UUID | None = None
     should_parse: bool = True
     last_parsed: Date | None = None
+    claimed_until: Date | None = None
 
 
 class Capture(UuidBaseDocument):
@@ -176,9 +201,10 @@ class InnerCapture(BaseInnerDocument):
 
 
 class InnerDownloader(BaseInnerDocument):
-    id: UUID
+    id: UUID | None = None
     should_download: bool = True
     last_downloaded: Date | None = None
+    claimed_until: Date | None = None
 
 
 class WarcLocation(BaseInnerDocument):
@@ -0,0 +1,181 @@
+from io import BytesIO
+from typing import Iterable, Iterator
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.function import RandomScore
+from elasticsearch_dsl.query import FunctionScore, Term, RankFeature
+from tqdm.auto import tqdm
+from warcio.archiveiterator import ArchiveIterator
+
+from archive_query_log.config import Config
+from archive_query_log.downloaders.warc import load_serp_warc, warc_downloader_id
+from archive_query_log.orm import Capture, InnerDownloader, Serp, WarcLocation
+from archive_query_log.parsers.url import parse_serp_url
+from archive_query_log.parsers.warc_query import parse_serp_warc_query_action
+from archive_query_log.parsers.warc_special_contents_result_blocks import (
+    parse_serp_warc_special_contents_result_blocks_action,
+)
+from archive_query_log.parsers.warc_web_search_result_blocks import (
+    parse_serp_warc_web_search_result_blocks_action,
+)
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents
+from archive_query_log.utils.scheduler import get_scheduler
+from archive_query_log.utils.time import utc_now
+from archive_query_log.utils.warc import WarcMemoryStore, warc_record_bytes
+
+
+def fold_actions(actions: Iterable[dict]) -> list[dict]:
+    """
+    Fold update actions into the create action of the same document, so that
+    each new document is written once, with all its fields.
+    """
+    folded: list[dict] = []
+    created: dict[tuple[str, str], dict] = {}
+    for action in actions:
+        key = (action.get("_index", ""), action.get("_id", ""))
+        if action["_op_type"] == "update" and key in created:
+            created[key].update(action["doc"])
+            continue
+        if action["_op_type"] == "create":
+            created[key] = action
+        folded.append(action)
+    return folded
+
+
+def _store_warcs(
+    config: Config,
+    serps_records: dict[str, bytes],
+    dry_run: bool = False,
+) -> dict[str, WarcLocation]:
+    """
+    Upload the WARC records of all SERPs in one S3 write.
+    """
+    if dry_run:
+        # Locate the records in memory only.
+        return {
+            serp_id: WarcLocation(file="", offset=offset, length=len(record))
+            for offset, (serp_id, record) in enumerate(serps_records.items())
+        }
+
+    # The stored records are yielded in the same order as the records.
+    serp_ids = list(serps_records.keys())
+    records = (
+        next(ArchiveIterator(BytesIO(record))) for record in serps_records.values()
+    )
+    return {
+        serp_id: WarcLocation(
+            file=stored_record.location.key,
+            offset=stored_record.location.offset,
+            length=stored_record.location.length,
+        )
+        for serp_id, stored_record in zip(
+            serp_ids, config.s3.warc_s3_store.write(records)
+        )
+    }
+
+
+def _parse_serp_warc_actions(
+    config: Config,
+    serp: Serp,
+    warc_store: WarcMemoryStore,
+) -> Iterator[dict]:
+    yield from parse_serp_warc_query_action(serp, warc_store)
+    yield from parse_serp_warc_web_search_result_blocks_action(
+        serp,
+        warc_store,
+        config.es.index_web_search_result_blocks,
+    )
+    yield from parse_serp_warc_special_contents_result_blocks_action(
+        serp,
+        warc_store,
+        config.es.index_special_contents_result_blocks,
+    )
+
+
+def process_captures_serps(
+    config: Config,
+    captures: Iterable[Capture],
+    dry_run: bool = False,
+) -> list[dict]:
+    """
+    Take captures all the way to parsed SERPs in memory: parse the URL,
+    download the WARC from the Memento API, upload it to S3, and parse the
+    WARC. Returns the bulk actions of all captures, with one write per
+    new document.
+    """
+    actions: list[dict] = []
+    serps: list[Serp] = []
+    serps_records: dict[str, bytes] = {}
+    for capture in captures:
+        serp, url_query_parser = parse_serp_url(capture, config.es.index_serps)
+        actions.append(capture.update_action(url_query_parser=url_query_parser))
+        if serp is None:
+            continue
+        serps.append(serp)
+        # Keep the last record, as the downloader does.
+        for record in load_serp_warc(config, serp):
+            serps_records[str(serp.id)] = warc_record_bytes(record)
+
+    locations = _store_warcs(config, serps_records, dry_run)
+    warc_store = WarcMemoryStore(
+        records={
+            (locations[serp_id].file, locations[serp_id].offset): record
+            for serp_id, record in serps_records.items()
+        }
+    )
+    downloader_id = warc_downloader_id(config)
+    for serp in serps:
+        location = locations.get(str(serp.id))
+        if location is not None:
+            serp.warc_location = location
+            serp.warc_downloader = InnerDownloader(
+                id=downloader_id,
+                should_download=False,
+                last_downloaded=utc_now(),
+            )
+        actions.append(serp.create_action())
+        if location is not None:
+            actions.extend(_parse_serp_warc_actions(config, serp, warc_store))
+    return fold_actions(actions)
+
+
+def process_serps_pipeline(
+    config: Config,
+    size: int = 10,
+    dry_run: bool = False,
+) -> int:
+    changed_captures_search: Search = (
+        Capture.search(using=config.es.client, index=config.es.index_captures)
+        .filter(~Term(url_query_parser__should_parse=False))
+        .query(
+            RankFeature(field="archive.priority", saturation={})
+            | RankFeature(field="provider.priority", saturation={})
+            | FunctionScore(functions=[RandomScore()])
+        )
+    )
+    changed_captures: Iterable[Capture]
+    num_changed_captures, changed_captures = select_documents(
+        changed_captures_search,
+        size=size,
+        partition=config.partition,
+        claim_field="url_query_parser",
+        dry_run=dry_run,
+        scheduler=get_scheduler(config.schedule, "process_serps_pipeline"),
+    )
+    if num_changed_captures <= 0:
+        print("No new/changed captures.")
+        return 0
+
+    changed_captures = tqdm(
+        count_documents("process_serps_pipeline", until_stopped(changed_captures)),
+        total=num_changed_captures,
+        desc="Processing SERPs",
+        unit="capture",
+    )
+    config.es.bulk(
+        actions=process_captures_serps(config, changed_captures, dry_run),
+        dry_run=dry_run,
+    )
+    return num_changed_captures
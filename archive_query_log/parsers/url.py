@@ -0,0 +1,169 @@
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.function import RandomScore
+from elasticsearch_dsl.query import FunctionScore, Term, RankFeature
+from tqdm.auto import tqdm
+
+from archive_query_log.captures.local import LocalCapturesFormat, iter_local_captures
+from archive_query_log.config import Config
+from archive_query_log.orm import Capture, InnerParser, Serp, Source
+from archive_query_log.parsers.url_offset import parse_url_offset
+from archive_query_log.parsers.url_page import parse_url_page
+from archive_query_log.parsers.url_query import parse_url_query, create_serp
+from archive_query_log.parsers.utils.url import ParsedUrl
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents
+from archive_query_log.utils.parallel import ActionPool, Executor, map_actions
+from archive_query_log.utils.scheduler import get_scheduler
+
+
+def parse_serp_url(
+    capture: Capture,
+    index_serps: str,
+) -> tuple[Serp | None, InnerParser]:
+    """
+    Parse the URL query, page, and offset of a capture in one pass
+    and create the SERP with all URL-derived fields already filled.
+    """
+    url = ParsedUrl(capture.url)
+    url_query, url_query_parser = parse_url_query(capture, url)
+    if url_query is None:
+        return None, url_query_parser
+
+    serp = create_serp(
+        capture=capture,
+        index_serps=index_serps,
+        url_query=url_query,
+        url_query_parser=url_query_parser,
+    )
+    serp.url_page, serp.url_page_parser = parse_url_page(serp, url)
+    serp.url_offset, serp.url_offset_parser = parse_url_offset(serp, url)
+    return serp, url_query_parser
+
+
+def parse_serp_url_action(
+    capture: Capture,
+    index_serps: str,
+) -> Iterator[dict]:
+    # Re-check if parsing is necessary.
+    if (
+        capture.url_query_parser is not None
+        and capture.url_query_parser.should_parse is not None
+        and not capture.url_query_parser.should_parse
+    ):
+        return
+
+    serp, url_query_parser = parse_serp_url(capture, index_serps)
+    if serp is not None:
+        yield serp.create_action()
+    yield capture.update_action(
+        url_query_parser=url_query_parser,
+    )
+    return
+
+
+def get_url_action(config: Config) -> Callable[[Capture], Iterable[dict]]:
+    return partial(
+        parse_serp_url_action,
+        index_serps=config.es.index_serps,
+    )
+
+
+def parse_serps_url(
+    config: Config,
+    size: int = 10,
+    dry_run: bool = False,
+    pool: ActionPool | None = None,
+    executor: Executor = "local",
+) -> int:
+    changed_captures_query = ~Term(url_query_parser__should_parse=False)
+    action = get_url_action(config)
+    if executor == "ray":
+        from archive_query_log.utils.ray_actions import bulk_actions_ray
+
+        bulk_actions_ray(
+            document_type=Capture,
+            index=config.es.index_captures,
+            query=changed_captures_query,
+            action=action,
+            config=config,
+            dry_run=dry_run,
+        )
+        return 0
+
+    changed_captures_search: Search = (
+        Capture.search(using=config.es.client, index=config.es.index_captures)
+        .filter(changed_captures_query)
+        .query(
+            RankFeature(field="archive.priority", saturation={})
+            | RankFeature(field="provider.priority", saturation={})
+            | FunctionScore(functions=[RandomScore()])
+        )
+    )
+    changed_captures: Iterable[Capture]
+    num_changed_captures, changed_captures = select_documents(
+        changed_captures_search,
+        size=size,
+        partition=config.partition,
+        claim_field="url_query_parser",
+        dry_run=dry_run,
+        scheduler=get_scheduler(config.schedule, "parse_serps_url"),
+    )
+    if num_changed_captures > 0:
+        changed_captures = tqdm(
+            count_documents("parse_serps_url", until_stopped(changed_captures)),
+            total=num_changed_captures,
+            desc="Parsing URL query, page, and offset",
+            unit="capture",
+        )
+        actions = map_actions(
+            action=action,
+            items=changed_captures,
+            pool=pool,
+        )
+        config.es.bulk(
+            actions=actions,
+            dry_run=dry_run,
+        )
+    else:
+        print("No new/changed captures.")
+    return num_changed_captures
+
+
+def parse_serps_url_local(
+    input_path: Path,
+    output_path: Path,
+    format: LocalCapturesFormat = "jsonl",
+    source: Source | None = None,
+    index_serps: str = "serps",
+) -> None:
+    """
+    Parse SERPs from the URLs of captures in a local file, without Elasticsearch.
+
+    Captures are streamed from the input file and SERPs are streamed to the
+    output JSONL file, so that memory usage does not depend on the file size.
+    All captures are parsed, regardless of whether they were parsed before.
+    """
+    captures: Iterable[Capture] = iter_local_captures(
+        path=input_path,
+        format=format,
+        source=source,
+    )
+    captures = tqdm(
+        captures,
+        desc="Parsing URL query, page, and offset",
+        unit="capture",
+    )
+    num_serps = 0
+    with output_path.open("wt", encoding="utf-8") as file:
+        for capture in captures:
+            serp, _ = parse_serp_url(capture, index_serps)
+            if serp is None:
+                continue
+            file.write(serp.model_dump_json() + "\n")
+            num_serps += 1
+    print(f"Parsed {num_serps} SERPs.")
@@ -1,8 +1,7 @@
 from abc import ABC, abstractmethod
 from functools import cached_property
-from itertools import chain
 from re import compile as re_compile
-from typing import Iterable, Iterator, Pattern, Sequence
+from typing import Callable, Iterable, Iterator, Pattern, Sequence
 from uuid import uuid5, UUID
 
 from elasticsearch_dsl import Search
@@ -15,11 +14,18 @@ from archive_query_log.config import Config
 from archive_query_log.namespaces import NAMESPACE_URL_OFFSET_PARSER
 from archive_query_log.orm import Serp, InnerParser
 from archive_query_log.parsers.utils import clean_int
+from archive_query_log.parsers.utils.registry import ProviderParserRegistry
 from archive_query_log.parsers.utils.url import (
+    ParsedUrl,
     parse_url_query_parameter,
     parse_url_fragment_parameter,
     parse_url_path_segment,
 )
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents, timed
+from archive_query_log.utils.parallel import ActionPool, Executor, map_actions
+from archive_query_log.utils.scheduler import get_scheduler
 from archive_query_log.utils.time import utc_now
 
 
@@ -54,14 +60,15 @@ class UrlOffsetParser(BaseModel, ABC):
         return True
 
     @abstractmethod
-    def parse(self, serp: Serp) -> int | None: ...
+    def parse(self, serp: Serp, url: ParsedUrl | None = None) -> int | None: ...
 
 
 class QueryParameterUrlOffsetParser(UrlOffsetParser):
     parameter: str
 
-    def parse(self, serp: Serp) -> int | None:
-        offset_string = parse_url_query_parameter(self.parameter, serp.capture.url)
+    def parse(self, serp: Serp, url: ParsedUrl | None = None) -> int | None:
+        url = ParsedUrl.of(serp.capture.url, url)
+        offset_string = parse_url_query_parameter(self.parameter, url)
         if offset_string is None:
             return None
         return clean_int(
@@ -73,8 +80,9 @@ class QueryParameterUrlOffsetParser(UrlOffsetParser):
 class FragmentParameterUrlOffsetParser(UrlOffsetParser):
     parameter: str
 
-    def parse(self, serp: Serp) -> int | None:
-        offset_string = parse_url_fragment_parameter(self.parameter, serp.capture.url)
+    def parse(self, serp: Serp, url: ParsedUrl | None = None) -> int | None:
+        url = ParsedUrl.of(serp.capture.url, url)
+        offset_string = parse_url_fragment_parameter(self.parameter, url)
         if offset_string is None:
             return None
         return clean_int(
@@ -86,8 +94,9 @@ class FragmentParameterUrlOffsetParser(UrlOffsetParser):
 class PathSegmentUrlOffsetParser(UrlOffsetParser):
     segment: int
 
-    def parse(self, serp: Serp) -> int | None:
-        offset_string = parse_url_path_segment(self.segment, serp.capture.url)
+    def parse(self, serp: Serp, url: ParsedUrl | None = None) -> int | None:
+        url = ParsedUrl.of(serp.capture.url, url)
+        offset_string = parse_url_path_segment(self.segment, url)
         if offset_string is None:
             return None
         return clean_int(
@@ -96,6 +105,31 @@ class PathSegmentUrlOffsetParser(UrlOffsetParser):
         )
 
 
+def parse_url_offset(
+    serp: Serp,
+    url: ParsedUrl | None = None,
+) -> tuple[int | None, InnerParser]:
+    url = ParsedUrl.of(serp.capture.url, url)
+    for parser in URL_OFFSET_PARSER_REGISTRY.applicable(
+        provider_id=serp.provider.id,
+        url=url.encoded_string,
+    ):
+        with timed("url_offset_parser", str(parser.id)):
+            url_offset = parser.parse(serp, url)
+        if url_offset is None:
+            # Parsing was not successful.
+            continue
+        return url_offset, InnerParser(
+            id=parser.id,
+            should_parse=False,
+            last_parsed=utc_now(),
+        )
+    return None, InnerParser(
+        should_parse=False,
+        last_parsed=utc_now(),
+    )
+
+
 def parse_serp_url_offset_action(serp: Serp) -> Iterator[dict]:
     # Re-check if parsing is necessary.
     if (
@@ -105,58 +139,74 @@ def parse_serp_url_offset_action(serp: Serp) -> Iterator[dict]:
     ):
         return
 
-    for parser in URL_OFFSET_PARSERS:
-        if not parser.is_applicable(serp):
-            continue
-        url_offset = parser.parse(serp)
-        if url_offset is None:
-            # Parsing was not successful.
-            continue
+    url_offset, url_offset_parser = parse_url_offset(serp)
+    if url_offset is None:
         yield serp.update_action(
-            url_offset=url_offset,
-            url_offset_parser=InnerParser(
-                id=parser.id,
-                should_parse=False,
-                last_parsed=utc_now(),
-            ),
+            url_offset_parser=url_offset_parser,
         )
         return
     yield serp.update_action(
-        url_offset_parser=InnerParser(
-            should_parse=False,
-            last_parsed=utc_now(),
-        ),
+        url_offset=url_offset,
+        url_offset_parser=url_offset_parser,
     )
     return
 
 
+def get_url_offset_action(config: Config) -> Callable[[Serp], Iterable[dict]]:
+    return parse_serp_url_offset_action
+
+
 def parse_serps_url_offset(
     config: Config,
     size: int = 10,
     dry_run: bool = False,
-) -> None:
-    config.es.client.indices.refresh(index=config.es.index_serps)
+    pool: ActionPool | None = None,
+    executor: Executor = "local",
+) -> int:
+    changed_serps_query = ~Term(url_offset_parser__should_parse=False)
+    action = get_url_offset_action(config)
+    if executor == "ray":
+        from archive_query_log.utils.ray_actions import bulk_actions_ray
+
+        bulk_actions_ray(
+            document_type=Serp,
+            index=config.es.index_serps,
+            query=changed_serps_query,
+            action=action,
+            config=config,
+            dry_run=dry_run,
+        )
+        return 0
+
     changed_serps_search: Search = (
         Serp.search(using=config.es.client, index=config.es.index_serps)
-        .filter(~Term(url_offset_parser__should_parse=False))
+        .filter(changed_serps_query)
         .query(
             RankFeature(field="archive.priority", saturation={})
             | RankFeature(field="provider.priority", saturation={})
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_serps = changed_serps_search.count()
+    changed_serps: Iterable[Serp]
+    num_changed_serps, changed_serps = select_documents(
+        changed_serps_search,
+        size=size,
+        partition=config.partition,
+        claim_field="url_offset_parser",
+        dry_run=dry_run,
+        scheduler=get_scheduler(config.schedule, "parse_serps_url_offset"),
+    )
     if num_changed_serps > 0:
-        changed_serps: Iterable[Serp] = changed_serps_search.params(size=size).execute()
-
         changed_serps = tqdm(
-            changed_serps,
+            count_documents("parse_serps_url_offset", until_stopped(changed_serps)),
             total=num_changed_serps,
             desc="Parsing URL offset",
             unit="SERP",
         )
-        actions = chain.from_iterable(
-            parse_serp_url_offset_action(serp) for serp in changed_serps
+        actions = map_actions(
+            action=action,
+            items=changed_serps,
+            pool=pool,
         )
         config.es.bulk(
             actions=actions,
@@ -164,6 +214,7 @@ def parse_serps_url_offset(
         )
     else:
         print("No new/changed SERPs.")
+    return num_changed_serps
 
 
 # TODO: Add actual parsers.
@@ -569,3 +620,7 @@ URL_OFFSET_PARSERS: Sequence[UrlOffsetParser] = (
         parameter="offset",
     ),
 )
+
+URL_OFFSET_PARSER_REGISTRY: ProviderParserRegistry[UrlOffsetParser] = (
+    ProviderParserRegistry(URL_OFFSET_PARSERS)
+)
@@ -1,8 +1,7 @@
 from abc import ABC, abstractmethod
-from functools import cached_property
-from itertools import chain
+from functools import cached_property, partial
 from re import compile as re_compile
-from typing import Iterable, Iterator, Pattern, Sequence
+from typing import Callable, Iterable, Iterator, Pattern, Sequence
 from uuid import uuid5, UUID
 
 from elasticsearch_dsl import Search
@@ -20,11 +19,18 @@ from archive_query_log.orm import (
     InnerParser,
 )
 from archive_query_log.parsers.utils import clean_text
+from archive_query_log.parsers.utils.registry import ProviderParserRegistry
 from archive_query_log.parsers.utils.url import (
+    ParsedUrl,
     parse_url_query_parameter,
     parse_url_fragment_parameter,
     parse_url_path_segment,
 )
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents, timed
+from archive_query_log.utils.parallel import ActionPool, Executor, map_actions
+from archive_query_log.utils.scheduler import get_scheduler
 from archive_query_log.utils.time import utc_now
 
 
@@ -59,14 +65,15 @@ class UrlQueryParser(BaseModel, ABC):
         return True
 
     @abstractmethod
-    def parse(self, capture: Capture) -> str | None: ...
+    def parse(self, capture: Capture, url: ParsedUrl | None = None) -> str | None: ...
 
 
 class QueryParameterUrlQueryParser(UrlQueryParser):
     parameter: str
 
-    def parse(self, capture: Capture) -> str | None:
-        query = parse_url_query_parameter(self.parameter, capture.url)
+    def parse(self, capture: Capture, url: ParsedUrl | None = None) -> str | None:
+        url = ParsedUrl.of(capture.url, url)
+        query = parse_url_query_parameter(self.parameter, url)
         if query is None:
             return None
         return clean_text(
@@ -79,8 +86,9 @@ class QueryParameterUrlQueryParser(UrlQueryParser):
 class FragmentParameterUrlQueryParser(UrlQueryParser):
     parameter: str
 
-    def parse(self, capture: Capture) -> str | None:
-        fragment = parse_url_fragment_parameter(self.parameter, capture.url)
+    def parse(self, capture: Capture, url: ParsedUrl | None = None) -> str | None:
+        url = ParsedUrl.of(capture.url, url)
+        fragment = parse_url_fragment_parameter(self.parameter, url)
         if fragment is None:
             return None
         return clean_text(
@@ -93,8 +101,9 @@ class FragmentParameterUrlQueryParser(UrlQueryParser):
 class PathSegmentUrlQueryParser(UrlQueryParser):
     segment: int
 
-    def parse(self, capture: Capture) -> str | None:
-        segment = parse_url_path_segment(self.segment, capture.url)
+    def parse(self, capture: Capture, url: ParsedUrl | None = None) -> str | None:
+        url = ParsedUrl.of(capture.url, url)
+        segment = parse_url_path_segment(self.segment, url)
         if segment is None:
             return None
         return clean_text(
@@ -104,6 +113,68 @@ class PathSegmentUrlQueryParser(UrlQueryParser):
         )
 
 
+def parse_url_query(
+    capture: Capture,
+    url: ParsedUrl | None = None,
+) -> tuple[str | None, InnerParser]:
+    url = ParsedUrl.of(capture.url, url)
+    for parser in URL_QUERY_PARSER_REGISTRY.applicable(
+        provider_id=capture.provider.id,
+        url=url.encoded_string,
+    ):
+        with timed("url_query_parser", str(parser.id)):
+            url_query = parser.parse(capture, url)
+        if url_query is None:
+            # Parsing was not successful.
+            continue
+        return url_query, InnerParser(
+            id=parser.id,
+            should_parse=False,
+            last_parsed=utc_now(),
+        )
+    return None, InnerParser(
+        should_parse=False,
+        last_parsed=utc_now(),
+    )
+
+
+def create_serp(
+    capture: Capture,
+    index_serps: str,
+    url_query: str,
+    url_query_parser: InnerParser,
+) -> Serp:
+    return Serp(
+        index=index_serps,
+        id=capture.id,
+        last_modified=utc_now(),
+        archive=capture.archive,
+        provider=capture.provider,
+        capture=InnerCapture(
+            id=capture.id,
+            url=capture.url,
+            timestamp=capture.timestamp,
+            status_code=capture.status_code,
+            digest=capture.digest,
+            mimetype=capture.mimetype,
+        ),
+        url_query=url_query,
+        url_query_parser=url_query_parser,
+        url_page_parser=InnerParser(
+            should_parse=True,
+        ),
+        url_offset_parser=InnerParser(
+            should_parse=True,
+        ),
+        warc_query_parser=InnerParser(
+            should_parse=True,
+        ),
+        warc_web_search_result_blocks_parser=InnerParser(
+            should_parse=True,
+        ),
+    )
+
+
 def parse_serp_url_query_action(
     capture: Capture,
     index_serps: str,
@@ -116,94 +187,84 @@ def parse_serp_url_query_action(
     ):
         return
 
-    for parser in URL_QUERY_PARSERS:
-        if not parser.is_applicable(capture):
-            continue
-        url_query = parser.parse(capture)
-        if url_query is None:
-            # Parsing was not successful.
-            continue
-        serp = Serp(
-            index=index_serps,
-            id=capture.id,
-            last_modified=utc_now(),
-            archive=capture.archive,
-            provider=capture.provider,
-            capture=InnerCapture(
-                id=capture.id,
-                url=capture.url,
-                timestamp=capture.timestamp,
-                status_code=capture.status_code,
-                digest=capture.digest,
-                mimetype=capture.mimetype,
-            ),
-            url_query=url_query,
-            url_query_parser=InnerParser(
-                id=parser.id,
-                should_parse=False,
-                last_parsed=utc_now(),
-            ),
-            url_page_parser=InnerParser(
-                should_parse=True,
-            ),
-            url_offset_parser=InnerParser(
-                should_parse=True,
-            ),
-            warc_query_parser=InnerParser(
-                should_parse=True,
-            ),
-            warc_web_search_result_blocks_parser=InnerParser(
-                should_parse=True,
-            ),
-        )
-        yield serp.create_action()
+    url_query, url_query_parser = parse_url_query(capture)
+    if url_query is None:
         yield capture.update_action(
-            url_query_parser=InnerParser(
-                id=parser.id,
-                should_parse=False,
-                last_parsed=utc_now(),
-            ),
+            url_query_parser=url_query_parser,
         )
         return
+
+    serp = create_serp(
+        capture=capture,
+        index_serps=index_serps,
+        url_query=url_query,
+        url_query_parser=url_query_parser,
+    )
+    yield serp.create_action()
     yield capture.update_action(
-        url_query_parser=InnerParser(
-            should_parse=False,
-            last_parsed=utc_now(),
-        ),
+        url_query_parser=url_query_parser,
     )
     return
 
 
+def get_url_query_action(config: Config) -> Callable[[Capture], Iterable[dict]]:
+    return partial(
+        parse_serp_url_query_action,
+        index_serps=config.es.index_serps,
+    )
+
+
 def parse_serps_url_query(
     config: Config,
     size: int = 10,
     dry_run: bool = False,
-) -> None:
-    config.es.client.indices.refresh(index=config.es.index_captures)
+    pool: ActionPool | None = None,
+    executor: Executor = "local",
+) -> int:
+    changed_captures_query = ~Term(url_query_parser__should_parse=False)
+    action = get_url_query_action(config)
+    if executor == "ray":
+        from archive_query_log.utils.ray_actions import bulk_actions_ray
+
+        bulk_actions_ray(
+            document_type=Capture,
+            index=config.es.index_captures,
+            query=changed_captures_query,
+            action=action,
+            config=config,
+            dry_run=dry_run,
+        )
+        return 0
+
     changed_captures_search: Search = (
         Capture.search(using=config.es.client, index=config.es.index_captures)
-        .filter(~Term(url_query_parser__should_parse=False))
+        .filter(changed_captures_query)
         .query(
             RankFeature(field="archive.priority", saturation={})
             | RankFeature(field="provider.priority", saturation={})
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_captures = changed_captures_search.count()
+    changed_captures: Iterable[Capture]
+    num_changed_captures, changed_captures = select_documents(
+        changed_captures_search,
+        size=size,
+        partition=config.partition,
+        claim_field="url_query_parser",
+        dry_run=dry_run,
+        scheduler=get_scheduler(config.schedule, "parse_serps_url_query"),
+    )
     if num_changed_captures > 0:
-        changed_captures: Iterable[Capture] = changed_captures_search.params(
-            size=size
-        ).execute()
-
         changed_captures = tqdm(
-            changed_captures,
+            count_documents("parse_serps_url_query", until_stopped(changed_captures)),
             total=num_changed_captures,
             desc="Parsing URL query",
             unit="capture",
         )
-        actions = chain.from_iterable(
-            parse_serp_url_query_action(capture, config.es.index_serps)
-            for capture in changed_captures
+        actions = map_actions(
+            action=action,
+            items=changed_captures,
+            pool=pool,
         )
         config.es.bulk(
             actions=actions,
@@ -211,6 +272,7 @@ def parse_serps_url_query(
         )
     else:
         print("No new/changed captures.")
+    return num_changed_captures
 
 
 URL_QUERY_PARSERS: Sequence[UrlQueryParser] = (
@@ -5914,3 +5976,7 @@ URL_QUERY_PARSERS: Sequence[UrlQueryParser] = (
         parameter="q",
     ),
 )
+
+URL_QUERY_PARSER_REGISTRY: ProviderParserRegistry[UrlQueryParser] = (
+    ProviderParserRegistry(URL_QUERY_PARSERS)
+)
@@ -0,0 +1,231 @@
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import chain
+from re import compile as re_compile
+from typing import Generic, Mapping, Pattern, Protocol, Sequence, TypeVar
+from uuid import UUID
+
+
+class ProviderSpecificParser(Protocol):
+    @property
+    def provider_id(self) -> UUID | None: ...
+
+    @property
+    def url_pattern(self) -> Pattern | None: ...
+
+
+_P = TypeVar("_P", bound=ProviderSpecificParser)
+
+_DEFAULT_FLAGS = re_compile("").flags
+_BACKREFERENCE_PATTERN = re_compile(r"\\[1-9]|\(\?P=")
+# Most URL patterns start with this prefix. Its match is unambiguous,
+# so it can be matched once for all patterns that share it.
+_HOST_PATTERN_PREFIX = r"^https?://[^/]+/"
+
+
+def _is_combinable(pattern: Pattern) -> bool:
+    # Patterns with inline flags, named groups, or back-references
+    # would change their meaning when embedded in a combined pattern.
+    return (
+        isinstance(pattern.pattern, str)
+        and pattern.flags == _DEFAULT_FLAGS
+        and len(pattern.groupindex) == 0
+        and _BACKREFERENCE_PATTERN.search(pattern.pattern) is None
+    )
+
+
+def _has_top_level_alternation(pattern: str) -> bool:
+    depth = 0
+    class_start: int | None = None
+    escaped = False
+    for index, char in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif class_start is not None:
+            # A closing bracket right after the opening bracket is a literal.
+            if char == "]" and pattern[class_start + 1 : index] not in ("", "^"):
+                class_start = None
+        elif char == "[":
+            class_start = index
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
+def _host_pattern_suffix(pattern: str) -> str | None:
+    if not pattern.startswith(_HOST_PATTERN_PREFIX):
+        return None
+    suffix = pattern.removeprefix(_HOST_PATTERN_PREFIX)
+    if suffix.startswith(("?", "*", "+", "{")):
+        # The suffix would quantify the prefix' last character.
+        return None
+    if _has_top_level_alternation(pattern):
+        return None
+    return suffix
+
+
+def _optional_lookahead(group_name: str, pattern: str) -> str:
+    return f"(?:(?=(?P<{group_name}>{pattern})))?"
+
+
+@dataclass(frozen=True)
+class CombinedUrlPattern(Generic[_P]):
+    """
+    Single pattern that matches the URL patterns of many parsers at once.
+
+    Each distinct URL pattern is embedded as an optional look-ahead with its own
+    group, so that one match call tells which of the patterns match the URL.
+    The common host prefix is matched only once for all patterns sharing it.
+    Patterns that cannot be embedded safely are matched separately, as are all
+    patterns if there are too few of them for combining to pay off.
+    """
+
+    parsers: Sequence[_P]
+    min_patterns: int = 4
+
+    @cached_property
+    def _combined(self) -> tuple[Pattern | None, Sequence[tuple[_P, int]]]:
+        group_names: dict[str, str] = {}
+        parser_group_names: list[str | None] = []
+        for parser in self.parsers:
+            pattern = parser.url_pattern
+            if pattern is None or not _is_combinable(pattern):
+                parser_group_names.append(None)
+                continue
+            if pattern.pattern not in group_names:
+                group_names[pattern.pattern] = f"_{len(group_names)}"
+            parser_group_names.append(group_names[pattern.pattern])
+
+        if len(group_names) < self.min_patterns:
+            return None, tuple(
+                (parser, 0 if parser.url_pattern is None else -1)
+                for parser in self.parsers
+            )
+
+        host_lookaheads: list[str] = []
+        other_lookaheads: list[str] = []
+        for pattern_string, group_name in group_names.items():
+            suffix = _host_pattern_suffix(pattern_string)
+            if suffix is not None:
+                host_lookaheads.append(_optional_lookahead(group_name, suffix))
+            else:
+                other_lookaheads.append(_optional_lookahead(group_name, pattern_string))
+        combined_pattern = re_compile(
+            "".join(other_lookaheads)
+            + (
+                f"(?:(?={_HOST_PATTERN_PREFIX}{''.join(host_lookaheads)}))?"
+                if len(host_lookaheads) > 0
+                else ""
+            )
+        )
+
+        # Group 0 (i.e., the whole match) always matches and is used for parsers
+        # without URL pattern. Group -1 marks patterns to be matched separately.
+        checks: list[tuple[_P, int]] = []
+        for parser, parser_group_name in zip(self.parsers, parser_group_names):
+            if parser_group_name is not None:
+                checks.append((parser, combined_pattern.groupindex[parser_group_name]))
+            elif parser.url_pattern is None:
+                checks.append((parser, 0))
+            else:
+                checks.append((parser, -1))
+        return combined_pattern, tuple(checks)
+
+    def match(self, url: str) -> Sequence[_P]:
+        combined_pattern, checks = self._combined
+        if combined_pattern is None:
+            spans: Sequence[tuple[int, int]] = ((0, 0),)
+        else:
+            # The combined pattern consists only of optional groups
+            # and thus always matches.
+            match = combined_pattern.match(url)
+            if match is None:
+                raise RuntimeError("Combined URL pattern did not match.")
+            spans = match.regs
+        return [
+            parser
+            for parser, group in checks
+            if (
+                spans[group][0] >= 0
+                if group >= 0
+                else parser.url_pattern is not None
+                and parser.url_pattern.match(url) is not None
+            )
+        ]
+
+
+@dataclass(frozen=True)
+class ProviderParserRegistry(Generic[_P]):
+    """
+    Index of parsers by their provider ID.
+
+    For any provider, the candidate parsers are the provider's own parsers
+    together with the provider-agnostic parsers, in the same order as in the
+    original sequence. Trying the candidates in order thus yields the same first
+    match as trying all parsers in order.
+    """
+
+    parsers: Sequence[_P]
+
+    @cached_property
+    def _provider_agnostic_indices(self) -> Sequence[int]:
+        return tuple(
+            index
+            for index, parser in enumerate(self.parsers)
+            if parser.provider_id is None
+        )
+
+    @cached_property
+    def _provider_agnostic_parsers(self) -> Sequence[_P]:
+        return tuple(self.parsers[index] for index in self._provider_agnostic_indices)
+
+    @cached_property
+    def _provider_parsers(self) -> Mapping[UUID, Sequence[_P]]:
+        provider_indices: dict[UUID, list[int]] = {}
+        for index, parser in enumerate(self.parsers):
+            if parser.provider_id is not None:
+                provider_indices.setdefault(parser.provider_id, []).append(index)
+        return {
+            provider_id: tuple(
+                self.parsers[index]
+                for index in sorted(chain(indices, self._provider_agnostic_indices))
+            )
+            for provider_id, indices in provider_indices.items()
+        }
+
+    @cached_property
+    def _provider_url_patterns(self) -> dict[UUID | None, CombinedUrlPattern[_P]]:
+        # Filled lazily, as most workers only see a few providers.
+        return {}
+
+    @property
+    def provider_ids(self) -> Sequence[UUID]:
+        return tuple(self._provider_parsers.keys())
+
+    def candidates(self, provider_id: UUID | None) -> Sequence[_P]:
+        if provider_id is None:
+            return self._provider_agnostic_parsers
+        return self._provider_parsers.get(provider_id, self._provider_agnostic_parsers)
+
+    def applicable(self, provider_id: UUID | None, url: str) -> Sequence[_P]:
+        """
+        Get the parsers that are applicable to a URL of the given provider,
+        in the same order as in the original sequence.
+        """
+        if provider_id not in self._provider_parsers:
+            # Share the provider-agnostic pattern among all unknown providers.
+            provider_id = None
+        url_pattern = self._provider_url_patterns.get(provider_id)
+        if url_pattern is None:
+            url_pattern = CombinedUrlPattern(self.candidates(provider_id))
+            self._provider_url_patterns[provider_id] = url_pattern
+        return url_pattern.match(url)
+
+    def __len__(self) -> int:
+        return len(self.parsers)
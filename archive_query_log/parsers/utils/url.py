@@ -1,26 +1,77 @@
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Mapping, Sequence
 from urllib.parse import parse_qsl, unquote
 from pydantic import HttpUrl
 
 
-def parse_url_query_parameter(parameter: str, url: HttpUrl) -> str | None:
-    for key, value in parse_qsl(url.query):
-        if key == parameter:
-            return value
-    return None
+def _parse_parameters(text: str | None) -> Mapping[str, Sequence[str]]:
+    parameters: dict[str, list[str]] = {}
+    for key, value in parse_qsl(text):
+        parameters.setdefault(key, []).append(value)
+    return parameters
 
 
-def parse_url_fragment_parameter(parameter: str, url: HttpUrl) -> str | None:
-    for key, value in parse_qsl(url.fragment):
-        if key == parameter:
-            return value
-    return None
+@dataclass(frozen=True)
+class ParsedUrl:
+    """
+    View of a URL whose components are decomposed at most once,
+    to be shared among all parsers tried for the same capture or SERP.
+    """
 
+    url: HttpUrl
 
-def parse_url_path_segment(segment: int, url: HttpUrl) -> str | None:
-    path = url.path
-    if path is None:
+    @classmethod
+    def of(cls, url: HttpUrl, parsed: "ParsedUrl | None" = None) -> "ParsedUrl":
+        """Reuse the already parsed URL if given, or else parse the URL."""
+        return parsed if parsed is not None else cls(url)
+
+    @cached_property
+    def encoded_string(self) -> str:
+        return self.url.encoded_string()
+
+    @cached_property
+    def query_parameters(self) -> Mapping[str, Sequence[str]]:
+        return _parse_parameters(self.url.query)
+
+    @cached_property
+    def fragment_parameters(self) -> Mapping[str, Sequence[str]]:
+        return _parse_parameters(self.url.fragment)
+
+    @cached_property
+    def path_segments(self) -> Sequence[str] | None:
+        path = self.url.path
+        if path is None:
+            return None
+        return path.split("/")
+
+
+def parse_url_query_parameter(parameter: str, url: HttpUrl | ParsedUrl) -> str | None:
+    if not isinstance(url, ParsedUrl):
+        url = ParsedUrl(url)
+    values = url.query_parameters.get(parameter)
+    if values is None:
+        return None
+    return values[0]
+
+
+def parse_url_fragment_parameter(
+    parameter: str, url: HttpUrl | ParsedUrl
+) -> str | None:
+    if not isinstance(url, ParsedUrl):
+        url = ParsedUrl(url)
+    values = url.fragment_parameters.get(parameter)
+    if values is None:
+        return None
+    return values[0]
+
+
+def parse_url_path_segment(segment: int, url: HttpUrl | ParsedUrl) -> str | None:
+    if not isinstance(url, ParsedUrl):
+        url = ParsedUrl(url)
+    path_segments = url.path_segments
+    if path_segments is None:
         return None
-    path_segments = path.split("/")
     if len(path_segments) <= segment:
         return None
     path_segment = path_segments[segment]
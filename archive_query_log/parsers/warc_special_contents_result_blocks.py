@@ -1,8 +1,7 @@
 from abc import ABC, abstractmethod
 from functools import cached_property
-from itertools import chain
 from re import compile as re_compile
-from typing import Iterable, Iterator, Pattern, Sequence
+from typing import Callable, Iterable, Iterator, Pattern, Sequence
 from urllib.parse import urljoin
 from uuid import uuid5, UUID
 
@@ -26,6 +25,11 @@ from archive_query_log.orm import (
     SpecialContentsResultBlockId,
 )
 from archive_query_log.parsers.utils.xml import parse_xml_tree, safe_xpath
+from archive_query_log.utils.daemon import until_stopped
+from archive_query_log.utils.es import select_documents
+from archive_query_log.utils.metrics import count_documents, timed
+from archive_query_log.utils.parallel import ActionPool, Executor, map_actions
+from archive_query_log.utils.scheduler import get_scheduler
 from archive_query_log.utils.time import utc_now
 from archive_query_log.utils.warc import WarcStore
 
@@ -205,7 +209,8 @@ def parse_serp_warc_special_contents_result_blocks_action(
     for parser in WARC_SPECIAL_CONTENTS_RESULT_BLOCKS_PARSERS:
         if not parser.is_applicable(serp):
             continue
-        warc_special_contents_result_blocks = parser.parse(serp, warc_store)
+        with timed("warc_special_contents_result_blocks_parser", str(parser.id)):
+            warc_special_contents_result_blocks = parser.parse(serp, warc_store)
         if warc_special_contents_result_blocks is None:
             # Parsing was not successful.
             continue
@@ -255,41 +260,78 @@ def parse_serp_warc_special_contents_result_blocks_action(
     return
 
 
+def get_warc_special_contents_result_blocks_action(
+    config: Config,
+) -> Callable[[Serp], Iterable[dict]]:
+    def action(serp: Serp) -> Iterator[dict]:
+        # Access the WARC store lazily, so that each worker opens its own.
+        return parse_serp_warc_special_contents_result_blocks_action(
+            serp,
+            config.s3.warc_store,
+            config.es.index_special_contents_result_blocks,
+        )
+
+    return action
+
+
 def parse_serps_warc_special_contents_result_blocks(
     config: Config,
     size: int = 10,
     dry_run: bool = False,
-) -> None:
-    config.es.client.indices.refresh(index=config.es.index_serps)
+    pool: ActionPool | None = None,
+    executor: Executor = "local",
+) -> int:
+    changed_serps_query = Exists(field="warc_location") & ~Term(
+        warc_special_contents_result_blocks_parser__should_parse=False
+    )
+    action = get_warc_special_contents_result_blocks_action(config)
+    if executor == "ray":
+        from archive_query_log.utils.ray_actions import bulk_actions_ray
+
+        bulk_actions_ray(
+            document_type=Serp,
+            index=config.es.index_serps,
+            query=changed_serps_query,
+            action=action,
+            config=config,
+            dry_run=dry_run,
+        )
+        return 0
+
     changed_serps_search: Search = (
         Serp.search(using=config.es.client, index=config.es.index_serps)
-        .filter(
-            Exists(field="warc_location")
-            & ~Term(warc_special_contents_result_blocks_parser__should_parse=False)
-        )
+        .filter(changed_serps_query)
         .query(
             RankFeature(field="archive.priority", saturation={})
             | RankFeature(field="provider.priority", saturation={})
             | FunctionScore(functions=[RandomScore()])
         )
     )
-    num_changed_serps = changed_serps_search.count()
+    changed_serps: Iterable[Serp]
+    num_changed_serps, changed_serps = select_documents(
+        changed_serps_search,
+        size=size,
+        partition=config.partition,
+        claim_field="warc_special_contents_result_blocks_parser",
+        dry_run=dry_run,
+        scheduler=get_scheduler(
+            config.schedule, "parse_serps_warc_special_contents_result_blocks"
+        ),
+    )
     if num_changed_serps > 0:
-        changed_serps: Iterable[Serp] = changed_serps_search.params(size=size).execute()
-
         changed_serps = tqdm(
-            changed_serps,
+            count_documents(
+                "parse_serps_warc_special_contents_result_blocks",
+                until_stopped(changed_serps),
+            ),
             total=num_changed_serps,
             desc="Parsing WARC special contents result blocks",
             unit="SERP",
         )
-        actions = chain.from_iterable(
-            parse_serp_warc_special_contents_result_blocks_action(
-                serp,
-                config.s3.warc_store,
-                config.es.index_special_contents_result_blocks,
-            )
-            for serp in changed_serps
+        actions = map_actions(
+            action=action,
+            items=changed_serps,
+            pool=pool,
         )
         config.es.bulk(
             actions=actions,
@@ -297,6 +339,7 @@ def parse_serps_warc_special_contents_result_blocks(
         )
     else:
         print("No new/changed SERPs.")
+    return num_changed_serps
 
 
 WARC_SPECIAL_CONTENTS_RESULT_BLOCKS_PARSERS: Sequence[
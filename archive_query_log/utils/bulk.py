@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+from itertools import chain
+from sys import maxsize
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Any, Iterable, Iterator
+
+from elasticsearch import Elasticsearch, TransportError
+from elasticsearch.helpers import BulkIndexError, streaming_bulk
+
+from archive_query_log.utils.metrics import METRICS
+
+
+@dataclass
+class AdaptiveChunkSize:
+    """
+    Number of actions per bulk request, adapted to the cluster's feedback.
+
+    If the cluster rejects a chunk (HTTP 429), the size is halved. If a chunk
+    takes longer than the target latency, the size is reduced proportionally.
+    Otherwise, if the chunk was full, the size grows by 10%. Chunks cut short
+    by the byte limit (e.g., for documents with large contents) do not grow the
+    size, so that it does not drift away from the chunks actually sent.
+    """
+
+    size: int
+    min_size: int = 10
+    max_size: int = 10_000
+    target_latency: float = 5
+    name: str = ""
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+
+    def update(
+        self,
+        latency: float,
+        num_actions: int,
+        num_bytes: int,
+        rejected: bool = False,
+    ) -> None:
+        with self._lock:
+            # The last chunk may have been cut short, e.g., by the byte limit.
+            base = min(self.size, num_actions)
+            if rejected:
+                size = base // 2
+            elif latency > self.target_latency:
+                size = int(base * self.target_latency / latency)
+            elif num_actions >= self.size:
+                size = self.size + max(1, self.size // 10)
+            else:
+                size = self.size
+            self.size = min(self.max_size, max(self.min_size, size))
+        METRICS.set_gauge("bulk_chunk_size", self.name, self.size)
+        METRICS.set_gauge("bulk_chunk_bytes", self.name, num_bytes)
+
+
+def _iter_chunks(
+    client: Elasticsearch,
+    actions: Iterable[dict],
+    chunk_size: AdaptiveChunkSize,
+    max_bytes: int,
+) -> Iterator[tuple[list[dict], int]]:
+    # Like the helper, start a new chunk before exceeding the byte limit.
+    chunk: list[dict] = []
+    num_bytes = 0
+    for action in actions:
+        action_bytes = len(client.transport.serializer.dumps(action))
+        if len(chunk) > 0 and (
+            len(chunk) >= chunk_size.size or num_bytes + action_bytes > max_bytes
+        ):
+            yield chunk, num_bytes
+            chunk, num_bytes = [], 0
+        chunk.append(action)
+        num_bytes += action_bytes
+    if len(chunk) > 0:
+        yield chunk, num_bytes
+
+
+def _bulk_chunk(
+    client: Elasticsearch,
+    chunk: list[dict],
+    num_bytes: int,
+    chunk_size: AdaptiveChunkSize,
+    initial_backoff: float,
+    max_backoff: float,
+    max_retries: int,
+) -> Iterator[tuple[bool, Any]]:
+    pending = chunk
+    for attempt in range(max_retries + 1):
+        start = perf_counter()
+        rejected: list[dict] = []
+        errors: list[Any] = []
+        try:
+            # Send the whole chunk in one request, with retries handled here.
+            results = list(
+                streaming_bulk(
+                    client=client,
+                    actions=pending,
+                    chunk_size=len(pending),
+                    max_chunk_bytes=maxsize,
+                    max_retries=0,
+                    raise_on_error=False,
+                    raise_on_exception=True,
+                    yield_ok=True,
+                )
+            )
+        except TransportError as error:
+            if error.status_code != 429:
+                raise
+            results = []
+            rejected = pending
+        for action, (ok, item) in zip(pending, results):
+            if ok:
+                yield ok, item
+            elif next(iter(item.values())).get("status") == 429:
+                rejected.append(action)
+            else:
+                errors.append(item)
+        chunk_size.update(
+            latency=perf_counter() - start,
+            num_actions=len(pending),
+            num_bytes=num_bytes * len(pending) // len(chunk),
+            rejected=len(rejected) > 0,
+        )
+        if len(errors) > 0:
+            raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+        if len(rejected) == 0:
+            return
+        pending = rejected
+        if attempt < max_retries:
+            sleep(min(max_backoff, initial_backoff * 2**attempt))
+    raise BulkIndexError(
+        f"{len(pending)} document(s) failed to index.",
+        [{"index": {"status": 429, "data": action}} for action in pending],
+    )
+
+
+def adaptive_streaming_bulk(
+    client: Elasticsearch,
+    actions: Iterable[dict],
+    chunk_size: AdaptiveChunkSize,
+    max_chunk_bytes: int,
+    initial_backoff: float = 2,
+    max_backoff: float = 60,
+    max_retries: int = 5,
+) -> Iterator[tuple[bool, Any]]:
+    """
+    Like Elasticsearch's `streaming_bulk` helper, but send chunks of the size
+    chosen by the adaptive chunk size, which learns from each response.
+    """
+    for chunk, num_bytes in _iter_chunks(client, actions, chunk_size, max_chunk_bytes):
+        yield from _bulk_chunk(
+            client=client,
+            chunk=chunk,
+            num_bytes=num_bytes,
+            chunk_size=chunk_size,
+            initial_backoff=initial_backoff,
+            max_backoff=max_backoff,
+            max_retries=max_retries,
+        )
+
+
+def first_index(actions: Iterable[dict]) -> tuple[str, Iterator[dict]]:
+    """
+    Peek at the index of the first action, e.g., to tell stages apart.
+    """
+    actions_iterator = iter(actions)
+    first = next(actions_iterator, None)
+    if first is None:
+        return "", actions_iterator
+    return first.get("_index", ""), chain((first,), actions_iterator)
@@ -0,0 +1,88 @@
+from signal import SIGINT, SIGTERM, getsignal, signal
+from threading import Event
+from types import FrameType
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from archive_query_log.config import MetricsConfig
+from archive_query_log.utils.metrics import export_metrics
+from archive_query_log.utils.parallel import prefetch_buffer
+
+_T = TypeVar("_T")
+
+_stop = Event()
+
+
+def until_stopped(items: Iterable[_T]) -> Iterator[_T]:
+    """
+    Iterate over the items until the daemon is asked to stop.
+
+    Stages wrap the documents they work on with this, so that on stop, the
+    actions of already processed documents are still flushed to Elasticsearch,
+    but no further documents are processed.
+    """
+    for item in items:
+        if _stop.is_set():
+            return
+        yield item
+
+
+def _request_stop(signum: int, frame: FrameType | None) -> None:
+    print("Stopping after the current document.")
+    _stop.set()
+
+
+def run_daemon(
+    run_batch: Callable[[], int],
+    min_backoff: float = 1,
+    max_backoff: float = 300,
+) -> None:
+    """
+    Repeatedly run a batch of a stage until stopped by SIGTERM (or SIGINT).
+
+    Each batch returns the number of candidate documents it found. If no
+    candidates were found, wait with exponential backoff before the next batch.
+    """
+    previous_handlers = {signum: getsignal(signum) for signum in (SIGTERM, SIGINT)}
+    for signum in previous_handlers:
+        signal(signum, _request_stop)
+    try:
+        backoff = min_backoff
+        while not _stop.is_set():
+            if run_batch() > 0:
+                backoff = min_backoff
+                continue
+            print(f"Backlog is empty, waiting {backoff:.0f} seconds.")
+            _stop.wait(backoff)
+            backoff = min(backoff * 2, max_backoff)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal(signum, handler)
+        _stop.clear()
+
+
+def run_stage(
+    stage: Callable[[int], int],
+    size: int | None = None,
+    prefetch_limit: int | None = None,
+    metrics: MetricsConfig | None = None,
+) -> None:
+    """
+    Run a stage once for the given number of documents (default: 10), or, if a
+    prefetch limit is given instead, as a daemon that repeatedly selects up to
+    that many candidates and reads up to that many items ahead.
+    While running, the stage's metrics are exported as configured.
+    """
+    if size is not None and prefetch_limit is not None:
+        raise ValueError("Either give a size or a prefetch limit, not both.")
+    if metrics is None:
+        metrics = MetricsConfig()
+    with export_metrics(
+        port=metrics.port,
+        path=metrics.path,
+        interval=metrics.interval,
+    ):
+        if prefetch_limit is None:
+            stage(size if size is not None else 10)
+            return
+        with prefetch_buffer(prefetch_limit):
+            run_daemon(lambda: stage(prefetch_limit))
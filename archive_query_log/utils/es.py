@@ -0,0 +1,123 @@
+from datetime import timedelta
+from typing import Any, Iterable, Iterator, TypeVar
+from warnings import warn
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.connections import get_connection
+from elasticsearch_dsl.query import Range
+from elasticsearch_pydantic import BaseDocument
+
+from archive_query_log.config import PartitionConfig
+from archive_query_log.utils.scheduler import FairScheduler
+from archive_query_log.utils.time import utc_now
+
+# How long a claimed document is reserved for the replica that claimed it.
+CLAIM_LEASE = timedelta(hours=1)
+
+_VERSION_FIELDS = {"seq_no", "primary_term"}
+
+_D = TypeVar("_D", bound=BaseDocument)
+
+
+def _without_version(document: _D) -> _D:
+    # Later update actions must not carry the (now outdated) sequence number.
+    fields = document.model_fields_set - _VERSION_FIELDS
+    return document.model_construct(
+        _fields_set=fields,
+        **{field: getattr(document, field) for field in fields},
+    )
+
+
+def claim_documents(
+    client: Elasticsearch,
+    documents: Iterable[_D],
+    claim_field: str,
+    lease: timedelta = CLAIM_LEASE,
+) -> Iterator[_D]:
+    """
+    Claim documents unchanged since they were read, by setting the lease of the
+    given inner document field. Only successfully claimed documents are yielded.
+    """
+    claimed_until = (utc_now() + lease).isoformat()
+    documents_by_id = {str(document.meta.id): document for document in documents}
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": document.meta.index,
+            "_id": document_id,
+            "if_seq_no": document.meta.seq_no,
+            "if_primary_term": document.meta.primary_term,
+            "doc": {claim_field: {"claimed_until": claimed_until}},
+        }
+        for document_id, document in documents_by_id.items()
+    )
+    for ok, item in streaming_bulk(
+        client=client,
+        actions=actions,
+        chunk_size=100,
+        raise_on_error=False,
+    ):
+        result = item["update"]
+        if ok:
+            yield _without_version(documents_by_id[result["_id"]])
+        elif result.get("status") != 409:
+            warn(
+                RuntimeWarning(
+                    f"Could not claim document {result['_id']}: {result.get('error')}"
+                )
+            )
+
+
+def select_documents(
+    search: Search,
+    size: int,
+    partition: PartitionConfig,
+    keep_alive: str = "1m",
+    claim_field: str | None = None,
+    dry_run: bool = False,
+    scheduler: FairScheduler | None = None,
+) -> tuple[int, Iterable[Any]]:
+    """
+    Select the top documents of a search (optionally from this replica's slice,
+    claimed, or fairly scheduled), and estimate the number of all matches.
+    """
+    client = get_connection(search._using)
+    if claim_field is not None:
+        search = search.filter(
+            ~Range(**{f"{claim_field}__claimed_until": {"gt": "now"}})
+        ).extra(seq_no_primary_term=True)
+
+    index = search._index
+    pit: dict | None = None
+    if partition.count > 1:
+        pit = client.open_point_in_time(
+            index=",".join(index),
+            keep_alive=keep_alive,
+        )
+        search = search.index().extra(
+            pit={"id": pit["id"], "keep_alive": keep_alive},
+            slice={"id": partition.index, "max": partition.count},
+        )
+    total: int
+    documents: Iterable[Any]
+    try:
+        if scheduler is not None:
+            total, documents = scheduler.select(search, size=size, index=index)
+        else:
+            response = search.params(size=size).execute()
+            total, documents = response.hits.total.value, response
+    finally:
+        if pit is not None:
+            client.close_point_in_time(body={"id": pit["id"]})
+
+    if total <= 0:
+        return 0, ()
+    if claim_field is not None and not dry_run:
+        documents = claim_documents(
+            client=client,
+            documents=documents,
+            claim_field=claim_field,
+        )
+    return total, documents
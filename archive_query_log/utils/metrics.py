@@ -0,0 +1,333 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter
+from typing import Any, Iterable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+from elasticsearch import Urllib3HttpConnection
+from requests import Response
+
+_T = TypeVar("_T")
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+@dataclass
+class _Histogram:
+    # Number of observations per bucket, the last bucket being unbounded.
+    counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    sum: float = 0
+
+    def observe(self, seconds: float) -> None:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+@dataclass(frozen=True)
+class MetricsDelta:
+    documents: dict[str, int]
+    latencies: dict[tuple[str, str], _Histogram]
+    gauges: dict[tuple[str, str], float]
+
+
+@dataclass
+class Metrics:
+    """
+    Throughput and latency metrics of the stages run by this process.
+
+    Documents are counted per stage. Latencies are recorded per operation
+    (e.g., a parser type, Elasticsearch, S3, or an archive's APIs) and name
+    (e.g., a parser ID, API endpoint, or host). Gauges hold the last value of
+    a setting chosen at runtime, e.g., the bulk chunk size per index.
+    """
+
+    started: float = field(default_factory=monotonic)
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False)
+    _documents: dict[str, int] = field(default_factory=dict, init=False)
+    _latencies: dict[tuple[str, str], _Histogram] = field(
+        default_factory=dict, init=False
+    )
+    _gauges: dict[tuple[str, str], float] = field(default_factory=dict, init=False)
+
+    def count(self, stage: str, documents: int = 1) -> None:
+        with self._lock:
+            self._documents[stage] = self._documents.get(stage, 0) + documents
+
+    def observe(self, operation: str, name: str, seconds: float) -> None:
+        with self._lock:
+            key = (operation, name)
+            if key not in self._latencies:
+                self._latencies[key] = _Histogram()
+            self._latencies[key].observe(seconds)
+
+    def set_gauge(self, metric: str, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[(metric, name)] = value
+
+    def reset(self) -> None:
+        # A new lock, as a forked process may inherit a held lock.
+        self._lock = Lock()
+        self._documents = {}
+        self._latencies = {}
+        self._gauges = {}
+
+    def pop_delta(self) -> "MetricsDelta":
+        """
+        Take the metrics recorded since the last call, e.g., in a worker.
+        """
+        with self._lock:
+            delta = MetricsDelta(
+                documents=self._documents,
+                latencies=self._latencies,
+                gauges=self._gauges,
+            )
+            self._documents = {}
+            self._latencies = {}
+            self._gauges = {}
+        return delta
+
+    def merge(self, delta: "MetricsDelta") -> None:
+        with self._lock:
+            for stage, documents in delta.documents.items():
+                self._documents[stage] = self._documents.get(stage, 0) + documents
+            for key, histogram in delta.latencies.items():
+                if key not in self._latencies:
+                    self._latencies[key] = _Histogram()
+                merged = self._latencies[key]
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.sum += histogram.sum
+            self._gauges.update(delta.gauges)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            uptime = monotonic() - self.started
+            documents: dict[str, Any] = {
+                stage: {
+                    "total": total,
+                    "per_second": total / uptime if uptime > 0 else 0,
+                }
+                for stage, total in self._documents.items()
+            }
+            latencies: dict[str, dict[str, Any]] = {}
+            for (operation, name), histogram in self._latencies.items():
+                latencies.setdefault(operation, {})[name] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count,
+                    "buckets": {
+                        str(bound): count
+                        for bound, count in zip(
+                            (*LATENCY_BUCKETS, "+Inf"), histogram.counts
+                        )
+                    },
+                }
+            gauges: dict[str, dict[str, float]] = {}
+            for (metric, name), value in self._gauges.items():
+                gauges.setdefault(metric, {})[name] = value
+        return {
+            "uptime_seconds": uptime,
+            "documents": documents,
+            "latency_seconds": latencies,
+            "gauges": gauges,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Format the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP aql_uptime_seconds Time since the metrics were started.",
+            "# TYPE aql_uptime_seconds gauge",
+            f"aql_uptime_seconds {monotonic() - self.started}",
+            "# HELP aql_documents_total Documents processed per stage.",
+            "# TYPE aql_documents_total counter",
+        ]
+        with self._lock:
+            for stage, total in sorted(self._documents.items()):
+                lines.append(f'aql_documents_total{{stage="{stage}"}} {total}')
+            lines += [
+                "# HELP aql_latency_seconds Latency per operation and name.",
+                "# TYPE aql_latency_seconds histogram",
+            ]
+            for (operation, name), histogram in sorted(self._latencies.items()):
+                labels = f'operation="{operation}",name="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'aql_latency_seconds_bucket{{{labels},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(f"aql_latency_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"aql_latency_seconds_count{{{labels}}} {cumulative}")
+            for metric in sorted({metric for metric, _ in self._gauges}):
+                lines.append(f"# TYPE aql_{metric} gauge")
+                for (gauge_metric, name), value in sorted(self._gauges.items()):
+                    if gauge_metric == metric:
+                        lines.append(f'aql_{metric}{{name="{_escape(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics of this process, including those of its action pool workers.
+# Metrics recorded with the Ray executor are not included.
+METRICS = Metrics()
+
+
+@contextmanager
+def timed(operation: str, name: str) -> Iterator[None]:
+    """
+    Record the latency of the wrapped block, even if it fails.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(operation, name, perf_counter() - start)
+
+
+def count_documents(stage: str, items: Iterable[_T]) -> Iterator[_T]:
+    """
+    Count the documents that a stage takes for processing.
+    """
+    for item in items:
+        METRICS.count(stage)
+        yield item
+
+
+def _elasticsearch_endpoint(url: str) -> str:
+    # Name requests by their API endpoint, e.g., "_search" or "_bulk".
+    for segment in urlsplit(url).path.split("/"):
+        if segment.startswith("_"):
+            return segment
+    return "other"
+
+
+class TimedUrllib3HttpConnection(Urllib3HttpConnection):
+    """
+    Elasticsearch connection that records the latency of each request.
+    """
+
+    def perform_request(self, method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+        with timed("elasticsearch", _elasticsearch_endpoint(url)):
+            return super().perform_request(method, url, *args, **kwargs)
+
+
+def _start_s3_call(context: dict[str, Any], **_: Any) -> None:
+    context["metrics_start"] = perf_counter()
+
+
+def _end_s3_call(model: Any, context: dict[str, Any], **_: Any) -> None:
+    start = context.pop("metrics_start", None)
+    if start is not None:
+        METRICS.observe("s3", model.name, perf_counter() - start)
+
+
+def time_s3_calls(client: Any) -> None:
+    """
+    Record the latency of each call of a Boto3 S3 client, e.g., "GetObject".
+    """
+    events = client.meta.events
+    events.register("before-call.s3", _start_s3_call, unique_id="metrics-start")
+    events.register("after-call.s3", _end_s3_call, unique_id="metrics-end")
+
+
+def time_http_response(response: Response, *args: Any, **kwargs: Any) -> None:
+    """
+    Record the time until the response headers of an archive's CDX or
+    Memento API were received, per host. Use as a response hook.
+    """
+    url = urlsplit(response.url)
+    operation = "cdx" if "cdx" in url.path.split("/") else "memento"
+    METRICS.observe(operation, url.hostname or "", response.elapsed.total_seconds())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = METRICS.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Do not log each scrape.
+        pass
+
+
+def _dump_metrics(path: Path) -> None:
+    # Replace the file atomically, so that readers never see partial dumps.
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    temporary_path.write_text(dumps(METRICS.to_dict(), indent=2))
+    temporary_path.replace(path)
+
+
+@contextmanager
+def export_metrics(
+    port: int | None = None,
+    path: Path | None = None,
+    interval: float = 60,
+) -> Iterator[int | None]:
+    """
+    Export the metrics while running the wrapped block: serve them at the
+    given port for Prometheus and/or periodically dump them to a JSON file.
+    Yields the port that the metrics are served at.
+    """
+    server: ThreadingHTTPServer | None = None
+    if port is not None:
+        server = ThreadingHTTPServer(("", port), _MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+    stopped = Event()
+    dump_thread: Thread | None = None
+    if path is not None:
+
+        def _dump_periodically() -> None:
+            while not stopped.wait(interval):
+                _dump_metrics(path)
+
+        dump_thread = Thread(target=_dump_periodically, daemon=True)
+        dump_thread.start()
+
+    try:
+        yield server.server_port if server is not None else None
+    finally:
+        stopped.set()
+        if dump_thread is not None and path is not None:
+            dump_thread.join()
+            _dump_metrics(path)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
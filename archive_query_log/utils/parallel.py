@@ -0,0 +1,295 @@
+from asyncio import run, sleep
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import batched, chain
+from multiprocessing import get_context
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import (
+    Any,
+    AsyncIterable,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Literal,
+    TypeAlias,
+    TypeVar,
+)
+
+from archive_query_log.utils.metrics import METRICS, MetricsDelta
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+Executor: TypeAlias = Literal["local", "ray"]
+
+_worker_action: Callable[[Any], Iterable[dict]] | None = None
+
+# How many items background threads read ahead of their consumer by default.
+_buffer_size = 100
+
+
+@contextmanager
+def prefetch_buffer(buffer_size: int) -> Iterator[None]:
+    """
+    Change how many items background threads read ahead by default.
+    """
+    global _buffer_size
+    previous_buffer_size = _buffer_size
+    _buffer_size = buffer_size
+    try:
+        yield
+    finally:
+        _buffer_size = previous_buffer_size
+
+
+def _init_worker(action: Callable[[Any], Iterable[dict]]) -> None:
+    global _worker_action
+    _worker_action = action
+    METRICS.reset()
+
+
+def _apply_batch(items: tuple[_T, ...]) -> tuple[list[dict], MetricsDelta]:
+    if _worker_action is None:
+        raise RuntimeError("Worker was not initialized.")
+    actions = [action for item in items for action in _worker_action(item)]
+    return actions, METRICS.pop_delta()
+
+
+@dataclass(frozen=True)
+class ActionPool:
+    """
+    Pool of forked worker processes that map items to actions.
+    """
+
+    executor: ProcessPoolExecutor
+    workers: int
+
+
+@contextmanager
+def action_pool(
+    action: Callable[[_T], Iterable[dict]],
+    workers: int = 1,
+) -> Iterator[ActionPool | None]:
+    """
+    Fork a pool of workers for the action, once per stage, before any threads
+    are started. With only one worker, no pool is needed.
+    """
+    if workers <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("fork"),
+        initializer=_init_worker,
+        initargs=(action,),
+    ) as executor:
+        # With fork, all workers are started on the first submission.
+        executor.submit(int).result()
+        yield ActionPool(executor=executor, workers=workers)
+
+
+def _map_actions_pool(
+    pool: ActionPool,
+    items: Iterable[_T],
+    batch_size: int,
+) -> Iterator[dict]:
+    pending: deque[Future[tuple[list[dict], MetricsDelta]]] = deque()
+
+    def _pop() -> list[dict]:
+        actions, delta = pending.popleft().result()
+        METRICS.merge(delta)
+        return actions
+
+    for batch in batched(items, batch_size):
+        if len(pending) >= 2 * pool.workers:
+            yield from _pop()
+        pending.append(pool.executor.submit(_apply_batch, batch))
+    while len(pending) > 0:
+        yield from _pop()
+
+
+_END = object()
+
+
+def _put(queue: Queue, item: Any, closed: Event) -> bool:
+    while not closed.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def prefetch(items: Iterable[_T], buffer_size: int | None = None) -> Iterator[_T]:
+    """
+    Iterate over the items in a background thread, up to a number of items
+    ahead of the consumer. Errors of the producer are re-raised in the consumer.
+    """
+    queue: Queue[tuple[Any, BaseException | None]] = Queue(
+        maxsize=buffer_size or _buffer_size
+    )
+    closed = Event()
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put(queue, (item, None), closed):
+                    return
+        except BaseException as error:
+            _put(queue, (_END, error), closed)
+            return
+        _put(queue, (_END, None), closed)
+
+    Thread(target=_produce, name="prefetch", daemon=True).start()
+    yield from _iter_results(queue, closed)
+
+
+def _iter_results(
+    queue: Queue[tuple[Any, BaseException | None]],
+    closed: Event,
+) -> Iterator[Any]:
+    try:
+        while True:
+            item, error = queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        closed.set()
+
+
+def prefetch_async(
+    items: AsyncIterable[_T],
+    buffer_size: int | None = None,
+) -> Iterator[_T]:
+    """
+    Iterate over asynchronous items, produced in an event loop in a background
+    thread, up to a number of items ahead of the consumer.
+    """
+    queue: Queue[tuple[Any, BaseException | None]] = Queue(
+        maxsize=buffer_size or _buffer_size
+    )
+    closed = Event()
+
+    async def _produce() -> None:
+        async for item in items:
+            # Wait for free space without blocking the event loop.
+            while True:
+                if closed.is_set():
+                    return
+                try:
+                    queue.put_nowait((item, None))
+                    break
+                except Full:
+                    await sleep(0.01)
+
+    def _run() -> None:
+        try:
+            run(_produce())
+        except BaseException as error:
+            _put(queue, (_END, error), closed)
+            return
+        _put(queue, (_END, None), closed)
+
+    Thread(target=_run, name="prefetch-async", daemon=True).start()
+    yield from _iter_results(queue, closed)
+
+
+def _iter_queue(queue: Queue, closed: Event) -> Iterator[Any]:
+    while not closed.is_set():
+        try:
+            item = queue.get(timeout=0.1)
+        except Empty:
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def map_partitions(
+    function: Callable[[Iterator[_T]], Iterable[_R]],
+    items: Iterable[_T],
+    key: Callable[[_T], Hashable],
+    partitions: int,
+    buffer_size: int = 100,
+) -> Iterator[_R]:
+    """
+    Apply the function concurrently to partitions of the items by their key,
+    keeping the order within each partition. Results are yielded as completed.
+    """
+    queues: list[Queue] = [Queue(maxsize=buffer_size) for _ in range(partitions)]
+    results: Queue[tuple[Any, BaseException | None]] = Queue(maxsize=buffer_size)
+    closed = Event()
+
+    def _distribute() -> None:
+        try:
+            for item in items:
+                queue = queues[hash(key(item)) % partitions]
+                if not _put(queue, item, closed):
+                    return
+        except BaseException as error:
+            _put(results, (_END, error), closed)
+            return
+        for queue in queues:
+            _put(queue, _END, closed)
+        _put(results, (_END, None), closed)
+
+    def _apply(queue: Queue) -> None:
+        try:
+            for result in function(_iter_queue(queue, closed)):
+                if not _put(results, (result, None), closed):
+                    return
+        except BaseException as error:
+            _put(results, (_END, error), closed)
+            return
+        _put(results, (_END, None), closed)
+
+    Thread(target=_distribute, name="distribute", daemon=True).start()
+    for i, queue in enumerate(queues):
+        Thread(target=_apply, args=(queue,), name=f"partition-{i}", daemon=True).start()
+    try:
+        # Wait until the distributor and all partitions have finished.
+        running = partitions + 1
+        while running > 0:
+            result, error = results.get()
+            if result is _END:
+                if error is not None:
+                    raise error
+                running -= 1
+                continue
+            yield result
+    finally:
+        closed.set()
+
+
+def map_actions(
+    action: Callable[[_T], Iterable[dict]],
+    items: Iterable[_T],
+    pool: ActionPool | None = None,
+    batch_size: int = 10,
+    buffer_size: int | None = None,
+) -> Iterator[dict]:
+    """
+    Map each item to its (bulk) actions, in the same order as the items, in
+    background threads or, if given, in the pool's worker processes.
+    """
+    if pool is None:
+        return prefetch(
+            chain.from_iterable(action(item) for item in prefetch(items, buffer_size)),
+            buffer_size,
+        )
+    return prefetch(
+        _map_actions_pool(
+            pool=pool,
+            items=prefetch(items, buffer_size),
+            batch_size=batch_size,
+        ),
+        buffer_size,
+    )
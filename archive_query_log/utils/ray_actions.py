@@ -0,0 +1,84 @@
+from json import dumps, loads
+from typing import Any, Callable, Iterable, TypeVar
+
+from elasticsearch_dsl.query import Query
+from elasticsearch_pydantic import BaseDocument
+from pandas import DataFrame
+from ray.data import Datasink, Dataset, read_datasource
+from ray.data.block import Block, BlockAccessor
+from ray_elasticsearch import ElasticsearchDatasource, unwrap_documents
+
+from archive_query_log.config import Config, EsConfig
+
+_D = TypeVar("_D", bound=BaseDocument)
+
+
+class _BulkActionsDatasink(Datasink[None]):
+    """
+    Sink that sends serialized bulk actions to Elasticsearch.
+
+    The actions of a single document can differ in their operation and index,
+    so they are passed as JSON strings instead of as columns.
+    """
+
+    def __init__(self, es_config: EsConfig, dry_run: bool = False) -> None:
+        self._es_config = es_config
+        self._dry_run = dry_run
+
+    def write(self, blocks: Iterable[Block], ctx: Any) -> None:
+        self._es_config.bulk(
+            actions=(
+                loads(action)
+                for block in blocks
+                for action in BlockAccessor.for_block(block).to_pandas()["action"]
+            ),
+            dry_run=self._dry_run,
+        )
+
+    @property
+    def supports_distributed_writes(self) -> bool:
+        return True
+
+    def get_name(self) -> str:
+        return "ElasticsearchBulkActions"
+
+
+def bulk_actions_ray(
+    document_type: type[_D],
+    index: str,
+    query: Query,
+    action: Callable[[_D], Iterable[dict]],
+    config: Config,
+    dry_run: bool = False,
+) -> None:
+    """
+    Read all documents matching the query with Ray, map each document to its
+    bulk actions, and write the actions back to Elasticsearch from the workers.
+    """
+
+    datasource = ElasticsearchDatasource(
+        **config.es.client_kwargs,
+        keep_alive="10m",
+        index=index,
+        query=query,
+        schema=document_type,
+    )
+    dataset: Dataset = read_datasource(datasource=datasource)
+
+    @unwrap_documents(document_type)
+    def map_batch(
+        batch: DataFrame,
+        documents: Iterable[_D],
+    ) -> DataFrame:
+        return DataFrame(
+            {
+                "action": [
+                    dumps(document_action, default=str)
+                    for document in documents
+                    for document_action in action(document)
+                ]
+            }
+        )
+
+    dataset = dataset.map_batches(map_batch, batch_format="pandas")
+    dataset.write_datasink(_BulkActionsDatasink(config.es, dry_run))
@@ -0,0 +1,182 @@
+from dataclasses import dataclass, field, replace
+from heapq import heapify, heappop, heappush
+from math import inf
+from time import monotonic
+from typing import Any, Iterable, Mapping, TypeAlias
+
+from elasticsearch_dsl import MultiSearch, Q, Search
+from elasticsearch_dsl.query import Term
+
+from archive_query_log.config import ScheduleConfig
+
+# Backlogs are grouped by archive ID and provider ID.
+BacklogKey: TypeAlias = tuple[str, str]
+
+
+@dataclass(frozen=True)
+class Backlog:
+    weight: float
+    size: int
+
+
+@dataclass
+class FairScheduler:
+    """
+    Weighted fair queueing of work across (archive, provider) backlogs,
+    weighted by the product of the archive's and the provider's priority.
+    """
+
+    max_backlogs: int = 1000
+    # Seconds until the backlogs are aggregated again.
+    refresh_interval: float = 60
+    _backlogs: dict[BacklogKey, Backlog] = field(default_factory=dict, init=False)
+    _backlogs_time: float = field(default=-inf, init=False)
+    # Kept across batches, so that small backlogs are served eventually.
+    _virtual_time: float = field(default=0, init=False)
+    _finish_times: dict[BacklogKey, float] = field(default_factory=dict, init=False)
+
+    def allocate(
+        self,
+        backlogs: Mapping[BacklogKey, Backlog],
+        size: int,
+    ) -> dict[BacklogKey, int]:
+        """
+        Allocate up to the given number of documents to the backlogs.
+        """
+        backlogs = {
+            key: backlog
+            for key, backlog in backlogs.items()
+            if backlog.size > 0 and backlog.weight > 0
+        }
+        # Forget backlogs that are empty now, and let new backlogs start now.
+        self._finish_times = {
+            key: self._finish_times.get(key, self._virtual_time + 1 / backlog.weight)
+            for key, backlog in backlogs.items()
+        }
+        remaining = {key: backlog.size for key, backlog in backlogs.items()}
+        queue = [(finish_time, key) for key, finish_time in self._finish_times.items()]
+        heapify(queue)
+        allocation: dict[BacklogKey, int] = {}
+        for _ in range(size):
+            if len(queue) == 0:
+                break
+            finish_time, key = heappop(queue)
+            weight = backlogs[key].weight
+            self._virtual_time = finish_time - 1 / weight
+            self._finish_times[key] = finish_time + 1 / weight
+            allocation[key] = allocation.get(key, 0) + 1
+            remaining[key] -= 1
+            if remaining[key] > 0:
+                heappush(queue, (self._finish_times[key], key))
+        return allocation
+
+    def backlogs(
+        self,
+        search: Search,
+        index: Iterable[str],
+    ) -> dict[BacklogKey, Backlog]:
+        """
+        Aggregate the backlogs of all documents matching the search's query.
+        """
+        # Plain search (top hits are not complete documents), same PIT slice.
+        request = search.to_dict()
+        aggregation_search = (
+            Search(using=search._using, index=None if "pit" in request else list(index))
+            .query(Q(request.get("query", {"match_all": {}})))
+            .extra(
+                size=0,
+                **{key: request[key] for key in ("pit", "slice") if key in request},
+            )
+        )
+        backlogs: dict[BacklogKey, Backlog] = {}
+        after: dict[str, Any] | None = None
+        while len(backlogs) < self.max_backlogs:
+            page_size = min(100, self.max_backlogs - len(backlogs))
+            page_search = aggregation_search._clone()
+            composite = page_search.aggs.bucket(
+                "backlogs",
+                "composite",
+                size=page_size,
+                sources=[
+                    {"archive": {"terms": {"field": "archive.id"}}},
+                    {"provider": {"terms": {"field": "provider.id"}}},
+                ],
+                **({"after": after} if after is not None else {}),
+            )
+            composite.metric(
+                "priorities",
+                "top_hits",
+                size=1,
+                _source=["archive.priority", "provider.priority"],
+            )
+            result = page_search.execute().aggregations.backlogs
+            for bucket in result.buckets:
+                source = bucket.priorities.hits.hits[0]._source.to_dict()
+                archive_priority = source.get("archive", {}).get("priority")
+                provider_priority = source.get("provider", {}).get("priority")
+                backlogs[(bucket.key.archive, bucket.key.provider)] = Backlog(
+                    weight=(1 if archive_priority is None else archive_priority)
+                    * (1 if provider_priority is None else provider_priority),
+                    size=bucket.doc_count,
+                )
+            after = result.to_dict().get("after_key")
+            if len(result.buckets) < page_size or after is None:
+                break
+        return backlogs
+
+    def select(
+        self,
+        search: Search,
+        size: int,
+        index: Iterable[str],
+    ) -> tuple[int, list[Any]]:
+        """
+        Select documents from the backlogs by weighted fair queueing.
+        Returns the total size of the backlogs and the selected documents.
+        """
+        if monotonic() - self._backlogs_time >= self.refresh_interval:
+            self._backlogs = self.backlogs(search, index)
+            self._backlogs_time = monotonic()
+        total = sum(backlog.size for backlog in self._backlogs.values())
+        allocation = self.allocate(self._backlogs, size)
+        if len(allocation) == 0:
+            return total, []
+        multi_search = MultiSearch(using=search._using)
+        for (archive_id, provider_id), backlog_size in allocation.items():
+            multi_search = multi_search.add(
+                search.filter(
+                    Term(archive__id=archive_id) & Term(provider__id=provider_id)
+                ).extra(size=backlog_size)
+            )
+        documents: list[Any] = []
+        for (key, backlog_size), response in zip(
+            allocation.items(), multi_search.execute()
+        ):
+            documents.extend(response)
+            # Deduct the selected documents until the next refresh.
+            num_documents = len(response.hits)
+            self._backlogs[key] = replace(
+                self._backlogs[key],
+                size=self._backlogs[key].size - num_documents
+                if num_documents >= backlog_size
+                else 0,
+            )
+        return total, documents
+
+
+_schedulers: dict[str, FairScheduler] = {}
+
+
+def get_scheduler(config: ScheduleConfig, name: str) -> FairScheduler | None:
+    """
+    Get the scheduler of a stage, if fair scheduling is enabled.
+    The scheduler is kept for the lifetime of the process, e.g., a daemon.
+    """
+    if not config.fair:
+        return None
+    if name not in _schedulers:
+        _schedulers[name] = FairScheduler(
+            max_backlogs=config.max_backlogs,
+            refresh_interval=config.refresh_interval,
+        )
+    return _schedulers[name]
@@ -1,8 +1,11 @@
 from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Protocol, Iterator
+from io import BytesIO
+from typing import Protocol, Iterator, Mapping
 
+from warcio.archiveiterator import ArchiveIterator
 from warcio.recordloader import ArcWarcRecord
+from warcio.warcwriter import WARCWriter
 from warc_cache import WarcCacheStore, WarcCacheLocation
 from warc_s3 import WarcS3Store, WarcS3Location
 
@@ -45,3 +48,29 @@ class WarcCacheStoreWrapper(WarcStore):
                 )
             )
         )
+
+
+def warc_record_bytes(record: ArcWarcRecord) -> bytes:
+    """
+    Serialize a WARC record (uncompressed), consuming its stream.
+    """
+    buffer = BytesIO()
+    WARCWriter(buffer, gzip=False).write_record(record)
+    return buffer.getvalue()
+
+
+@dataclass(frozen=True)
+class WarcMemoryStore(WarcStore):
+    """
+    Serialized WARC records kept in memory, by file and offset, e.g., to parse
+    records right after downloading them, without reading them back from S3.
+    """
+
+    records: Mapping[tuple[str, int], bytes]
+
+    @contextmanager
+    def read(self, location: WarcLocation) -> Iterator[ArcWarcRecord]:
+        iterator = ArchiveIterator(
+            BytesIO(self.records[(location.file, location.offset)])
+        )
+        yield next(iterator)
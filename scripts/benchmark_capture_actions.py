@@ -0,0 +1,93 @@
+from argparse import ArgumentParser
+from json import dumps
+from timeit import timeit
+from typing import Sequence
+from uuid import UUID
+
+from web_archive_api.cdx import CdxCapture
+
+from archive_query_log.captures import CaptureActions, create_capture
+from archive_query_log.captures.cdx import _read_cdx_text
+from archive_query_log.orm import InnerArchive, InnerProvider, Source
+from archive_query_log.utils.time import utc_now
+
+_SOURCE = Source(
+    id=UUID(int=0),
+    archive=InnerArchive(
+        id=UUID(int=1),
+        cdx_api_url="https://web.archive.org/cdx/search/cdx",
+        memento_api_url="https://web.archive.org/web",
+        priority=1.0,
+    ),
+    provider=InnerProvider(
+        id=UUID(int=2),
+        domain="google.com",
+        url_path_prefix="/search",
+    ),
+)
+
+
+def _cdx_captures(count: int) -> Sequence[CdxCapture]:
+    # Synthetic rows, like a page of the Internet Archive's JSON CDX API.
+    rows: list[list[str]] = [
+        ["urlkey", "timestamp", "original", "mimetype", "statuscode", "digest"]
+        + ["redirect", "robotflags", "length", "offset", "filename"]
+    ]
+    for i in range(count):
+        rows.append(
+            [
+                f"com,google)/search?hl=en&q=query+{i}",
+                f"2020{i % 12 + 1:02d}{i % 28 + 1:02d}"
+                f"{i // 3600 % 24:02d}{i // 60 % 60:02d}{i % 60:02d}",
+                f"https://www.google.com/search?q=query+{i}&hl=en",
+                "text/html",
+                "200",
+                f"DIGEST{i:026d}",
+                "-",
+                "-",
+                str(10_000 + i),
+                str(100_000 * i),
+                f"CRAWL-{i % 100}.warc.gz",
+            ]
+        )
+    return _read_cdx_text(dumps(rows)).captures
+
+
+def _create_capture_actions(cdx_captures: Sequence[CdxCapture]) -> None:
+    # Baseline: construct and serialize a capture document per CDX row.
+    for cdx_capture in cdx_captures:
+        capture = create_capture(_SOURCE, cdx_capture)
+        if capture is not None:
+            capture.index = "captures"
+            capture.create_action()
+
+
+def _capture_actions(cdx_captures: Sequence[CdxCapture]) -> None:
+    capture_actions = CaptureActions(source=_SOURCE, index="captures")
+    last_modified = utc_now()
+    for cdx_capture in cdx_captures:
+        capture_actions.create_action(cdx_capture, last_modified)
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Benchmark building capture create actions from CDX rows."
+    )
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cdx_captures = _cdx_captures(args.rows)
+    num_rows = len(cdx_captures) * args.repeat
+
+    baseline = timeit(lambda: _create_capture_actions(cdx_captures), number=args.repeat)
+    fast = timeit(lambda: _capture_actions(cdx_captures), number=args.repeat)
+    print(
+        f"create_capture + create_action: {num_rows / baseline:,.0f} rows/s, "
+        f"CaptureActions: {num_rows / fast:,.0f} rows/s "
+        f"({baseline / fast:.1f}x speed-up)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from argparse import ArgumentParser
+from statistics import median
+from subprocess import run
+from sys import executable
+from time import perf_counter
+
+_DEFAULT_COMMAND = ("serps", "parse", "url-page", "--help")
+
+
+def _run(command: list[str]) -> float:
+    start = perf_counter()
+    run(command, check=True, capture_output=True)
+    return perf_counter() - start
+
+
+def _import_times(command: list[str], top: int) -> list[tuple[int, str]]:
+    result = run(
+        [executable, "-X", "importtime", *command[1:]],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times: list[tuple[int, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times.append((int(cumulative), name.strip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark the startup time of the CLI.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top-imports", type=int, default=10)
+    parser.add_argument("args", nargs="*", default=list(_DEFAULT_COMMAND))
+    args = parser.parse_args()
+
+    command = [executable, "-m", "archive_query_log", *args.args]
+    # Warm up file system caches and bytecode.
+    _run(command)
+    times = [_run(command) for _ in range(args.repeat)]
+    print(
+        f"{' '.join(args.args)}: "
+        f"median {median(times) * 1e3:.0f} ms, "
+        f"min {min(times) * 1e3:.0f} ms, "
+        f"max {max(times) * 1e3:.0f} ms"
+    )
+
+    if args.top_imports > 0:
+        print("Slowest imports (cumulative):")
+        for cumulative, name in _import_times(command, args.top_imports):
+            print(f"{cumulative / 1e3:8.0f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from timeit import timeit
+from typing import Sequence
+from uuid import UUID
+
+from archive_query_log.orm import Serp
+from archive_query_log.parsers.url_page import URL_PAGE_PARSER_REGISTRY
+from archive_query_log.parsers.url_query import URL_QUERY_PARSER_REGISTRY
+from archive_query_log.parsers.utils.registry import ProviderParserRegistry
+
+_TESTS_DATA_PATH = Path(__file__).parent.parent / "data" / "tests"
+
+
+def _load_urls(data_path: Path) -> Sequence[tuple[UUID, str]]:
+    urls: list[tuple[UUID, str]] = []
+    for path in sorted(data_path.glob("*.jsonl")):
+        with path.open("rt", encoding="utf-8") as file:
+            for line in file:
+                serp = Serp.model_validate_json(line)
+                urls.append((serp.provider.id, serp.capture.url.encoded_string()))
+    return urls
+
+
+def _match_loop(
+    registry: ProviderParserRegistry,
+    urls: Sequence[tuple[UUID, str]],
+) -> None:
+    # Baseline: match each parser's pattern separately, as before.
+    for provider_id, url in urls:
+        [
+            parser
+            for parser in registry.parsers
+            if (parser.provider_id is None or parser.provider_id == provider_id)
+            and (parser.url_pattern is None or parser.url_pattern.match(url))
+        ]
+
+
+def _match_candidates_loop(
+    registry: ProviderParserRegistry,
+    urls: Sequence[tuple[UUID, str]],
+) -> None:
+    for provider_id, url in urls:
+        [
+            parser
+            for parser in registry.candidates(provider_id)
+            if parser.url_pattern is None or parser.url_pattern.match(url)
+        ]
+
+
+def _match_combined(
+    registry: ProviderParserRegistry,
+    urls: Sequence[tuple[UUID, str]],
+) -> None:
+    for provider_id, url in urls:
+        registry.applicable(provider_id, url)
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Benchmark URL pattern matching of the URL query and page parsers."
+    )
+    parser.add_argument("--data-path", type=Path, default=_TESTS_DATA_PATH)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    urls = _load_urls(args.data_path)
+    print(f"Loaded {len(urls)} SERP URLs.")
+
+    for name, registry in (
+        ("url-query", URL_QUERY_PARSER_REGISTRY),
+        ("url-page", URL_PAGE_PARSER_REGISTRY),
+    ):
+        # Warm up lazily built indices and combined patterns.
+        _match_combined(registry, urls)
+
+        loop = timeit(lambda: _match_loop(registry, urls), number=args.repeat)
+        candidates_loop = timeit(
+            lambda: _match_candidates_loop(registry, urls), number=args.repeat
+        )
+        combined = timeit(lambda: _match_combined(registry, urls), number=args.repeat)
+        num_matches = len(urls) * args.repeat
+        print(
+            f"{name}: "
+            f"per-parser loop {loop / num_matches * 1e6:.1f} µs/URL, "
+            f"per-provider loop {candidates_loop / num_matches * 1e6:.1f} µs/URL, "
+            f"combined pattern {combined / num_matches * 1e6:.1f} µs/URL "
+            f"({loop / combined:.1f}x speed-up)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from json import loads
+from typing import Any
+
+from elasticsearch import Transport
+from elasticsearch.serializer import JSONSerializer
+
+from archive_query_log.utils.bulk import AdaptiveChunkSize, adaptive_streaming_bulk
+
+
+class _BulkClient:
+    def __init__(self, num_rejections: int) -> None:
+        self.transport = Transport([{}], serializer=JSONSerializer())
+        self.num_rejections = num_rejections
+        self.chunk_sizes: list[int] = []
+
+    def bulk(self, body: str, **params: Any) -> dict:
+        lines = [loads(line) for line in body.splitlines()]
+        self.chunk_sizes.append(len(lines) // 2)
+        status = 201
+        if self.num_rejections > 0:
+            self.num_rejections -= 1
+            status = 429
+        return {
+            "errors": status != 201,
+            "items": [
+                {"create": {"_id": line["create"]["_id"], "status": status}}
+                for line in lines[::2]
+            ],
+        }
+
+
+def _actions(count: int) -> list[dict]:
+    return [
+        {"_op_type": "create", "_index": "captures", "_id": str(i), "_source": {}}
+        for i in range(count)
+    ]
+
+
+def test_adaptive_chunk_size_grows() -> None:
+    client = _BulkClient(num_rejections=0)
+    chunk_size = AdaptiveChunkSize(size=10, min_size=1, target_latency=60)
+    results = list(
+        adaptive_streaming_bulk(
+            client=client,  # type: ignore[arg-type]
+            actions=_actions(100),
+            chunk_size=chunk_size,
+            max_chunk_bytes=100 * 1024 * 1024,
+        )
+    )
+    assert len(results) == 100
+    assert all(ok for ok, _ in results)
+    assert client.chunk_sizes[:3] == [10, 11, 12]
+    assert chunk_size.size > 10
+
+
+def test_adaptive_chunk_size_shrinks_on_rejection() -> None:
+    client = _BulkClient(num_rejections=1)
+    chunk_size = AdaptiveChunkSize(size=10, min_size=1, target_latency=60)
+    results = list(
+        adaptive_streaming_bulk(
+            client=client,  # type: ignore[arg-type]
+            actions=_actions(10),
+            chunk_size=chunk_size,
+            max_chunk_bytes=100 * 1024 * 1024,
+            initial_backoff=0,
+        )
+    )
+    # The rejected chunk is retried, and the next chunk is smaller.
+    assert len(results) == 10
+    assert client.chunk_sizes == [10, 10]
+    assert chunk_size.size < 10
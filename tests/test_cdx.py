@@ -0,0 +1,463 @@
+from asyncio import CancelledError, run, sleep
+from datetime import datetime
+from json import dumps
+from threading import Thread, current_thread, main_thread
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Iterable, Iterator
+from uuid import UUID
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+from pytest import MonkeyPatch, raises
+from web_archive_api.cdx import CdxCapture, CdxFlag, CdxMatchType
+
+from archive_query_log.captures import (
+    CaptureActions,
+    _bulk_pages,
+    _filter_existing,
+    _iter_captures_actions,
+    _iter_time_ranges,
+    _shard_source_actions,
+    create_capture,
+)
+from archive_query_log.captures.cdx import (
+    AsyncCdxApi,
+    HostLimiter,
+    _read_cdx_text,
+    parse_cdx_line,
+)
+from archive_query_log.captures.filters import CaptureFilter, get_capture_filter
+from archive_query_log.orm import InnerArchive, InnerProvider, Source
+from archive_query_log.utils.time import UTC, utc_now
+
+_HEADER = ["urlkey", "timestamp", "original", "mimetype", "statuscode", "digest"]
+
+
+def _row(i: int) -> list[str]:
+    return [
+        f"com,example)/search?q={i}",
+        f"2020010100000{i}",
+        f"https://example.com/search?q={i}",
+        "text/html",
+        "200",
+        f"DIGEST{i}",
+    ]
+
+
+def test_read_cdx_text_resume_key() -> None:
+    page = _read_cdx_text(dumps([_HEADER, _row(1), _row(2), [], ["next-key"]]))
+    assert [capture.url for capture in page.captures] == [
+        "https://example.com/search?q=1",
+        "https://example.com/search?q=2",
+    ]
+    assert page.resume_key == "next-key"
+
+
+def test_parse_cdx_line_pywb_fields() -> None:
+    capture = parse_cdx_line(
+        {
+            "urlkey": "com,example)/?q=test",
+            "timestamp": "20200101000000",
+            "url": "https://example.com/?q=test",
+            "digest": "ABC",
+            "status": "-",
+            "mime": "text/html",
+            "robotflags": "A G",
+            "source-coll": "coll",
+            "is_fuzzy": "1",
+        }
+    )
+    assert capture.timestamp == datetime(2020, 1, 1, tzinfo=UTC)
+    assert capture.status_code is None
+    assert capture.mimetype == "text/html"
+    assert capture.flags == {CdxFlag.NO_ARCHIVE, CdxFlag.IGNORE}
+    assert capture.source_collection == "coll"
+    assert capture.fuzzy is True
+    with raises(RuntimeError):
+        parse_cdx_line({**dict(zip(_HEADER, _row(1))), "unknown": "value"})
+
+
+def test_async_cdx_api_follows_resume_keys() -> None:
+    async def _handler(request: web.Request) -> web.Response:
+        if "showNumPages" in request.query:
+            # No page count, so that the resume keys are used.
+            return web.Response(status=400)
+        if "resumeKey" not in request.query:
+            return web.json_response([_HEADER, _row(1), [], ["key"]])
+        assert request.query["resumeKey"] == "key"
+        return web.json_response([_HEADER, _row(2)])
+
+    async def _fetch() -> list[str]:
+        app = web.Application()
+        app.router.add_get("/cdx", _handler)
+        async with TestServer(app) as server, ClientSession() as session:
+            cdx_api = AsyncCdxApi(
+                api_url=str(server.make_url("/cdx")),
+                session=session,
+                limiter=HostLimiter(min_interval=0),
+            )
+            return [
+                capture.url
+                async for page in cdx_api.iter_pages(
+                    url="example.com/search",
+                    match_type=CdxMatchType.PREFIX,
+                )
+                for capture in page.captures
+            ]
+
+    assert run(_fetch()) == [
+        "https://example.com/search?q=1",
+        "https://example.com/search?q=2",
+    ]
+
+
+def test_async_cdx_api_resumes_from_page() -> None:
+    requested_pages: list[str] = []
+
+    async def _handler(request: web.Request) -> web.Response:
+        if "showNumPages" in request.query:
+            return web.Response(text="3")
+        if "fl" in request.query:
+            # Selecting fields is not supported.
+            return web.Response(status=400)
+        requested_pages.append(request.query["page"])
+        return web.json_response([_HEADER, _row(int(request.query["page"]))])
+
+    async def _fetch() -> list[int | None]:
+        app = web.Application()
+        app.router.add_get("/cdx", _handler)
+        async with TestServer(app) as server, ClientSession() as session:
+            cdx_api = AsyncCdxApi(
+                api_url=str(server.make_url("/cdx")),
+                session=session,
+                limiter=HostLimiter(min_interval=0),
+            )
+            return [
+                page.page
+                async for page in cdx_api.iter_pages(
+                    url="example.com/search",
+                    match_type=CdxMatchType.PREFIX,
+                    page=1,
+                )
+            ]
+
+    assert run(_fetch()) == [1, 2]
+    assert requested_pages == ["1", "2"]
+
+
+def test_async_cdx_api_counts_filtered_pages() -> None:
+    requested_pages: list[str] = []
+
+    async def _handler(request: web.Request) -> web.Response:
+        if "showNumPages" in request.query:
+            # Fewer pages match the filter.
+            return web.Response(text="1" if "filter" in request.query else "3")
+        requested_pages.append(request.query["page"])
+        return web.json_response([_HEADER, _row(int(request.query["page"]))])
+
+    async def _fetch() -> list[int | None]:
+        app = web.Application()
+        app.router.add_get("/cdx", _handler)
+        async with TestServer(app) as server, ClientSession() as session:
+            cdx_api = AsyncCdxApi(
+                api_url=str(server.make_url("/cdx")),
+                session=session,
+                limiter=HostLimiter(min_interval=0),
+            )
+            return [
+                page.page
+                async for page in cdx_api.iter_pages(
+                    url="example.com/search",
+                    match_type=CdxMatchType.PREFIX,
+                    filters=["statuscode:200"],
+                )
+            ]
+
+    assert run(_fetch()) == [0]
+    assert requested_pages == ["0"]
+
+
+def test_async_cdx_api_requests_extended_fields() -> None:
+    # A pywb-style row, with the extended fields.
+    row = {
+        "urlkey": "com,example)/search?q=1",
+        "timestamp": "20200101000001",
+        "url": "https://example.com/search?q=1",
+        "mime": "text/html",
+        "status": "200",
+        "digest": "DIGEST1",
+        "access": "allow",
+        "collection": "collection",
+        "source": "source.cdxj",
+        "source-coll": "source-collection",
+        "load_url": "https://example.com/load",
+    }
+    aliases = {"original": "url", "mimetype": "mime", "statuscode": "status"}
+
+    async def _handler(request: web.Request) -> web.Response:
+        if "showNumPages" in request.query:
+            return web.Response(status=400)
+        fields = [aliases.get(f, f) for f in request.query["fl"].split(",")]
+        return web.Response(text=dumps({f: row[f] for f in fields if f in row}))
+
+    async def _fetch() -> list[CdxCapture]:
+        app = web.Application()
+        app.router.add_get("/cdx", _handler)
+        async with TestServer(app) as server, ClientSession() as session:
+            cdx_api = AsyncCdxApi(
+                api_url=str(server.make_url("/cdx")),
+                session=session,
+                limiter=HostLimiter(min_interval=0),
+            )
+            return [
+                capture
+                async for page in cdx_api.iter_pages(
+                    url="example.com/search",
+                    match_type=CdxMatchType.PREFIX,
+                )
+                for capture in page.captures
+            ]
+
+    (capture,) = run(_fetch())
+    assert capture.status_code == 200
+    assert capture.access == "allow"
+    assert capture.collection == "collection"
+    assert capture.source == "source.cdxj"
+    assert capture.source_collection == "source-collection"
+
+
+def test_capture_filter() -> None:
+    capture_filter = CaptureFilter(
+        status_codes=(200,),
+        mimetypes=("text/html", "application/xhtml+xml"),
+    )
+    assert capture_filter.cdx_filters == [
+        "statuscode:200",
+        r"mimetype:text/html|application/xhtml\+xml",
+    ]
+    redirect = [*_row(2)[:4], "301", "DIGEST2"]
+    image = [*_row(3)[:3], "image/png", "200", "DIGEST3"]
+    page = _read_cdx_text(dumps([_HEADER, _row(1), redirect, image]))
+    assert [capture_filter.matches(capture) for capture in page.captures] == [
+        True,
+        False,
+        False,
+    ]
+
+
+def test_capture_filter_collapse() -> None:
+    capture_filter = CaptureFilter(collapse_digest=True, collapse_period="day")
+    assert capture_filter.cdx_collapse == ["digest"]
+    same_day = [*_row(1)[:1], "20200101120000", *_row(1)[2:]]
+    other_digest = [*_row(1)[:5], "OTHER"]
+    other_day = [*_row(1)[:1], "20200102000000", *_row(1)[2:]]
+    page = _read_cdx_text(
+        dumps([_HEADER, _row(1), same_day, other_digest, other_day, _row(2)])
+    )
+    keys = [capture_filter.collapse_key(capture) for capture in page.captures]
+    assert keys[0] == keys[1]
+    assert len(set(keys)) == 4
+    assert CaptureFilter().collapse_key(page.captures[0]) is None
+
+
+def test_filter_existing_captures() -> None:
+    ids = [UUID(int=i) for i in range(3)]
+
+    def _mget(index: str, body: dict, _source: bool) -> dict:
+        assert index == "captures"
+        return {
+            "docs": [
+                {"_id": capture_id, "found": capture_id == str(ids[1])}
+                for capture_id in body["ids"]
+            ]
+        }
+
+    config = SimpleNamespace(
+        es=SimpleNamespace(
+            client=SimpleNamespace(mget=_mget), index_captures="captures"
+        )
+    )
+    actions = [{"_id": str(capture_id)} for capture_id in ids]
+    remaining = run(
+        _filter_existing(config, "captures", actions)  # type: ignore[arg-type]
+    )
+    assert remaining == [actions[0], actions[2]]
+
+
+def test_capture_actions_equal_capture_create_action() -> None:
+    source = Source(
+        id=UUID(int=3),
+        archive=InnerArchive(
+            id=UUID(int=1),
+            cdx_api_url="https://web.archive.org/cdx/search/cdx",
+            memento_api_url="https://web.archive.org/web",
+            priority=1.0,
+        ),
+        provider=InnerProvider(
+            id=UUID(int=2), domain="example.com", url_path_prefix="/search"
+        ),
+    )
+    redirect = [*_row(2)[:4], "301", "DIGEST2", "https://example.com/search?q=2+3"]
+    page = _read_cdx_text(
+        dumps([[*_HEADER, "redirect"], [*_row(1), "-"], [*_row(3), "-"], redirect])
+    )
+    last_modified = utc_now()
+    capture_actions = CaptureActions(source=source, index="captures")
+    for cdx_capture in page.captures:
+        capture = create_capture(source, cdx_capture)
+        assert capture is not None
+        capture.last_modified = last_modified
+        capture.index = "captures"
+        assert (
+            capture_actions.create_action(cdx_capture, last_modified)
+            == capture.create_action()
+        )
+
+
+def test_iter_time_ranges() -> None:
+    time_ranges = list(_iter_time_ranges(datetime(1998, 6, 1, tzinfo=UTC), "year"))
+    assert time_ranges == [
+        (None, datetime(1996, 12, 31, 23, 59, 59, tzinfo=UTC)),
+        (
+            datetime(1997, 1, 1, tzinfo=UTC),
+            datetime(1997, 12, 31, 23, 59, 59, tzinfo=UTC),
+        ),
+        (datetime(1998, 1, 1, tzinfo=UTC), datetime(1998, 6, 1, tzinfo=UTC)),
+    ]
+    assert len(list(_iter_time_ranges(datetime(1998, 6, 1, tzinfo=UTC), "month"))) == 30
+
+
+def test_shard_source_actions() -> None:
+    source = Source(
+        id=UUID(int=3),
+        index="sources",
+        archive=InnerArchive(
+            id=UUID(int=1),
+            cdx_api_url="https://web.archive.org/cdx/search/cdx",
+            memento_api_url="https://web.archive.org/web",
+        ),
+        provider=InnerProvider(
+            id=UUID(int=2), domain="example.com", url_path_prefix="/search"
+        ),
+    )
+
+    num_pages_requests: list[dict] = []
+
+    async def _num_pages(**kwargs) -> int:
+        num_pages_requests.append(kwargs)
+        from_timestamp = kwargs.get("from_timestamp")
+        # No captures in 1997.
+        if from_timestamp is not None and from_timestamp.year == 1997:
+            return 0
+        return 1000
+
+    def _mget(index: str, body: dict, _source: bool) -> dict:
+        assert index == "sources"
+        return {"docs": [{"_id": doc_id, "found": False} for doc_id in body["ids"]]}
+
+    config = SimpleNamespace(
+        http=SimpleNamespace(cdx_shard_min_pages=100, cdx_shard_period="year"),
+        es=SimpleNamespace(client=SimpleNamespace(mget=_mget), index_sources="sources"),
+    )
+    cdx_api = SimpleNamespace(num_pages=_num_pages)
+    to_timestamp = datetime(1998, 6, 1, tzinfo=UTC)
+    actions = run(
+        _shard_source_actions(config, cdx_api, source, to_timestamp)  # type: ignore[arg-type]
+    )
+    assert actions is not None
+    *shard_actions, source_action = actions
+    assert [action["shard"] for action in shard_actions] == [
+        {
+            "source_id": str(source.id),
+            "from_timestamp": None,
+            "to_timestamp": "1996-12-31T23:59:59Z",
+        },
+        {
+            "source_id": str(source.id),
+            "from_timestamp": "1998-01-01T00:00:00Z",
+            "to_timestamp": "1998-06-01T00:00:00Z",
+        },
+    ]
+    assert all(action["_index"] == "sources" for action in shard_actions)
+    assert len(num_pages_requests) == 4
+    assert all(
+        request["filters"] == get_capture_filter(source).cdx_filters
+        for request in num_pages_requests
+    )
+    assert source_action["_id"] == str(source.id)
+    assert source_action["doc"]["should_fetch_captures"] is False
+
+
+def test_bulk_pages_writes_creates_before_updates() -> None:
+    calls: list[list[str]] = []
+
+    def _bulk(actions: Iterable[dict], dry_run: bool) -> None:
+        calls.append([action["_op_type"] for action in actions])
+
+    config = SimpleNamespace(es=SimpleNamespace(bulk_concurrency=2, bulk=_bulk))
+    pages = [
+        [{"_op_type": "create"}, {"_op_type": "create"}, {"_op_type": "update"}],
+        [{"_op_type": "update"}],
+    ]
+    _bulk_pages(config, pages)  # type: ignore[arg-type]
+    assert calls == [["create", "create"], ["update"], [], ["update"]]
+
+
+def test_iter_captures_actions_cancels_on_error(monkeypatch: MonkeyPatch) -> None:
+    sources = [
+        Source(
+            id=UUID(int=i),
+            archive=InnerArchive(
+                id=UUID(int=1),
+                cdx_api_url="https://web.archive.org/cdx/search/cdx",
+                memento_api_url="https://web.archive.org/web",
+            ),
+            provider=InnerProvider(
+                id=UUID(int=2), domain="example.com", url_path_prefix="/search"
+            ),
+        )
+        for i in (3, 4)
+    ]
+    source_threads: list[Thread] = []
+    cancelled: list[UUID] = []
+
+    def _iter_sources() -> Iterator[Source]:
+        for source in sources:
+            source_threads.append(current_thread())
+            yield source
+
+    async def _add_captures_actions(
+        config: Any, cdx_api: Any, source: Source
+    ) -> AsyncIterator[list[dict]]:
+        if source.id == sources[0].id:
+            await sleep(0.01)
+            raise ValueError("Failed.")
+        try:
+            # A slow CDX request that is still in flight.
+            await sleep(10)
+            yield [{"_op_type": "create"}]
+        except CancelledError:
+            cancelled.append(source.id)
+            raise
+
+    monkeypatch.setattr(
+        "archive_query_log.captures._add_captures_actions", _add_captures_actions
+    )
+    config = SimpleNamespace(
+        http=SimpleNamespace(
+            cdx_host_concurrency=1,
+            cdx_host_interval=0,
+            cdx_concurrency=2,
+            user_agent="test",
+            max_retries=0,
+        )
+    )
+
+    async def _consume() -> None:
+        async for _ in _iter_captures_actions(config, _iter_sources()):  # type: ignore[arg-type]
+            await sleep(0)
+
+    with raises(ValueError):
+        run(_consume())
+    assert cancelled == [sources[1].id]
+    assert main_thread() not in source_threads
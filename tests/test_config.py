@@ -0,0 +1,14 @@
+from pickle import dumps, loads
+
+from archive_query_log.config import Config
+
+
+def test_config_pickle_without_clients() -> None:
+    config = Config()
+    assert config.es.client is not None
+    assert config.http.session is not None
+
+    unpickled_config = loads(dumps(config))  # noqa: S301
+    assert unpickled_config == config
+    assert "client" not in vars(unpickled_config.es)
+    assert "session" not in vars(unpickled_config.http)
@@ -0,0 +1,43 @@
+from os import getpid, kill
+from signal import SIGTERM
+
+from pytest import raises
+
+from archive_query_log.utils import parallel
+from archive_query_log.utils.daemon import run_daemon, run_stage, until_stopped
+
+
+def test_run_daemon_flushes_on_sigterm() -> None:
+    num_batches = 0
+    processed: list[int] = []
+
+    def run_batch() -> int:
+        nonlocal num_batches
+        num_batches += 1
+        if num_batches == 1:
+            # Empty backlog, so the daemon should back off and try again.
+            return 0
+        for item in until_stopped(range(10)):
+            if item == 3:
+                kill(getpid(), SIGTERM)
+            processed.append(item)
+        return 10
+
+    run_daemon(run_batch, min_backoff=0.01)
+    assert num_batches == 2
+    assert processed == [0, 1, 2, 3]
+
+
+def test_run_stage_prefetch_limit() -> None:
+    batches: list[tuple[int, int]] = []
+
+    def stage(size: int) -> int:
+        batches.append((size, parallel._buffer_size))
+        kill(getpid(), SIGTERM)
+        return size
+
+    run_stage(stage, prefetch_limit=3)
+    assert batches == [(3, 3)]
+    assert parallel._buffer_size == 100
+    with raises(ValueError):
+        run_stage(stage, size=10, prefetch_limit=3)
@@ -0,0 +1,130 @@
+from json import loads
+from typing import Any
+from uuid import uuid4
+
+from elasticsearch import JSONSerializer, Transport
+from elasticsearch_dsl import Search
+
+from archive_query_log.config import PartitionConfig
+from archive_query_log.orm import UuidBaseDocument
+from archive_query_log.utils.es import select_documents
+
+
+class _Client:
+    def __init__(self) -> None:
+        self.searches: list[dict[str, Any]] = []
+        self.closed_pits: list[str] = []
+
+    def open_point_in_time(self, index: str, keep_alive: str) -> dict:
+        assert index == "serps"
+        return {"id": "pit"}
+
+    def close_point_in_time(self, body: dict) -> None:
+        self.closed_pits.append(body["id"])
+
+    def search(self, index: Any = None, **params: Any) -> dict:
+        self.searches.append({"index": index, **params})
+        return {
+            "hits": {
+                "total": {"value": 42, "relation": "eq"},
+                "hits": [],
+            },
+        }
+
+
+def test_select_documents_partitioned() -> None:
+    client = _Client()
+    search = Search(using=client, index="serps")
+    total, documents = select_documents(
+        search,
+        size=10,
+        partition=PartitionConfig(index=2, count=5),
+    )
+    assert total == 42
+    assert list(documents) == []
+    assert client.closed_pits == ["pit"]
+    (request,) = client.searches
+    assert request["index"] is None
+    assert request["size"] == 10
+    assert request["slice"] == {"id": 2, "max": 5}
+    assert request["pit"]["id"] == "pit"
+
+
+class _ClaimClient(_Client):
+    def __init__(self, conflicting_ids: set[str]) -> None:
+        super().__init__()
+        self.transport = Transport([{}], serializer=JSONSerializer())
+        self.conflicting_ids = conflicting_ids
+        self.bulk_actions: list[dict[str, Any]] = []
+
+    def search(self, index: Any = None, **params: Any) -> dict:
+        self.searches.append({"index": index, **params})
+        return {
+            "hits": {
+                "total": {"value": 2, "relation": "eq"},
+                "hits": [
+                    {
+                        "_index": "serps",
+                        "_id": str(id),
+                        "_seq_no": seq_no,
+                        "_primary_term": 1,
+                        "_source": {},
+                    }
+                    for seq_no, id in enumerate(_IDS)
+                ],
+            },
+        }
+
+    def bulk(self, body: str, **params: Any) -> dict:
+        lines = [loads(line) for line in body.splitlines()]
+        actions = [line["update"] for line in lines[::2]]
+        self.bulk_actions.extend(actions)
+        return {
+            "errors": len(self.conflicting_ids) > 0,
+            "items": [
+                {
+                    "update": {
+                        "_index": action["_index"],
+                        "_id": action["_id"],
+                        "status": 409 if action["_id"] in self.conflicting_ids else 200,
+                    }
+                }
+                for action in actions
+            ],
+        }
+
+
+_IDS = (uuid4(), uuid4())
+
+
+def test_select_documents_claimed() -> None:
+    client = _ClaimClient(conflicting_ids={str(_IDS[1])})
+    search = UuidBaseDocument.search(using=client, index="serps")
+    total, documents = select_documents(
+        search,
+        size=10,
+        partition=PartitionConfig(),
+        claim_field="warc_downloader",
+    )
+    assert total == 2
+    (document,) = documents
+    assert document.id == _IDS[0]
+    assert "_seq_no" not in document.update_action()
+
+    (request,) = client.searches
+    assert request["seq_no_primary_term"] is True
+    assert [action["if_seq_no"] for action in client.bulk_actions] == [0, 1]
+
+
+def test_select_documents_claimed_dry_run() -> None:
+    client = _ClaimClient(conflicting_ids=set())
+    search = UuidBaseDocument.search(using=client, index="serps")
+    _, documents = select_documents(
+        search,
+        size=10,
+        partition=PartitionConfig(),
+        claim_field="warc_downloader",
+        dry_run=True,
+    )
+    assert len(list(documents)) == 2
+    assert client.bulk_actions == []
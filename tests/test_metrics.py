@@ -0,0 +1,58 @@
+from json import loads
+from pathlib import Path
+from urllib.request import urlopen
+
+from archive_query_log.utils.metrics import (
+    METRICS,
+    Metrics,
+    _elasticsearch_endpoint,
+    export_metrics,
+    timed,
+)
+
+
+def test_metrics_formats() -> None:
+    metrics = Metrics()
+    metrics.count("parse_serps_url", 3)
+    metrics.observe("elasticsearch", "_bulk", 0.2)
+    metrics.observe("elasticsearch", "_bulk", 100)
+
+    latency = metrics.to_dict()["latency_seconds"]["elasticsearch"]["_bulk"]
+    assert latency["count"] == 2
+    assert latency["buckets"]["0.25"] == 1
+    assert latency["buckets"]["+Inf"] == 1
+
+    text = metrics.to_prometheus()
+    assert 'aql_documents_total{stage="parse_serps_url"} 3' in text
+    assert (
+        'aql_latency_seconds_bucket{operation="elasticsearch",name="_bulk",le="60"} 1'
+        in text
+    )
+    assert (
+        'aql_latency_seconds_bucket{operation="elasticsearch",name="_bulk",le="+Inf"} 2'
+        in text
+    )
+
+
+def test_elasticsearch_endpoint() -> None:
+    assert _elasticsearch_endpoint("/_bulk") == "_bulk"
+    assert _elasticsearch_endpoint("/captures/_search?size=10") == "_search"
+    assert _elasticsearch_endpoint("/captures/_update/123") == "_update"
+
+
+def test_export_metrics(tmp_path: Path) -> None:
+    path = tmp_path / "metrics.json"
+    with export_metrics(port=0, path=path, interval=60):
+        with timed("test_parser", "test"):
+            pass
+    # The final dump is written when the exporter stops.
+    dump = loads(path.read_text())
+    assert dump["latency_seconds"]["test_parser"]["test"]["count"] >= 1
+
+
+def test_serve_metrics() -> None:
+    METRICS.count("test_stage")
+    with export_metrics(port=0) as server_port:
+        with urlopen(f"http://localhost:{server_port}/metrics") as response:
+            text = response.read().decode("utf-8")
+    assert 'aql_documents_total{stage="test_stage"}' in text
@@ -0,0 +1,70 @@
+from asyncio import sleep
+from typing import AsyncIterator, Iterator
+
+from pytest import raises
+
+from archive_query_log.utils.parallel import map_partitions, prefetch, prefetch_async
+
+
+def test_prefetch_keeps_order() -> None:
+    assert list(prefetch(range(1000), buffer_size=10)) == list(range(1000))
+
+
+def test_prefetch_reraises_errors() -> None:
+    def _items() -> Iterator[int]:
+        yield 1
+        raise ValueError("broken")
+
+    items = prefetch(_items(), buffer_size=10)
+    assert next(items) == 1
+    with raises(ValueError, match="broken"):
+        next(items)
+
+
+def test_map_partitions_keeps_order_per_key() -> None:
+    items = [(i % 7, i) for i in range(1000)]
+    results = list(
+        map_partitions(
+            function=lambda partition: partition,
+            items=items,
+            key=lambda item: item[0],
+            partitions=3,
+            buffer_size=10,
+        )
+    )
+    assert sorted(results) == sorted(items)
+    for key in range(7):
+        assert [item for item in results if item[0] == key] == [
+            item for item in items if item[0] == key
+        ]
+
+
+def test_map_partitions_reraises_errors() -> None:
+    def _function(partition: Iterator[int]) -> Iterator[int]:
+        for item in partition:
+            if item == 42:
+                raise ValueError("broken")
+            yield item
+
+    with raises(ValueError, match="broken"):
+        list(
+            map_partitions(
+                function=_function,
+                items=range(100),
+                key=lambda item: item,
+                partitions=4,
+            )
+        )
+
+
+def test_prefetch_async() -> None:
+    async def _items() -> AsyncIterator[int]:
+        for i in range(100):
+            await sleep(0)
+            yield i
+        raise ValueError("broken")
+
+    items = prefetch_async(_items(), buffer_size=10)
+    assert [next(items) for _ in range(100)] == list(range(100))
+    with raises(ValueError, match="broken"):
+        next(items)
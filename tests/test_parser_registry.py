@@ -0,0 +1,204 @@
+from pathlib import Path
+from re import compile as re_compile, IGNORECASE
+from typing import Pattern, Sequence
+from uuid import UUID
+
+from pytest import mark
+
+from archive_query_log.parsers.url_offset import (
+    URL_OFFSET_PARSERS,
+    URL_OFFSET_PARSER_REGISTRY,
+)
+from archive_query_log.parsers.url_page import (
+    URL_PAGE_PARSERS,
+    URL_PAGE_PARSER_REGISTRY,
+)
+from archive_query_log.parsers.url_query import URL_QUERY_PARSER_REGISTRY
+from archive_query_log.parsers.utils.registry import (
+    CombinedUrlPattern,
+    ProviderSpecificParser,
+    ProviderParserRegistry,
+)
+
+from tests import TESTS_DATA_PATH
+from tests.utils import iter_test_serps
+
+_REGISTRIES: Sequence[ProviderParserRegistry] = (
+    URL_QUERY_PARSER_REGISTRY,
+    URL_PAGE_PARSER_REGISTRY,
+    URL_OFFSET_PARSER_REGISTRY,
+)
+_SERPS_PATHS = tuple(sorted(TESTS_DATA_PATH.glob("*.jsonl")))
+
+
+def _expected_candidates(
+    parsers: Sequence[ProviderSpecificParser],
+    provider_id: UUID,
+) -> list[ProviderSpecificParser]:
+    return [
+        parser
+        for parser in parsers
+        if parser.provider_id is None or parser.provider_id == provider_id
+    ]
+
+
+@mark.parametrize(
+    "registry",
+    _REGISTRIES,
+    ids=["url_query", "url_page", "url_offset"],
+)
+def test_registry_candidates_keep_order(registry: ProviderParserRegistry) -> None:
+    for provider_id in registry.provider_ids:
+        assert list(registry.candidates(provider_id)) == _expected_candidates(
+            registry.parsers, provider_id
+        )
+    assert list(registry.candidates(UUID(int=0))) == _expected_candidates(
+        registry.parsers, UUID(int=0)
+    )
+
+
+def test_registry_provider_agnostic_parsers_interleaved() -> None:
+    class _Parser:
+        url_pattern = None
+
+        def __init__(self, provider_id: UUID | None) -> None:
+            self.provider_id = provider_id
+
+    provider_a = UUID(int=1)
+    provider_b = UUID(int=2)
+    parsers = (
+        _Parser(None),
+        _Parser(provider_a),
+        _Parser(provider_b),
+        _Parser(None),
+        _Parser(provider_a),
+    )
+    registry = ProviderParserRegistry(parsers)
+    assert list(registry.candidates(provider_a)) == [
+        parsers[0],
+        parsers[1],
+        parsers[3],
+        parsers[4],
+    ]
+    assert list(registry.candidates(provider_b)) == [
+        parsers[0],
+        parsers[2],
+        parsers[3],
+    ]
+    assert list(registry.candidates(None)) == [parsers[0], parsers[3]]
+
+
+@mark.parametrize("serps_path", _SERPS_PATHS, ids=[p.stem for p in _SERPS_PATHS])
+def test_registry_first_match(serps_path: Path) -> None:
+    for serp in iter_test_serps(serps_path):
+        expected_page = next(
+            (
+                parser.id
+                for parser in URL_PAGE_PARSERS
+                if parser.is_applicable(serp) and parser.parse(serp) is not None
+            ),
+            None,
+        )
+        actual_page = next(
+            (
+                parser.id
+                for parser in URL_PAGE_PARSER_REGISTRY.candidates(serp.provider.id)
+                if parser.is_applicable(serp) and parser.parse(serp) is not None
+            ),
+            None,
+        )
+        assert actual_page == expected_page
+
+        expected_offset = next(
+            (
+                parser.id
+                for parser in URL_OFFSET_PARSERS
+                if parser.is_applicable(serp) and parser.parse(serp) is not None
+            ),
+            None,
+        )
+        actual_offset = next(
+            (
+                parser.id
+                for parser in URL_OFFSET_PARSER_REGISTRY.candidates(serp.provider.id)
+                if parser.is_applicable(serp) and parser.parse(serp) is not None
+            ),
+            None,
+        )
+        assert actual_offset == expected_offset
+
+
+@mark.parametrize("serps_path", _SERPS_PATHS, ids=[p.stem for p in _SERPS_PATHS])
+def test_registry_applicable(serps_path: Path) -> None:
+    for serp in iter_test_serps(serps_path):
+        url = serp.capture.url.encoded_string()
+        for registry in _REGISTRIES:
+            assert list(registry.applicable(serp.provider.id, url)) == [
+                parser
+                for parser in registry.parsers
+                if (
+                    parser.provider_id is None or parser.provider_id == serp.provider.id
+                )
+                and (parser.url_pattern is None or parser.url_pattern.match(url))
+            ]
+
+
+def test_combined_url_pattern_fallback() -> None:
+    class _Parser:
+        provider_id = None
+
+        def __init__(self, url_pattern: Pattern | None) -> None:
+            self.url_pattern = url_pattern
+
+    parsers = (
+        _Parser(re_compile(r"^https?://[^/]+/search\?")),
+        _Parser(re_compile(r"^https?://[^/]+/(s|f)/\1\?")),
+        _Parser(None),
+        _Parser(re_compile(r"^https?://[^/]+/SEARCH\?", IGNORECASE)),
+        _Parser(re_compile(r"^https?://[^/]+/search\?")),
+        _Parser(re_compile(r"^https?://[^/]+/s/")),
+    )
+    pattern = CombinedUrlPattern(parsers)
+    assert list(pattern.match("https://example.com/search?q=test")) == [
+        parsers[0],
+        parsers[2],
+        parsers[3],
+        parsers[4],
+    ]
+    assert list(pattern.match("https://example.com/s/s?q=test")) == [
+        parsers[1],
+        parsers[2],
+        parsers[5],
+    ]
+
+
+def test_combined_url_pattern_host_prefix() -> None:
+    class _Parser:
+        provider_id = None
+
+        def __init__(self, url_pattern: Pattern | None) -> None:
+            self.url_pattern = url_pattern
+
+    parsers = (
+        _Parser(re_compile(r"^https?://[^/]+/search\?")),
+        _Parser(re_compile(r"^https?://[^/]+/?\?")),
+        _Parser(re_compile(r"^https?://[^/]+/s\?|^https?://[^/]+/search")),
+        _Parser(re_compile(r"^https?://[^/]+/[^]|]+/search")),
+        _Parser(re_compile(r"^https?://[^/]+/s(earch)?\?")),
+        _Parser(re_compile(r"^https?://[^/]+/s")),
+    )
+    pattern = CombinedUrlPattern(parsers, min_patterns=1)
+    urls = (
+        "https://example.com/search?q=test",
+        "https://example.com?q=test",
+        "https://example.com/?q=test",
+        "https://example.com/s?q=test",
+        "https://example.com/de/search?q=test",
+        "https://example.com/d|e/search?q=test",
+    )
+    for url in urls:
+        assert list(pattern.match(url)) == [
+            parser
+            for parser in parsers
+            if parser.url_pattern is not None and parser.url_pattern.match(url)
+        ]
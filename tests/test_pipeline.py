@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+from typing import Any, Iterable, Iterator
+from uuid import UUID
+
+from pytest import MonkeyPatch
+from warc_s3 import WarcS3Location, WarcS3Record
+from warcio.recordloader import ArcWarcRecord
+
+from archive_query_log.orm import Capture, Serp
+from archive_query_log.parsers.pipeline import fold_actions, process_captures_serps
+from archive_query_log.parsers.url import parse_serp_url
+from archive_query_log.parsers.warc_query import parse_serp_warc_query_action
+from archive_query_log.utils.warc import WarcMemoryStore, warc_record_bytes
+
+from tests import TESTS_DATA_PATH
+from tests.utils import MockWarcStore, iter_test_serps
+
+
+def test_fold_actions() -> None:
+    actions = fold_actions(
+        [
+            {"_op_type": "update", "_index": "captures", "_id": "1", "doc": {"a": 1}},
+            {"_op_type": "create", "_index": "serps", "_id": "1", "b": 2},
+            {"_op_type": "update", "_index": "serps", "_id": "1", "doc": {"c": 3}},
+            {"_op_type": "update", "_index": "serps", "_id": "2", "doc": {"d": 4}},
+        ]
+    )
+    assert actions == [
+        {"_op_type": "update", "_index": "captures", "_id": "1", "doc": {"a": 1}},
+        {"_op_type": "create", "_index": "serps", "_id": "1", "b": 2, "c": 3},
+        {"_op_type": "update", "_index": "serps", "_id": "2", "doc": {"d": 4}},
+    ]
+
+
+def test_memory_warc_store_parses_like_stored_warc() -> None:
+    serps_path = TESTS_DATA_PATH / "google.jsonl"
+    mock_warc_store = MockWarcStore(serps_path)
+    for serp in iter_test_serps(serps_path):
+        if serp.warc_location is None:
+            continue
+        with mock_warc_store.read(serp.warc_location) as record:
+            memory_warc_store = WarcMemoryStore(
+                records={
+                    (serp.warc_location.file, serp.warc_location.offset): (
+                        warc_record_bytes(record)
+                    )
+                }
+            )
+        expected = list(parse_serp_warc_query_action(serp, mock_warc_store))
+        actual = list(parse_serp_warc_query_action(serp, memory_warc_store))
+        for action in expected + actual:
+            del action["doc"]["warc_query_parser"]["last_parsed"]
+        assert actual == expected
+
+
+def _capture(serp: Serp) -> Capture:
+    return Capture(
+        id=serp.capture.id,
+        index="captures",
+        archive=serp.archive,
+        provider=serp.provider,
+        url=serp.capture.url,
+        url_key="",
+        timestamp=serp.capture.timestamp,
+        status_code=serp.capture.status_code,
+        digest=serp.capture.digest,
+        mimetype=serp.capture.mimetype,
+    )
+
+
+class _WarcS3Store:
+    def __init__(self) -> None:
+        self.target_uris: list[str] = []
+
+    def write(self, records: Iterable[ArcWarcRecord]) -> Iterator[WarcS3Record]:
+        for record in records:
+            offset = len(self.target_uris)
+            self.target_uris.append(record.rec_headers.get_header("WARC-Target-URI"))
+            yield WarcS3Record(
+                record=record,
+                location=WarcS3Location(key="stored.warc.gz", offset=offset, length=1),
+            )
+
+
+def test_process_captures_serps(monkeypatch: MonkeyPatch) -> None:
+    # Yandex SERPs have a WARC query parser, but no result block parsers.
+    serps_path = TESTS_DATA_PATH / "yandex.jsonl"
+    mock_warc_store = MockWarcStore(serps_path)
+    test_serps = [
+        serp
+        for serp in iter_test_serps(serps_path)
+        if serp.warc_location is not None
+        and parse_serp_url(_capture(serp), "serps")[0] is not None
+    ][:3]
+    # The Memento API has no WARC record for the last capture.
+    locations = {serp.capture.id: serp.warc_location for serp in test_serps[:-1]}
+    target_uris: dict[UUID, str] = {}
+
+    def _load_serp_warc(config: Any, serp: Serp) -> Iterator[ArcWarcRecord]:
+        location = locations.get(serp.capture.id)
+        if location is None:
+            return
+        with mock_warc_store.read(location) as record:
+            target_uris[serp.id] = record.rec_headers.get_header("WARC-Target-URI")
+            yield record
+
+    monkeypatch.setattr(
+        "archive_query_log.parsers.pipeline.load_serp_warc", _load_serp_warc
+    )
+    warc_s3_store = _WarcS3Store()
+    config = SimpleNamespace(
+        es=SimpleNamespace(
+            index_serps="serps",
+            index_web_search_result_blocks="web_search_result_blocks",
+            index_special_contents_result_blocks="special_contents_result_blocks",
+        ),
+        s3=SimpleNamespace(
+            endpoint_url=None,
+            bucket_name="serps",
+            warc_s3_store=warc_s3_store,
+        ),
+    )
+    actions = process_captures_serps(
+        config,  # type: ignore[arg-type]
+        [_capture(serp) for serp in test_serps],
+    )
+
+    capture_actions = [action for action in actions if action["_index"] == "captures"]
+    assert [action["_id"] for action in capture_actions] == [
+        str(serp.capture.id) for serp in test_serps
+    ]
+    serp_actions = [action for action in actions if action["_index"] == "serps"]
+    assert len(serp_actions) == 3
+    *stored_serp_actions, unstored_serp_action = serp_actions
+    assert len(warc_s3_store.target_uris) == 2
+    for serp_action in stored_serp_actions:
+        assert serp_action["_op_type"] == "create"
+        location = serp_action["warc_location"]
+        assert location["file"] == "stored.warc.gz"
+        # Each SERP points to its own record, in the order they were written.
+        serp_id = UUID(serp_action["_id"])
+        assert warc_s3_store.target_uris[location["offset"]] == target_uris[serp_id]
+        assert serp_action["warc_downloader"]["should_download"] is False
+        assert serp_action["warc_query_parser"]["should_parse"] is False
+    assert unstored_serp_action["_op_type"] == "create"
+    assert "warc_location" not in unstored_serp_action
+    # Without a record, the SERP is left for the downloader and parsers.
+    assert unstored_serp_action["warc_query_parser"]["should_parse"] is True
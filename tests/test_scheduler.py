@@ -0,0 +1,146 @@
+from typing import Any
+
+from elasticsearch_dsl import Search
+
+from archive_query_log.utils.scheduler import Backlog, FairScheduler
+
+
+def test_allocate_proportional_to_weight() -> None:
+    scheduler = FairScheduler()
+    allocation = scheduler.allocate(
+        {
+            ("archive", "large"): Backlog(weight=3, size=1000),
+            ("archive", "small"): Backlog(weight=1, size=1000),
+        },
+        size=8,
+    )
+    assert allocation == {("archive", "large"): 6, ("archive", "small"): 2}
+
+
+def test_allocate_limited_by_backlog() -> None:
+    scheduler = FairScheduler()
+    allocation = scheduler.allocate(
+        {
+            ("archive", "large"): Backlog(weight=3, size=1000),
+            ("archive", "small"): Backlog(weight=1, size=1),
+        },
+        size=8,
+    )
+    assert allocation == {("archive", "large"): 7, ("archive", "small"): 1}
+
+
+def test_allocate_serves_small_backlogs_across_batches() -> None:
+    scheduler = FairScheduler()
+    backlogs = {
+        ("archive", "large"): Backlog(weight=100, size=1000),
+        ("archive", "small"): Backlog(weight=1, size=1000),
+    }
+    served = [key for _ in range(101) for key in scheduler.allocate(backlogs, size=1)]
+    assert served.count(("archive", "small")) == 1
+
+
+class _Client:
+    def __init__(self, buckets: list[dict[str, Any]]) -> None:
+        self.buckets = buckets
+        self.searches: list[dict[str, Any]] = []
+        self.multi_searches: list[list[dict[str, Any]]] = []
+
+    def search(self, index: Any = None, **params: Any) -> dict:
+        self.searches.append({"index": index, **params})
+        return {
+            "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []},
+            "aggregations": {"backlogs": {"buckets": self.buckets}},
+        }
+
+    def msearch(self, body: list[dict[str, Any]], index: Any = None) -> dict:
+        requests = body[1::2]
+        self.multi_searches.append(requests)
+        return {
+            "responses": [
+                {
+                    "hits": {
+                        "total": {"value": request["size"], "relation": "eq"},
+                        "hits": [
+                            {"_index": "serps", "_id": str(i), "_source": {}}
+                            for i in range(request["size"])
+                        ],
+                    }
+                }
+                for request in requests
+            ]
+        }
+
+
+def _bucket(
+    archive_id: str,
+    provider_id: str,
+    doc_count: int,
+    source: dict[str, Any],
+) -> dict[str, Any]:
+    return {
+        "key": {"archive": archive_id, "provider": provider_id},
+        "doc_count": doc_count,
+        "priorities": {
+            "hits": {
+                "total": {"value": doc_count, "relation": "eq"},
+                "hits": [{"_index": "serps", "_id": "0", "_source": source}],
+            }
+        },
+    }
+
+
+def test_backlogs() -> None:
+    client = _Client(
+        [
+            _bucket("a", "p", 10, {"archive": {"priority": 0}}),
+            _bucket("a", "q", 20, {"provider": {"priority": 2.5}}),
+            _bucket("b", "q", 30, {}),
+        ]
+    )
+    search = Search(using=client, index="serps").extra(
+        pit={"id": "pit", "keep_alive": "1m"},
+        slice={"id": 1, "max": 2},
+    )
+    backlogs = FairScheduler().backlogs(search, index=["serps"])
+    assert backlogs == {
+        ("a", "p"): Backlog(weight=0, size=10),
+        ("a", "q"): Backlog(weight=2.5, size=20),
+        ("b", "q"): Backlog(weight=1, size=30),
+    }
+    (request,) = client.searches
+    assert request["index"] is None
+    assert request["size"] == 0
+    assert request["pit"]["id"] == "pit"
+    assert request["slice"] == {"id": 1, "max": 2}
+
+
+def test_select() -> None:
+    client = _Client(
+        [
+            _bucket("a", "p", 1, {"archive": {"priority": 1}}),
+            _bucket("a", "q", 100, {"archive": {"priority": 1}}),
+        ]
+    )
+    search = Search(using=client, index="serps")
+    scheduler = FairScheduler()
+    total, documents = scheduler.select(search, size=4, index=["serps"])
+    assert total == 101
+    assert len(documents) == 4
+    (requests,) = client.multi_searches
+    assert [request["size"] for request in requests] == [1, 3]
+    assert requests[0]["query"]["bool"]["filter"] == [
+        {
+            "bool": {
+                "must": [
+                    {"term": {"archive.id": "a"}},
+                    {"term": {"provider.id": "p"}},
+                ]
+            }
+        }
+    ]
+
+    # The backlogs are not aggregated again before the refresh interval.
+    total, _ = scheduler.select(search, size=4, index=["serps"])
+    assert total == 97
+    assert len(client.searches) == 1
+    assert [request["size"] for request in client.multi_searches[1]] == [4]
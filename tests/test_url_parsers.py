@@ -0,0 +1,158 @@
+from functools import partial
+from json import dumps
+from pathlib import Path
+from uuid import uuid4
+
+from pytest import mark
+
+from archive_query_log.orm import Capture, Serp, Source
+from archive_query_log.parsers.url import (
+    parse_serp_url,
+    parse_serp_url_action,
+    parse_serps_url_local,
+)
+from archive_query_log.parsers.url_offset import parse_serp_url_offset_action
+from archive_query_log.parsers.url_page import parse_serp_url_page_action
+from archive_query_log.parsers.url_query import parse_serp_url_query_action
+from archive_query_log.utils.metrics import METRICS
+from archive_query_log.utils.parallel import action_pool, map_actions
+
+from tests import TESTS_DATA_PATH
+from tests.utils import iter_test_serps
+
+_SERPS_PATHS = tuple(sorted(TESTS_DATA_PATH.glob("*.jsonl")))
+
+
+def _clean_parser(parser: dict) -> dict:
+    """
+    Remove non-deterministic fields from an inner parser.
+    """
+    return {key: value for key, value in parser.items() if key != "last_parsed"}
+
+
+def _capture(serp: Serp) -> Capture:
+    return Capture(
+        id=serp.capture.id,
+        archive=serp.archive,
+        provider=serp.provider,
+        url=serp.capture.url,
+        url_key="",
+        timestamp=serp.capture.timestamp,
+        status_code=serp.capture.status_code,
+        digest=serp.capture.digest,
+        mimetype=serp.capture.mimetype,
+    )
+
+
+@mark.parametrize("serps_path", _SERPS_PATHS, ids=[p.stem for p in _SERPS_PATHS])
+def test_fused_url_parsers(serps_path: Path) -> None:
+    for serp in iter_test_serps(serps_path):
+        capture = _capture(serp)
+        fused_actions = list(parse_serp_url_action(capture, "serps"))
+        query_actions = list(parse_serp_url_query_action(capture, "serps"))
+        assert len(fused_actions) == len(query_actions)
+        if len(fused_actions) < 2:
+            # No SERP was created.
+            continue
+        serp_action, capture_action = fused_actions
+        assert _clean_parser(capture_action["doc"]["url_query_parser"]) == (
+            _clean_parser(query_actions[1]["doc"]["url_query_parser"])
+        )
+        assert serp_action["url_query"] == query_actions[0]["url_query"]
+
+        page_action, *_ = parse_serp_url_page_action(serp)
+        assert serp_action["url_page"] == page_action["doc"].get("url_page")
+        assert _clean_parser(serp_action["url_page_parser"]) == (
+            _clean_parser(page_action["doc"]["url_page_parser"])
+        )
+
+        offset_action, *_ = parse_serp_url_offset_action(serp)
+        assert serp_action["url_offset"] == offset_action["doc"].get("url_offset")
+        assert _clean_parser(serp_action["url_offset_parser"]) == (
+            _clean_parser(offset_action["doc"]["url_offset_parser"])
+        )
+
+
+def test_local_url_parsers(tmp_path: Path) -> None:
+    serps = list(iter_test_serps(TESTS_DATA_PATH / "google.jsonl"))
+    captures = [_capture(serp) for serp in serps]
+    expected_serps = [
+        serp
+        for serp, _ in (parse_serp_url(capture, "serps") for capture in captures)
+        if serp is not None
+    ]
+    assert len(expected_serps) > 0
+
+    captures_path = tmp_path / "captures.jsonl"
+    with captures_path.open("wt", encoding="utf-8") as file:
+        for capture in captures:
+            file.write(capture.model_dump_json() + "\n")
+    serps_path = tmp_path / "serps.jsonl"
+    parse_serps_url_local(captures_path, serps_path, format="jsonl")
+    actual_serps = list(iter_test_serps(serps_path))
+    assert [serp.id for serp in actual_serps] == [serp.id for serp in expected_serps]
+    assert [serp.url_query for serp in actual_serps] == [
+        serp.url_query for serp in expected_serps
+    ]
+
+    # A CDX file only contains captures of a single source.
+    source = Source(
+        id=uuid4(),
+        archive=serps[0].archive,
+        provider=serps[0].provider,
+    )
+    captures = [
+        capture for capture in captures if capture.provider.id == source.provider.id
+    ]
+    expected_serps = [
+        serp for serp in expected_serps if serp.provider.id == source.provider.id
+    ]
+    cdx_path = tmp_path / "captures.cdx"
+    with cdx_path.open("wt", encoding="utf-8") as file:
+        file.write(" CDX N b a m s k r M S V g\n")
+        for capture in captures:
+            timestamp = capture.timestamp.strftime("%Y%m%d%H%M%S")
+            url = capture.url.encoded_string()
+            if " " in url:
+                # Space-separated CDX lines cannot contain such URLs.
+                file.write(
+                    dumps(
+                        {
+                            "urlkey": "key",
+                            "timestamp": timestamp,
+                            "url": url,
+                            "digest": capture.digest,
+                        }
+                    )
+                    + "\n"
+                )
+                continue
+            file.write(
+                f"key {timestamp} {url} text/html 200 "
+                f"{capture.digest} - - 1234 0 example.warc.gz\n"
+            )
+    parse_serps_url_local(cdx_path, serps_path, format="cdx", source=source)
+    actual_serps = list(iter_test_serps(serps_path))
+    assert [serp.url_query for serp in actual_serps] == [
+        serp.url_query for serp in expected_serps
+    ]
+    assert [serp.url_page for serp in actual_serps] == [
+        serp.url_page for serp in expected_serps
+    ]
+
+
+def test_parallel_url_parsers() -> None:
+    captures = [
+        _capture(serp) for serp in iter_test_serps(TESTS_DATA_PATH / "google.jsonl")
+    ]
+    action = partial(parse_serp_url_action, index_serps="serps")
+    expected_actions = list(map_actions(action, captures))
+    METRICS.reset()
+    with action_pool(action, workers=2) as pool:
+        actual_actions = list(map_actions(action, captures, pool=pool, batch_size=3))
+    # The parser latencies recorded in the workers are merged.
+    parser_latencies = METRICS.to_dict()["latency_seconds"]["url_query_parser"]
+    assert sum(latency["count"] for latency in parser_latencies.values()) > 0
+    assert [(action["_op_type"], action["_id"]) for action in actual_actions] == [
+        (action["_op_type"], action["_id"]) for action in expected_actions
+    ]
@@ -0,0 +1,37 @@
+from pydantic import HttpUrl
+
+from archive_query_log.parsers.utils.url import (
+    ParsedUrl,
+    parse_url_query_parameter,
+    parse_url_fragment_parameter,
+    parse_url_path_segment,
+)
+
+
+def test_parsed_url() -> None:
+    url = ParsedUrl(HttpUrl("https://example.com/search/a%20b/2?q=a+b&q=c&p=1#s=3"))
+    assert url.encoded_string == "https://example.com/search/a%20b/2?q=a+b&q=c&p=1#s=3"
+    assert parse_url_query_parameter("q", url) == "a b"
+    assert parse_url_query_parameter("p", url) == "1"
+    assert parse_url_query_parameter("s", url) is None
+    assert parse_url_fragment_parameter("s", url) == "3"
+    assert parse_url_fragment_parameter("q", url) is None
+    assert parse_url_path_segment(1, url) == "search"
+    assert parse_url_path_segment(2, url) == "a b"
+    assert parse_url_path_segment(4, url) is None
+
+
+def test_parsed_url_same_as_url() -> None:
+    url = HttpUrl("https://example.com/search?q=test&start=10#page=2")
+    parsed_url = ParsedUrl(url)
+    for parameter in ("q", "start", "page"):
+        assert parse_url_query_parameter(parameter, url) == (
+            parse_url_query_parameter(parameter, parsed_url)
+        )
+        assert parse_url_fragment_parameter(parameter, url) == (
+            parse_url_fragment_parameter(parameter, parsed_url)
+        )
+    for segment in range(3):
+        assert parse_url_path_segment(segment, url) == (
+            parse_url_path_segment(segment, parsed_url)
+        )